@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from records.roles import role_for_user_id, role_version_for_user_id, set_role
+
+
+class RoleRefreshToken(RefreshToken):
+    '''
+    Refresh token whose access tokens carry, in signed claims, everything the api needs
+    to authorize a request: the role ('role') and its version ('rv'), the username and the
+    ids of the user's Student/Parent/Teacher records. The claims are looked up when the
+    access token is minted (login and refresh), so access tokens stay short lived
+    (SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']) and never carry a role older than the role cache
+    '''
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user_id = self[api_settings.USER_ID_CLAIM]
+        access['role'] = role_for_user_id(user_id)
+        access['rv'] = role_version_for_user_id(user_id)
+
+        profile = (get_user_model().objects.filter(pk=user_id)
+                   .values('username', 'student_profile', 'parent_profile', 'teacher_profile').first()) or {}
+        access['username'] = profile.get('username', '')
+        access['student_id'] = profile.get('student_profile')
+        access['parent_id'] = profile.get('parent_profile')
+        access['teacher_id'] = profile.get('teacher_profile')
+        return access
+
+
+class RecordsTokenUser(TokenUser):
+    '''Lightweight request.user built from the access token claims, no database row behind it'''
+
+    @cached_property
+    def student_id(self):
+        return self.token.get('student_id')
+
+    @cached_property
+    def parent_id(self):
+        return self.token.get('parent_id')
+
+    @cached_property
+    def teacher_id(self):
+        return self.token.get('teacher_id')
+
+
+def check_role_version(validated_token):
+    '''
+    Rejects tokens minted before the user's last role change. The version comes from the
+    process-local role cache, loaded from UserProfile on a miss (once per ROLE_CACHE_TTL), so
+    a role change made in another process is seen here within ROLE_CACHE_TTL seconds
+    '''
+    user_id = validated_token[api_settings.USER_ID_CLAIM]
+    if validated_token.get('rv') != role_version_for_user_id(user_id):
+        raise AuthenticationFailed('Role changed, log in again.', code='role_changed')
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    '''
+    JWT authentication that builds request.user (a RecordsTokenUser) from the token claims
+    without any query beyond the role version check (one query per user and ROLE_CACHE_TTL).
+    Role changes are handled by the 'rv' role version claim; deactivated users keep access
+    until their access token expires
+    '''
+
+    def get_user(self, validated_token):
+        check_role_version(validated_token)
+        user = super().get_user(validated_token)
+        if 'role' in validated_token:
+            set_role(user, validated_token['role'])
+        return user
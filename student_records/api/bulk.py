@@ -0,0 +1,109 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.response import Response
+from records.views import is_admin
+from records import cache as records_cache
+from records import reference
+from records import changes
+
+
+class BulkCreateMixin:
+    '''
+    Accepts a list payload on create (POST to the list url) and writes it with bulk_create.
+    Rows are validated in one pass with every foreign key resolved by a single IN query per
+    related model; valid rows are inserted in one transaction, upserted on bulk_unique_fields
+    when the model has a natural key, and invalid rows are reported without aborting the batch.
+    Bulk writes are for admins only
+    '''
+    # Natural key of the model for update_conflicts upserts, plain inserts when None
+    bulk_unique_fields = None
+    bulk_max_rows = 5000
+    bulk_batch_size = 500
+
+    def create(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        if not is_admin(request.user):
+            raise PermissionDenied('Only admins can create records in bulk.')
+        rows = request.data
+        if not rows:
+            raise ValidationError('Expected a non-empty list of records.')
+        if len(rows) > self.bulk_max_rows:
+            raise ValidationError(f'At most {self.bulk_max_rows} records can be created at once.')
+
+        valid, errors = self.validate_rows(rows)
+        if valid:
+            self.perform_bulk_create([self.get_queryset().model(**data) for data in valid.values()])
+
+        response_status = status.HTTP_201_CREATED
+        if errors:
+            response_status = status.HTTP_207_MULTI_STATUS if valid else status.HTTP_400_BAD_REQUEST
+        return Response({'count': len(valid), 'errors': errors}, status=response_status)
+
+    def get_related_cache(self, rows):
+        '''{field name: {pk: related object}} for every writable foreign key, one IN query each'''
+        cache = {}
+        for name, field in self.get_serializer().fields.items():
+            if not isinstance(field, PrimaryKeyRelatedField) or field.read_only:
+                continue
+            # Teachers, subjects and classes come from the reference data snapshot
+            if field.get_queryset().model in reference.REFERENCE_MODELS:
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            pks = set()
+            for row in rows:
+                try:
+                    pks.add(pk_field.to_python(row.get(name)))
+                except (TypeError, ValueError, DjangoValidationError):
+                    # Left for the field to report on that row
+                    pass
+            pks.discard(None)
+            cache[name] = field.get_queryset().in_bulk(pks)
+        return cache
+
+    def validate_rows(self, rows):
+        '''Returns ({natural key or index: validated data}, [per-row errors])'''
+        context = self.get_serializer_context()
+        context['related_cache'] = self.get_related_cache([row for row in rows if isinstance(row, dict)])
+
+        valid, errors, seen = {}, [], {}
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors.append({'index': index, 'errors': {'non_field_errors': ['Expected an object.']}})
+                continue
+            serializer = self.get_serializer_class()(data=row, context=context)
+            # Uniqueness is settled by the upsert, not by a query per row
+            serializer.validators = []
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+
+            data = serializer.validated_data
+            key = index
+            if self.bulk_unique_fields:
+                key = tuple(getattr(data.get(name), 'pk', data.get(name)) for name in self.bulk_unique_fields)
+                if key in seen:
+                    errors.append({'index': index, 'errors': {'non_field_errors': [f'Duplicate of record {seen[key]} in this batch.']}})
+                    continue
+                seen[key] = index
+            valid[key] = data
+        return valid, errors
+
+    def perform_bulk_create(self, objs):
+        model = self.get_queryset().model
+        with transaction.atomic():
+            if self.bulk_unique_fields:
+                # Every other column is overwritten on conflict, updated_at (auto_now) included
+                update_fields = [field.name for field in model._meta.concrete_fields
+                                 if not field.primary_key and field.name not in self.bulk_unique_fields
+                                 and not getattr(field, 'auto_now_add', False)]
+                changes.upsert(model, objs, self.bulk_unique_fields, update_fields, batch_size=self.bulk_batch_size)
+            else:
+                model.objects.bulk_create(objs, batch_size=self.bulk_batch_size)
+                if model in changes.SYNCED:
+                    changes.record(model, objs)
+            # bulk_create sends no post_save
+            records_cache.bump_objects(model, objs)
@@ -0,0 +1,32 @@
+from rest_framework.response import Response
+from records.conditional import list_validators, detail_validators, not_modified, set_validators
+
+
+class ConditionalGetMixin:
+    '''
+    ETag and Last-Modified on the list and detail responses of a viewset. A request whose
+    If-None-Match/If-Modified-Since still matches gets a 304 before anything is serialized.
+    The validators are computed from the role-scoped queryset, and the path, format and user
+    are part of the ETag
+    '''
+
+    def get_shown_with(self):
+        '''Models shown in the response beyond SHOWN_WITH (records/conditional.py)'''
+        return ()
+
+    def list(self, request, *args, **kwargs):
+        parts = (request.get_full_path(), request.accepted_renderer.format, request.user.pk)
+        etag, last_modified = list_validators(self.filter_queryset(self.get_queryset()), *parts, shown_with=self.get_shown_with())
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        parts = (request.get_full_path(), request.accepted_renderer.format, request.user.pk)
+        etag, last_modified = detail_validators(instance, *parts, shown_with=self.get_shown_with())
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = Response(self.get_serializer(instance).data)
+        return set_validators(response, etag, last_modified)
@@ -0,0 +1,96 @@
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
+from rest_framework.exceptions import ValidationError
+from .serializers import expandable_serializer
+
+
+def parse_expand(value, serializer_class, max_depth):
+    '''{name: {nested expansions}} of "grade.teacher,parents", a 400 for anything serializer_class cannot expand'''
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        names = path.split('.')
+        if len(names) > max_depth:
+            raise ValidationError({'expand': [f'"{path}" is nested more than {max_depth} levels deep.']})
+        node, current = tree, serializer_class
+        for name in names:
+            if name not in current.expandable_fields:
+                raise ValidationError({'expand': [f'"{path}" cannot be expanded.']})
+            node = node.setdefault(name, {})
+            current = expandable_serializer(current.expandable_fields[name][0])
+    return tree
+
+
+def viewset_for_model(model):
+    '''The viewset of api/urls.py serving model'''
+    from .urls import router
+    for prefix, viewset, basename in router.registry:
+        if viewset.serializer_class.Meta.model is model:
+            return viewset
+    raise LookupError(f'No viewset serves {model.__name__}')
+
+
+class ExpandMixin:
+    '''
+    ?expand=grade.teacher,parents,performance on the list and detail responses of a viewset:
+    the related records are nested in each record, as their own viewset serializes them.
+    Every edge of the expansion is loaded with one prefetch for the whole page, from the
+    queryset the related model's viewset scopes to the user, so nothing outside the user's
+    role scope is expanded. To-many relations bring the expand_limit most recent rows of each record
+    '''
+    expand_actions = ('list', 'retrieve')
+    expand_limit = 20
+    expand_max_depth = 3
+
+    def get_expand(self):
+        '''The expansion tree of the request, {} when there is none'''
+        if self.action not in self.expand_actions or 'expand' not in self.request.query_params:
+            return {}
+        if getattr(self, '_expand', None) is None:
+            self._expand = parse_expand(self.request.query_params['expand'], self.get_serializer_class(), self.expand_max_depth)
+        return self._expand
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = self.get_expand()
+        return context
+
+    def expanded_edges(self, serializer_class, model, tree, prefix=''):
+        '''(prefetch lookup, relation field) of every edge of tree, outer edges first'''
+        for name, nested in tree.items():
+            serializer_name, source, many = serializer_class.expandable_fields[name]
+            field = model._meta.get_field(source)
+            yield prefix + source, field
+            yield from self.expanded_edges(expandable_serializer(serializer_name), field.related_model, nested, f'{prefix}{source}__')
+
+    def get_expanded_models(self):
+        '''Models of the records nested in the response'''
+        tree = self.get_expand()
+        if not tree:
+            return ()
+        model = self.get_serializer_class().Meta.model
+        return tuple({field.related_model for lookup, field in self.expanded_edges(self.get_serializer_class(), model, tree)})
+
+    def get_shown_with(self):
+        return super().get_shown_with() + self.get_expanded_models()
+
+    def get_expand_prefetch(self, lookup, field):
+        '''One prefetch of the related records the user may see'''
+        viewset = viewset_for_model(field.related_model)(request=self.request, args=(), kwargs={}, format_kwarg=None, action='list')
+        queryset = viewset.get_queryset()
+        if field.one_to_many and self.expand_limit:
+            # Most recent first, by the order of the related list, ranked per record in the same query
+            ordering = ['-' + name for name in getattr(viewset.pagination_class, 'ordering', ('pk',))]
+            queryset = (queryset.annotate(expand_rank=Window(RowNumber(), partition_by=F(field.field.attname), order_by=ordering))
+                        .filter(expand_rank__lte=self.expand_limit).order_by(*ordering))
+        return Prefetch(lookup, queryset=queryset)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        tree = self.get_expand()
+        if not tree:
+            return queryset
+        edges = self.expanded_edges(self.get_serializer_class(), queryset.model, tree)
+        return queryset.prefetch_related(*[self.get_expand_prefetch(lookup, field) for lookup, field in edges])
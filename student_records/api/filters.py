@@ -0,0 +1,77 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+from records.views import is_student, is_parent
+
+
+class ParentLookupFilter(BaseFilterBackend):
+    '''
+    Restricts a viewset listing the records of one parent record, e.g. for
+    /api/students/<id>/attendance/, to the rows of view.parent_lookup ({'student': 12})
+    '''
+    def filter_queryset(self, request, queryset, view):
+        parent_lookup = getattr(view, 'parent_lookup', None)
+        return queryset.filter(**parent_lookup) if parent_lookup else queryset
+
+
+def leading_columns(model):
+    '''Names of the fields some index of model starts with: composite indexes, unique constraints, keys and db_index fields'''
+    columns = {field.name for field in model._meta.concrete_fields if field.primary_key or field.unique or field.db_index}
+    for index in model._meta.indexes:
+        columns.add(index.fields[0].lstrip('-'))
+    for constraint in model._meta.constraints:
+        if getattr(constraint, 'fields', None):
+            columns.add(constraint.fields[0])
+    for fields in model._meta.unique_together:
+        columns.add(fields[0])
+    return columns
+
+
+class DeclaredFilterBackend(BaseFilterBackend):
+    '''
+    Query parameter filters declared by each viewset in query_filters, parameter -> ORM lookup,
+    e.g. {'term': 'term', 'date_after': 'date__gte'}. Values are parsed by the model field, a 400
+    otherwise. On the viewsets of the big tables (filters_require_index) a combination of
+    filters is only accepted when one of them enters an index: it filters the leading column of
+    an index of the model. Rows already narrowed to a few students, the records of a student or
+    parent user or of /api/students/<id>/..., are accepted with any combination
+    '''
+    def get_filters(self, request, view, model):
+        '''{lookup: value} of the declared parameters present in the request'''
+        filters, errors = {}, {}
+        for param, lookup in getattr(view, 'query_filters', {}).items():
+            if param not in request.query_params:
+                continue
+            field = model._meta.get_field(lookup.split('__')[0])
+            try:
+                value = (field.target_field if field.is_relation else field).to_python(request.query_params[param])
+                if value is None and not field.null:
+                    raise DjangoValidationError('missing')
+            except DjangoValidationError:
+                errors[param] = ['Enter a valid value.']
+                continue
+            filters[lookup] = value
+        if errors:
+            raise ValidationError(errors)
+        return filters
+
+    def check_indexed(self, request, view, model, filters):
+        if not getattr(view, 'filters_require_index', False) or getattr(view, 'parent_lookup', None):
+            return
+        if is_student(request.user) or is_parent(request.user):
+            return
+        indexed = leading_columns(model)
+        if any(lookup.split('__')[0] in indexed for lookup in filters):
+            return
+        usable = sorted(param for param, lookup in view.query_filters.items() if lookup.split('__')[0] in indexed)
+        raise ValidationError({'filters': [f'This combination of filters is not index-backed, add one of: {", ".join(usable)}.']})
+
+    def filter_queryset(self, request, queryset, view):
+        # Lists only: the parameters of /api/students/<id>/attendance/ filter the attendance, not the student
+        if getattr(view, 'detail', False):
+            return queryset
+        filters = self.get_filters(request, view, queryset.model)
+        if not filters:
+            return queryset
+        self.check_indexed(request, view, queryset.model, filters)
+        return queryset.filter(**filters)
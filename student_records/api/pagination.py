@@ -0,0 +1,162 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    '''
+    Cursor (keyset) pagination over a composite, index-backed ordering.
+    The cursor holds the ordering values of the last row seen and the next page
+    is fetched with a (col1, col2, ..., id) > (...) seek predicate, so deep pages
+    cost the same as the first page: no OFFSET scan and no COUNT(*)
+    '''
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    # Must end with a unique column so that every row has a distinct position
+    ordering = ('id',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.fields = [queryset.model._meta.get_field(name) for name in self.ordering]
+
+        position, self.reverse = self.decode_cursor(request)
+        if self.reverse:
+            queryset = queryset.order_by(*['-' + name for name in self.ordering])
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            queryset = queryset.filter(self.seek_filter(position, self.reverse))
+
+        # Fetch one extra row to know whether there is another page after this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        '''Page size from the query string, clamped to max_page_size'''
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def seek_filter(self, position, reverse=False):
+        '''
+        Build (a, b, c) > (x, y, z) as a >= x AND (a > x OR (a = x AND b > y) OR ...)
+        The leading range on the first column lets the database seek the index
+        '''
+        names = [field.attname for field in self.fields]
+        op = 'lt' if reverse else 'gt'
+        first_op = 'lte' if reverse else 'gte'
+
+        branches = []
+        for i, name in enumerate(names):
+            equal = {prev: position[j] for j, prev in enumerate(names[:i])}
+            branches.append(Q(**equal, **{f'{name}__{op}': position[i]}))
+        return Q(**{f'{names[0]}__{first_op}': position[0]}) & reduce(or_, branches)
+
+    def position_of(self, row):
+        '''Ordering values of a row, encoded to JSON-safe strings'''
+        position = []
+        for field in self.fields:
+            value = row[field.attname] if isinstance(row, dict) else getattr(row, field.attname)
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return position
+
+    def decode_cursor(self, request):
+        '''Returns (position, reverse) for the cursor in the request, or (None, False)'''
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if not isinstance(data['p'], list) or len(data['p']) != len(self.fields):
+                raise ValueError('cursor does not match ordering')
+            position = [field.to_python(value) for field, value in zip(self.fields, data['p'])]
+            # The ordering columns are not null, and a None cannot be compared in seek_filter
+            if None in position:
+                raise ValueError('cursor has an empty position')
+            return position, bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeError, AttributeError, DjangoValidationError):
+            # A tampered or stale cursor is a bad request
+            raise ParseError(self.invalid_cursor_message)
+
+    def encode_cursor(self, position, reverse):
+        data = {'p': position}
+        if reverse:
+            data['r'] = 1
+        encoded = urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            # Reversed past the start of the collection; restart from the beginning
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.position_of(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class AttendanceCursorPagination(KeysetCursorPagination):
+    '''Attendance pages in (date, id) order'''
+    ordering = ('date', 'id')
+
+
+class AcademicTermCursorPagination(KeysetCursorPagination):
+    '''Performance/Invoice pages in (academic_year, term, id) order'''
+    ordering = ('academic_year', 'term', 'id')
+
+
+class PaymentCursorPagination(KeysetCursorPagination):
+    '''Payment pages in (payment_date, id) order'''
+    ordering = ('payment_date', 'id')
+
+
+class EnrollmentCursorPagination(KeysetCursorPagination):
+    '''Enrollment pages in (date_enrolled, id) order'''
+    ordering = ('date_enrolled', 'id')
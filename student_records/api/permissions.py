@@ -1,6 +1,22 @@
-from rest_framework.permissions import BasePermission
+from rest_framework.permissions import BasePermission, SAFE_METHODS
 from records.views import is_admin, is_student, is_teacher, is_parent
-from records.models import Teacher, Payment, Invoice
+from records.models import Student, Teacher, Parent, Payment, Invoice, StudentAccess
+from records.roles import visible_parents
+
+
+def has_student_access(user, obj):
+    '''
+    Checks obj belongs to a student in the user's StudentAccess rows,
+    a single indexed lookup whatever the relation chain from obj to the student
+    '''
+    access = StudentAccess.objects.filter(user_id=user.pk)
+    if isinstance(obj, Student):
+        return access.filter(student_id=obj.pk).exists()
+    elif isinstance(obj, Payment):
+        return access.filter(student__invoices=obj.invoice_id).exists()
+    elif hasattr(obj, 'student_id'):
+        return access.filter(student_id=obj.student_id).exists()
+    return False
 
 class AllRecordsPermission(BasePermission):
     """
@@ -27,11 +43,11 @@ class AllRecordsPermission(BasePermission):
 
         # For student: can access their own records and Methods are GET, HEAD, OPTIONS
         if is_student(user):
-            if hasattr(obj, 'student') and obj.student.user == user:
-                '''Indirect relationship'''
+            if has_student_access(user, obj):
+                '''Student object itself or indirect relationship, through StudentAccess'''
                 return method in ['GET', 'HEAD', 'OPTIONS']
-            elif hasattr(obj, 'user') and obj.user == user:
-                '''Direct relationship- student object itself'''
+            elif isinstance(obj, Parent) and visible_parents(user).filter(pk=obj.pk).exists():
+                '''Their own parents/guardians, as listed'''
                 return method in ['GET', 'HEAD', 'OPTIONS']
             elif isinstance(obj, Teacher):
                 '''Allow students to see all Teacher records'''
@@ -42,10 +58,10 @@ class AllRecordsPermission(BasePermission):
 
         # For parents: can access their own records and own children's records, Methods are GET, HEAD, OPTIONS
         if is_parent(user):
-            if hasattr(obj, 'student') and obj.student.parents.filter(parent__user=user).exists():
-                '''Indirect relationship'''
+            if has_student_access(user, obj):
+                '''Children's records, through StudentAccess'''
                 return method in ['GET', 'HEAD', 'OPTIONS']
-            elif hasattr(obj, 'user') and obj.user == user:
+            elif hasattr(obj, 'user_id') and obj.user_id == user.pk:
                 '''Direct relationship- parent object itself'''
                 return method in ['GET', 'HEAD', 'OPTIONS']
             elif isinstance(obj, Teacher):
@@ -60,7 +76,7 @@ class AllRecordsPermission(BasePermission):
         if is_teacher(user):
             if isinstance(obj, (Payment, Invoice)):
                 return False
-            elif hasattr(obj, 'user') and obj.user == user:
+            elif hasattr(obj, 'user_id') and obj.user_id == user.pk:
                 '''Direct relationship- teacher object itself'''
                 return method in ['GET', 'HEAD', 'OPTIONS']
             else:
@@ -68,3 +84,31 @@ class AllRecordsPermission(BasePermission):
 
         # default if does not meet authentication and permissions
         return False
+
+
+class TeacherOrAdminPermission(BasePermission):
+    """Staff-only actions (gradebook): admins and teachers, finer checks are left to the action"""
+
+    def has_permission(self, request, view):
+        return is_admin(request.user) or is_teacher(request.user)
+
+
+class ClassTeacherPermission(TeacherOrAdminPermission):
+    """
+    Class-wide actions on a Grade (roll call).
+    Admin: read and write
+    Teacher: read any class, write only the classes they are the class teacher of
+    """
+
+    def has_object_permission(self, request, view, obj):
+        user = request.user
+        if is_admin(user):
+            return True
+        if request.method in SAFE_METHODS:
+            return True
+        if obj.teacher_id is None:
+            return False
+        if getattr(user, 'teacher_id', None) is not None:
+            # JWT user, the teacher id is a signed claim
+            return obj.teacher_id == user.teacher_id
+        return Teacher.objects.filter(pk=obj.teacher_id, user_id=user.pk).exists()
@@ -0,0 +1,146 @@
+import datetime
+from operator import itemgetter
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from records import reference
+from student_records.profiling import profiled
+from .serializers import ReferenceNameField
+from .sparse import PROPERTY_COLUMNS
+
+
+def column_reader(model, source_attrs):
+    '''
+    (values() paths, function of a values() row giving the attribute) of a serializer field
+    source: a column of model, a property computed from its columns (PROPERTY_COLUMNS), or
+    either of those on a row a non-null foreign key reaches. None for anything else
+    '''
+    path = []
+    last = len(source_attrs) - 1
+    for i, attr in enumerate(source_attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            columns = PROPERTY_COLUMNS.get(model, {}).get(attr)
+            if columns is None or i != last:
+                return None
+            paths = ['__'.join(path + [column]) for column in columns]
+            compute = getattr(model, attr).fget
+            return paths, lambda row: compute(SimpleNamespace(**{column: row[p] for column, p in zip(columns, paths)}))
+        if not field.concrete or field.many_to_many:
+            return None
+        if i == last:
+            key = '__'.join(path + [field.attname])
+            return [key], itemgetter(key)
+        # A missing row in the middle of the path is not read the way DRF reads it
+        if not field.is_relation or field.null:
+            return None
+        path.append(field.name)
+        model = field.related_model
+    return None
+
+
+def datetime_converter(field):
+    '''DateTimeField.to_representation of aware datetimes, in the timezone of the request resolved once'''
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if field_timezone is None or not isinstance(output_format, str) or output_format.lower() != ISO_8601:
+        return field.to_representation
+
+    def convert(value):
+        if value.tzinfo is None:
+            return field.to_representation(value)
+        text = value.astimezone(field_timezone).isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+def converter(field):
+    '''
+    field.to_representation of a column value, compiled once: the common field types skip DRF's
+    per-value checks, anything else goes through the field itself
+    '''
+    if isinstance(field, serializers.ChoiceField) and not isinstance(field, serializers.MultipleChoiceField):
+        choices = field.choice_strings_to_values
+        return lambda value: choices.get(str(value), value)
+    if type(field) is serializers.IntegerField:
+        return int
+    if isinstance(field, serializers.CharField):
+        return str
+    if type(field) is serializers.BooleanField:
+        return bool
+    output_format = getattr(field, 'format', api_settings.DATE_FORMAT)
+    if type(field) is serializers.DateField and isinstance(output_format, str) and output_format.lower() == ISO_8601:
+        return datetime.date.isoformat
+    if type(field) is serializers.DateTimeField:
+        return datetime_converter(field)
+    if (type(field) is serializers.DecimalField and not field.localize and field.decimal_places is not None
+            and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)):
+        quantize = field.quantize
+        return lambda value: '{:f}'.format(quantize(value))
+    if isinstance(field, ReferenceNameField):
+        # The names of the request's reference snapshot, rather than a snapshot lookup per row
+        names = {pk: field.to_representation(pk) for pk in reference.snapshot(field.context.get('request')).by_id[field.model]}
+        return names.get
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return lambda value: value
+    return field.to_representation
+
+
+class ValuesListMixin:
+    '''
+    Read-only path of the list action: rows are fetched with values(), only the columns the
+    serializer fields read, and turned into the same JSON as the serializer by a reader and a
+    converter per field, compiled once per request. Lists whose fields need the serializer
+    (records nested by ?expand=, many-to-many ids, computed fields) are serialized as before
+    '''
+    # Off to always serialize lists with the serializer
+    fast_list = True
+
+    def get_row_plan(self):
+        '''[(name, values() paths, reader, converter)] of the list's fields, None when one needs the serializer'''
+        serializer = self.get_serializer()
+        model = serializer.Meta.model
+        plan = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, (serializers.BaseSerializer, ManyRelatedField)) or field.source == '*':
+                return None
+            read = column_reader(model, field.source_attrs)
+            if read is None:
+                return None
+            plan.append((name, read[0], read[1], converter(field)))
+        return plan
+
+    def convert_rows(self, plan, rows):
+        '''The serializer's representation of values() rows'''
+        fields = [(name, reader, convert) for name, paths, reader, convert in plan]
+        data = []
+        with profiled('serialize'):
+            for row in rows:
+                item = {}
+                for name, reader, convert in fields:
+                    value = reader(row)
+                    item[name] = None if value is None else convert(value)
+                data.append(item)
+        return data
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_row_plan() if self.fast_list else None
+        if plan is None:
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        # The primary key and the keyset pagination order are read back from the rows
+        columns = {queryset.model._meta.pk.attname, *getattr(self.pagination_class, 'ordering', ())}
+        for name, paths, reader, convert in plan:
+            columns.update(paths)
+        rows = queryset.prefetch_related(None).values(*columns)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response(self.convert_rows(plan, rows))
+        return self.get_paginated_response(self.convert_rows(plan, page))
@@ -2,6 +2,12 @@ from rest_framework import serializers
 from accounts.models import CustomUser
 from records.models import Student, Teacher, Parent, Grade, Subject, Performance, Attendance, Invoice, Payment, Enrollment
 from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from records import reference
+from student_records.profiling import profiled
+from .authentication import RoleRefreshToken
+from .sparse import trim_fields
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password1 = serializers.CharField(write_only=True, required=True, validators=[validate_password])
@@ -29,52 +35,203 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         user.save()
         return user
 
-class StudentSerializer(serializers.ModelSerializer):
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    '''
+    PrimaryKeyRelatedField that resolves ids from context['related_cache'][field_name] when the
+    view provides it, so a bulk write looks each related model up with one IN query for the batch
+    '''
+    def to_internal_value(self, data):
+        cache = self.context.get('related_cache', {}).get(self.field_name)
+        model = self.get_queryset().model
+        if cache is None and model in reference.REFERENCE_MODELS:
+            cache = reference.snapshot(self.context.get('request')).by_id[model]
+        if cache is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = model._meta.pk.to_python(data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in cache:
+            self.fail('does_not_exist', pk_value=data)
+        return cache[pk]
+
+
+class ReferenceNameField(serializers.ReadOnlyField):
+    '''
+    Display name of a Teacher/Subject/Grade foreign key (source: its id) from the reference data
+    snapshot, the request's own when the serializer has the request in its context
+    '''
+    def __init__(self, model, attribute=None, **kwargs):
+        self.model = model
+        self.attribute = attribute
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        obj = reference.get(self.model, value, self.context.get('request'))
+        if obj is None:
+            return None
+        return getattr(obj, self.attribute) if self.attribute else str(obj)
+
+
+class RecordSerializer(serializers.ModelSerializer):
+    '''
+    Base serializer of the records models. Display fields of related rows (student_name, ...)
+    are read from relations the viewset's get_queryset loads up front, or from the reference
+    data snapshot for teachers, subjects and classes (ReferenceNameField)
+    '''
+    serializer_related_field = CachedPrimaryKeyRelatedField
+    # Relations ?expand= can nest (api/expand.py): name -> (serializer class name, model relation, many)
+    expandable_fields = {}
+
+    def __init__(self, *args, expand=None, **kwargs):
+        # The expansions below this serializer when nested by ?expand=, None for the top level
+        self.expand = expand
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        '''
+        Expanded relations nested as records, and at the top level only the fields of
+        ?fields=/?exclude= (api/sparse.py), when the viewset passes them
+        '''
+        fields = super().get_fields()
+        expand = self.context.get('expand') if self.expand is None else self.expand
+        for name, nested in (expand or {}).items():
+            serializer_name, source, many = self.expandable_fields[name]
+            options = {'source': source} if source != name else {}
+            fields[name] = expandable_serializer(serializer_name)(many=many, read_only=True, expand=nested, **options)
+        if self.expand is not None:
+            return fields
+        return trim_fields(fields, self.context.get('fields'), self.context.get('exclude'))
+
+    def to_representation(self, instance):
+        # Reported as 'serialize' in the Server-Timing header (student_records/profiling.py)
+        with profiled('serialize'):
+            return super().to_representation(instance)
+
+
+class RoleTokenObtainPairSerializer(TokenObtainPairSerializer):
+    '''/api/login/ token pair whose access token carries the role claim'''
+    token_class = RoleRefreshToken
+
+class RoleTokenRefreshSerializer(TokenRefreshSerializer):
+    '''/api/token/refresh/ access token with a freshly resolved role claim'''
+    token_class = RoleRefreshToken
+
+def expandable_serializer(name):
+    '''Serializer classes of this module by name, expandable_fields refer to classes defined later'''
+    return globals()[name]
+
+class StudentSerializer(RecordSerializer):
+    full_name = serializers.CharField(read_only=True)
+    grade_name = ReferenceNameField(Grade, source='grade_id')
+    expandable_fields = {
+        'grade': ('GradeSerializer', 'grade', False),
+        'parents': ('ParentSerializer', 'parentstudentlink', True),
+        'performance': ('PerformanceSerializer', 'performance', True),
+        'attendance': ('AttendanceSerializer', 'attendance', True),
+        'invoices': ('InvoiceSerializer', 'invoices', True),
+        'enrollments': ('EnrollmentSerializer', 'enrollments', True),
+    }
+
     class Meta:
         model = Student
         fields = "__all__"
 
-class TeacherSerializer(serializers.ModelSerializer):
+class TeacherSerializer(RecordSerializer):
     class Meta:
         model = Teacher
         fields = "__all__"
 
-class ParentSerializer(serializers.ModelSerializer):
+class ParentSerializer(RecordSerializer):
+    expandable_fields = {'students': ('StudentSerializer', 'students', True)}
+
     class Meta:
         model = Parent
         fields = "__all__"
 
-class GradeSerializer(serializers.ModelSerializer):
+class GradeSerializer(RecordSerializer):
+    teacher_name = ReferenceNameField(Teacher, 'full_name', source='teacher_id')
+    expandable_fields = {'teacher': ('TeacherSerializer', 'teacher', False)}
+
     class Meta:
         model = Grade
         fields = "__all__"
 
-class SubjectSerializer(serializers.ModelSerializer):
+class SubjectSerializer(RecordSerializer):
+    teacher_name = ReferenceNameField(Teacher, 'full_name', source='teacher_id')
+    expandable_fields = {'teacher': ('TeacherSerializer', 'teacher', False)}
+
     class Meta:
         model = Subject
         fields = "__all__"
 
-class PerformanceSerializer(serializers.ModelSerializer):
+class PerformanceSerializer(RecordSerializer):
+    subject_name = ReferenceNameField(Subject, 'name', source='subject_id')
+    student_name = serializers.CharField(source='student.full_name', read_only=True)
+    expandable_fields = {
+        'student': ('StudentSerializer', 'student', False),
+        'subject': ('SubjectSerializer', 'subject', False),
+    }
+
     class Meta:
         model = Performance
         fields = "__all__"
 
-class AttendanceSerializer(serializers.ModelSerializer):
+class AttendanceSerializer(RecordSerializer):
+    student_name = serializers.CharField(source='student.full_name', read_only=True)
+    grade_name = ReferenceNameField(Grade, source='grade_id')
+    expandable_fields = {
+        'student': ('StudentSerializer', 'student', False),
+        'grade': ('GradeSerializer', 'grade', False),
+    }
+
     class Meta:
         model = Attendance
         fields = "__all__"
 
-class InvoiceSerializer(serializers.ModelSerializer):
+class InvoiceSerializer(RecordSerializer):
+    student_name = serializers.CharField(source='student.full_name', read_only=True)
+    expandable_fields = {
+        'student': ('StudentSerializer', 'student', False),
+        'payments': ('PaymentSerializer', 'payments', True),
+    }
+
     class Meta:
         model = Invoice
         fields = "__all__"
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(RecordSerializer):
+    student_name = serializers.CharField(source='invoice.student.full_name', read_only=True)
+    expandable_fields = {'invoice': ('InvoiceSerializer', 'invoice', False)}
+
     class Meta:
         model = Payment
         fields = "__all__"
 
-class EnrollmentSerializer(serializers.ModelSerializer):
+class EnrollmentSerializer(RecordSerializer):
+    student_name = serializers.CharField(source='student.full_name', read_only=True)
+    grade_name = ReferenceNameField(Grade, source='grade_id')
+    expandable_fields = {
+        'student': ('StudentSerializer', 'student', False),
+        'grade': ('GradeSerializer', 'grade', False),
+    }
+
     class Meta:
         model = Enrollment
         fields = "__all__"
+
+class GradebookCellSerializer(serializers.Serializer):
+    '''One score of the gradebook matrix'''
+    student = serializers.IntegerField()
+    subject = serializers.IntegerField()
+    score = serializers.IntegerField(min_value=0)
+
+class GradebookSerializer(serializers.Serializer):
+    '''The exam of a class gradebook (query string on GET), with the scores to save on POST'''
+    exam_type = serializers.ChoiceField(choices=Performance.EXAM_CHOICES)
+    academic_year = serializers.IntegerField(min_value=2000, max_value=2100)
+    term = serializers.ChoiceField(choices=Performance.TERMS)
+    subject = serializers.IntegerField(required=False)
+    scores = GradebookCellSerializer(many=True, required=False)
@@ -0,0 +1,125 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+from rest_framework.serializers import BaseSerializer
+from records.models import Student
+
+# Model properties shown by the serializers and the columns they are computed from
+PROPERTY_COLUMNS = {
+    Student: {'full_name': ('first_name', 'last_name')},
+}
+
+
+def parse_field_list(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def trim_fields(fields, only=None, exclude=None):
+    '''
+    The serializer fields named in only (all when None) minus those in exclude,
+    a 400 naming any field the serializer does not have
+    '''
+    unknown = sorted(((only or set()) | (exclude or set())) - set(fields))
+    if unknown:
+        raise ValidationError({'fields': [f'Unknown field "{name}".' for name in unknown]})
+    return {name: field for name, field in fields.items()
+            if (only is None or name in only) and name not in (exclude or ())}
+
+
+def source_columns(model, source_attrs):
+    '''
+    (only() paths, select_related paths) of what a serializer field reads: its own column, or
+    the columns of the rows it reaches through foreign keys. None when it reads something other
+    than columns of model
+    '''
+    path, joins = [], []
+    for i, attr in enumerate(source_attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            columns = PROPERTY_COLUMNS.get(model, {}).get(attr)
+            if columns is None:
+                # A related row is loaded whole, the model's own row cannot be trimmed
+                return (['__'.join(path)], joins) if path else None
+            return ['__'.join(path + [column]) for column in columns], joins
+        if field.many_to_many or field.one_to_many:
+            # Prefetched in a query of their own
+            return [], []
+        path.append(field.name)
+        if not field.is_relation or i == len(source_attrs) - 1:
+            break
+        joins.append('__'.join(path))
+        model = field.related_model
+    return ['__'.join(path)], joins
+
+
+def relation_paths(select_related, prefix=''):
+    '''select_related('invoice__student') paths of a query.select_related dict'''
+    paths = []
+    for name, nested in select_related.items():
+        paths.append(prefix + name)
+        paths += relation_paths(nested, f'{prefix}{name}__')
+    return paths
+
+
+class SparseFieldsMixin:
+    '''
+    ?fields=id,score and ?exclude=student_name on the list and detail responses of a viewset.
+    The serializer only builds the fields asked for, and the role-scoped queryset only selects
+    their columns (only()), joins the relations they read and prefetches the ones they list
+    '''
+    sparse_actions = ('list', 'retrieve')
+
+    def get_sparse_fields(self):
+        '''(fields, exclude) of the request, as sets or None'''
+        if self.action not in self.sparse_actions:
+            return None, None
+        params = self.request.query_params
+        only = parse_field_list(params['fields']) if 'fields' in params else None
+        exclude = parse_field_list(params['exclude']) if 'exclude' in params else None
+        return only, exclude
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['fields'], context['exclude'] = self.get_sparse_fields()
+        return context
+
+    def get_sparse_columns(self, queryset, fields):
+        '''(only() paths, select_related paths) of the fields shown, None to load whole rows'''
+        model = queryset.model
+        columns, joins = {model._meta.pk.name}, set()
+        # Read back by the keyset paginator and the conditional GET validators
+        columns.update(getattr(self.pagination_class, 'ordering', ()))
+        if any(field.name == 'updated_at' for field in model._meta.concrete_fields):
+            columns.add('updated_at')
+        for field in fields:
+            # Records nested by ?expand= are read whole
+            if field.source == '*' or isinstance(field, BaseSerializer):
+                return None
+            read = source_columns(model, field.source_attrs)
+            if read is None:
+                return None
+            columns.update(read[0])
+            joins.update(read[1])
+        return columns, joins
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        only, exclude = self.get_sparse_fields()
+        if only is None and exclude is None:
+            return queryset
+        fields = list(self.get_serializer().fields.values())
+        read = self.get_sparse_columns(queryset, fields)
+        if read is None:
+            return queryset
+        columns, joins = read
+        # Joins and prefetches of the fields left out are dropped with them
+        planned = queryset.query.select_related
+        kept = [path for path in relation_paths(planned) if path in joins] if isinstance(planned, dict) else []
+        # Columns of a relation that is not joined are read by its own query, only its id is needed here
+        columns = {column if '__' not in column or column.rsplit('__', 1)[0] in kept else column.split('__')[0] for column in columns}
+        columns.update(kept)
+        used = {field.source_attrs[0] for field in fields if field.source != '*'}
+        lookups = [lookup for lookup in queryset._prefetch_related_lookups if getattr(lookup, 'prefetch_to', lookup).split('__')[0] in used]
+        queryset = queryset.select_related(None).prefetch_related(None).prefetch_related(*lookups).only(*columns)
+        # select_related() without arguments would join every foreign key
+        return queryset.select_related(*kept) if kept else queryset
@@ -1,3 +1,1179 @@
 from django.test import TestCase
 
 # Create your tests here.
+import csv
+import datetime
+import io
+import json
+import os
+from base64 import urlsafe_b64encode
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import QuerySet
+from django.template.loader import render_to_string
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import AccessToken
+
+from accounts.models import CustomUser
+from records.models import Student, Parent, StudentParent, Grade, Teacher, Subject, UserProfile, Attendance, Performance, Invoice, Payment, Enrollment, StudentAccess, ChangeLog
+from records.roles import _role_cache
+from records import benchmark
+from records import changes
+from records import cache as records_cache
+from records import reference
+from student_records import settings as settings_module
+from student_records.metrics import MetricStore, render
+from student_records.nplusone import NPlusOneError, detect_n_plus_one
+from .authentication import RoleRefreshToken
+from .filters import leading_columns
+from .pagination import KeysetCursorPagination
+from .serializers import PerformanceSerializer, AttendanceSerializer
+from .views import StudentViewSet, ParentViewSet, GradeViewSet, SubjectViewSet, TeacherViewSet, PerformanceViewSet, AttendanceViewSet, InvoiceViewSet, PaymentViewSet, EnrollmentViewSet, SyncAPIView
+
+VIEWSETS = [StudentViewSet, ParentViewSet, GradeViewSet, SubjectViewSet, TeacherViewSet,
+            PerformanceViewSet, AttendanceViewSet, InvoiceViewSet, PaymentViewSet, EnrollmentViewSet]
+ROLES = ['Admin', 'Teacher', 'Student', 'Parent', 'Pending']
+
+
+def create_role_users():
+    '''Creates one user per role, with the Teacher/Student/Parent records they are linked to'''
+    users = {}
+    for i, role in enumerate(ROLES):
+        user = CustomUser.objects.create_user(username=role.lower(), password='Password123##', phone_number=f'25470000000{i}')
+        UserProfile.objects.create(user=user, role=role)
+        users[role] = user
+
+    teacher = Teacher.objects.create(full_name='Jane Teacher', user=users['Teacher'])
+    grade = Grade.objects.create(name=4, stream='East', teacher=teacher)
+    Subject.objects.create(name='Maths', teacher=teacher)
+    student = Student.objects.create(first_name='Angela', last_name='Kwamboka', gender='F', date_of_birth='2014-06-30',
+                                     address='100 Mountain View', status='Enrolled', date_of_admission='2019-01-11',
+                                     student_email='angela@example.com', grade=grade, user=users['Student'])
+    parent = Parent.objects.create(full_name='Mary Kwamboka', address='100 Mountain View', user=users['Parent'])
+    StudentParent.objects.create(student=student, parent=parent, relationship_type='M', is_primary_guardian=True)
+    return users
+
+
+def viewset_for(viewset_class, user, action='list'):
+    '''Instantiates a viewset the way the router would for a request by user'''
+    request = Request(RequestFactory().get('/'))
+    request.user = user
+    return viewset_class(request=request, action=action, format_kwarg=None, kwargs={})
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is sqlite specific')
+class QueryPlanTests(TestCase):
+    '''
+    Runs EXPLAIN QUERY PLAN on every viewset's get_queryset, for every role, as the
+    paginator executes it (first page and a seek page), and fails on full table scans.
+    A role-scoped query must reach every table through an index; only an unscoped
+    query may walk a table, and then only in index order and bounded by the page LIMIT
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, queryset):
+        plan = self.explain(queryset)
+        scans = [step for step in plan if step.startswith('SCAN ') and step != 'SCAN CONSTANT ROW']
+        if not queryset.query.where and not any('TEMP B-TREE' in step for step in plan):
+            # Unscoped listing walking the ordering index, stops after LIMIT rows
+            return []
+        return scans
+
+    def sample_position(self, paginator):
+        return [datetime.date(2024, 1, 1) if isinstance(field, models.DateField) else 1 for field in paginator.fields]
+
+    def test_no_full_table_scans(self):
+        for viewset_class in VIEWSETS:
+            for role, user in self.users.items():
+                with self.subTest(viewset=viewset_class.__name__, role=role):
+                    view = viewset_for(viewset_class, user)
+                    queryset = view.get_queryset()
+                    if queryset.query.is_empty():
+                        continue
+                    paginator = view.paginator
+                    paginator.fields = [queryset.model._meta.get_field(name) for name in paginator.ordering]
+                    first_page = queryset.order_by(*paginator.ordering)[:paginator.page_size + 1]
+                    seek_page = queryset.filter(paginator.seek_filter(self.sample_position(paginator))).order_by(*paginator.ordering)[:paginator.page_size + 1]
+
+                    for page in (first_page, seek_page):
+                        self.assertEqual(self.full_scans(page), [], self.explain(page))
+
+    def test_index_backed_filters_use_their_index(self):
+        for viewset_class in VIEWSETS:
+            if not getattr(viewset_class, 'filters_require_index', False):
+                continue
+            model = viewset_class.serializer_class.Meta.model
+            for param, lookup in viewset_class.query_filters.items():
+                field = model._meta.get_field(lookup.split('__')[0])
+                if field.name not in leading_columns(model):
+                    continue
+                with self.subTest(viewset=viewset_class.__name__, param=param):
+                    value = '2024-01-01' if isinstance(field, models.DateField) else '1'
+                    request = Request(RequestFactory().get('/', {param: value}))
+                    request.user = self.users['Admin']
+                    view = viewset_class(request=request, action='list', format_kwarg=None, kwargs={})
+                    queryset = view.filter_queryset(view.get_queryset()).order_by(*view.paginator.ordering)[:51]
+                    self.assertEqual(self.full_scans(queryset), [], self.explain(queryset))
+
+
+class KeysetPaginationTests(TestCase):
+    '''Cursors walk every row once, in order, in both directions, ties on the ordering included'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        student = Student.objects.get()
+        students = [student] + [Student.objects.create(first_name=name, last_name='Otieno', gender='M', date_of_birth='2014-01-01', address='Nairobi',
+                                                       status='Enrolled', date_of_admission='2019-01-11', student_email=f'{name.lower()}@example.com',
+                                                       grade=student.grade) for name in ('Brian', 'Chege')]
+        # Three rows on each date: ties on the leading ordering column
+        for day in (3, 1, 2):
+            for each in students:
+                Attendance.objects.create(student=each, grade=student.grade, date=datetime.date(2024, 3, day), status=1)
+        cls.ordered = list(Attendance.objects.order_by('date', 'id').values_list('id', flat=True))
+
+    def setUp(self):
+        self.client.force_login(self.users['Admin'])
+
+    def follow(self, url, link):
+        '''Ids of every page reached from url through the link, and the last page'''
+        pages = []
+        while url:
+            page = self.client.get(url).json()
+            pages.append([row['id'] for row in page['results']])
+            url = page[link]
+        return pages, page
+
+    def test_next_and_previous_cursors(self):
+        pages, last = self.follow('/api/attendances/?page_size=2', 'next')
+        self.assertEqual(pages, [self.ordered[i:i + 2] for i in range(0, 9, 2)])
+        self.assertIsNone(last['next'])
+        back, first = self.follow(last['previous'], 'previous')
+        self.assertEqual(back, [self.ordered[i:i + 2] for i in range(6, -1, -2)])
+        self.assertIsNone(first['previous'])
+
+    def test_invalid_cursors_are_bad_requests(self):
+        valid = self.client.get('/api/attendances/?page_size=2').json()['next']
+        cursor = valid.split('cursor=')[1].split('&')[0]
+        tampered = urlsafe_b64encode(json.dumps({'p': ['March', 'x']}).encode()).decode()
+        short = urlsafe_b64encode(json.dumps({'p': [1]}).encode()).decode()
+        long = urlsafe_b64encode(json.dumps({'p': ['2024-03-04', 1, 2]}).encode()).decode()
+        not_a_list = urlsafe_b64encode(json.dumps({'p': '21'}).encode()).decode()
+        # A null in each column of the ordering: (date, id) and (academic_year, term, id)
+        empty = {'/api/attendances/': [[None, 1], ['2024-03-04', None]], '/api/performances/': [[None, 1, 1], [2024, None, 1], [2024, 1, None]]}
+        for url in ('/api/attendances/', '/api/performances/'):
+            nulls = [urlsafe_b64encode(json.dumps({'p': position}).encode()).decode() for position in empty[url]]
+            for value in ('garbage', cursor[:-4], tampered, short, long, not_a_list, *nulls):
+                with self.subTest(url=url, cursor=value):
+                    response = self.client.get(url, {'cursor': value})
+                    self.assertEqual(response.status_code, 400)
+                    self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_page_size_is_clamped(self):
+        paginator = KeysetCursorPagination()
+        for value, size in (('0', 1), ('-3', 1), ('100000', paginator.max_page_size), ('x', paginator.page_size), ('7', 7)):
+            with self.subTest(page_size=value):
+                self.assertEqual(paginator.get_page_size(Request(RequestFactory().get('/', {'page_size': value}))), size)
+        self.assertEqual(len(self.client.get('/api/attendances/?page_size=0').json()['results']), 1)
+
+
+class RoleClaimTests(TestCase):
+    '''JWT requests are authorized from the signed token claims, without loading the user or UserProfile'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+
+    def setUp(self):
+        # Test rollbacks send no signals: roles cached by an earlier test would outlive its rows
+        _role_cache.clear()
+
+    def login(self, username):
+        response = self.client.post('/api/login/', {'username': username, 'password': 'Password123##'})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_access_token_carries_role_and_profile_ids(self):
+        tokens = self.login('student')
+        access = AccessToken(tokens['access'])
+        self.assertEqual(access['role'], 'student')
+        self.assertEqual(access['student_id'], self.users['Student'].student_profile.pk)
+        self.assertIsNone(access['parent_id'])
+        refreshed = self.client.post('/api/token/refresh/', {'refresh': tokens['refresh']}).json()
+        self.assertEqual(AccessToken(refreshed['access'])['role'], 'student')
+
+    def test_no_user_or_role_queries_on_jwt_requests(self):
+        tokens = self.login('teacher')
+        _role_cache.clear()
+        # The role version, once per ROLE_CACHE_TTL, and the page of teachers: the list validators are version stamps
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/teachers/', HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):
+            self.client.get('/api/teachers/', HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+
+    def test_role_change_rejects_older_tokens(self):
+        tokens = self.login('teacher')
+        profile = UserProfile.objects.get(user=self.users['Teacher'])
+        profile.role = 'Pending'
+        profile.save()
+        response = self.client.get('/api/teachers/', HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        # 403 rather than 401 since SessionAuthentication is the first authentication class
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['detail'], 'Role changed, log in again.')
+        self.assertEqual(AccessToken(self.login('teacher')['access'])['role'], 'pending')
+
+    def test_role_change_seen_by_processes_without_the_cached_version(self):
+        tokens = self.login('teacher')
+        profile = UserProfile.objects.get(user=self.users['Teacher'])
+        profile.role = 'Pending'
+        profile.save()
+        # Another worker, which had not cached the user's role version
+        _role_cache.clear()
+        response = self.client.get('/api/teachers/', HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        self.assertEqual(response.status_code, 403)
+
+    def test_saving_without_a_role_change_keeps_tokens_valid(self):
+        tokens = self.login('teacher')
+        profile = UserProfile.objects.get(user=self.users['Teacher'])
+        profile.save()
+        profile.role = 'Teacher'
+        profile.save(update_fields=['role'])
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).role_version, 0)
+        _role_cache.clear()
+        self.assertEqual(self.client.get('/api/teachers/', HTTP_AUTHORIZATION='Bearer ' + tokens['access']).status_code, 200)
+        profile.role = 'Admin'
+        profile.save(update_fields=['role'])
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).role_version, 1)
+
+
+class StudentAccessTests(TestCase):
+    '''
+    StudentAccess follows every change of who a student belongs to, and each role's lists and
+    detail pages, api and records views, follow StudentAccess: a stale row would leak a student
+    '''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.parent = Parent.objects.get()
+        cls.performance = Performance.objects.create(student=cls.student, subject=Subject.objects.get(), score=64,
+                                                     exam_type='CAT', academic_year=2024, term=1)
+        cls.guardian = cls.make_user('guardian', 'Parent')
+        cls.guardian_parent = Parent.objects.create(full_name='Gina Guardian', address='Nakuru', user=cls.guardian)
+
+    @classmethod
+    def make_user(cls, username, role):
+        user = CustomUser.objects.create_user(username=username, password='Password123##', phone_number=f'2547{CustomUser.objects.count():08d}')
+        UserProfile.objects.create(user=user, role=role)
+        return user
+
+    def setUp(self):
+        _role_cache.clear()
+
+    def sees(self, user, student=None):
+        '''Whether user gets the student from every list and detail endpoint, which must all agree'''
+        student = student or self.student
+        self.client.force_login(user)
+        seen = [
+            student.pk in [row['id'] for row in self.client.get('/api/students/').json()['results']],
+            self.client.get(f'/api/students/{student.pk}/').status_code == 200,
+            self.performance.pk in [row['id'] for row in self.client.get('/api/performances/').json()['results']],
+            self.client.get(f'/api/performances/{self.performance.pk}/').status_code == 200,
+            student in self.client.get('/records/students/').context['students'],
+            self.client.get(f'/records/student/{student.pk}/').status_code == 200,
+            self.client.get(f'/records/performance/{self.performance.pk}/').status_code == 200,
+        ]
+        self.assertIn(seen, ([True] * 7, [False] * 7))
+        return seen[0]
+
+    def test_linking_unlinking_and_relinking_a_parent(self):
+        self.assertFalse(self.sees(self.guardian))
+        link = StudentParent.objects.create(student=self.student, parent=self.guardian_parent, relationship_type='G', is_primary_guardian=False)
+        self.assertTrue(self.sees(self.guardian))
+        link.delete()
+        self.assertFalse(self.sees(self.guardian))
+        link = StudentParent.objects.create(student=self.student, parent=self.guardian_parent, relationship_type='G', is_primary_guardian=False)
+        self.assertTrue(self.sees(self.guardian))
+        # A link moved to another student takes the access with it
+        other = Student.objects.create(first_name='Brian', last_name='Otieno', gender='M', date_of_birth='2014-01-01', address='Nairobi',
+                                       status='Enrolled', date_of_admission='2019-01-11', student_email='brian@example.com', grade=self.student.grade)
+        link.student = other
+        link.save()
+        self.assertFalse(self.sees(self.guardian))
+        self.assertEqual(list(StudentAccess.objects.filter(user=self.guardian).values_list('student_id', flat=True)), [other.pk])
+
+    def test_changing_the_user_of_a_parent_or_student(self):
+        self.assertTrue(self.sees(self.users['Parent']))
+        self.parent.user = self.guardian
+        self.guardian_parent.user = None
+        self.guardian_parent.save()
+        self.parent.save()
+        self.assertFalse(self.sees(self.users['Parent']))
+        self.assertTrue(self.sees(self.guardian))
+        self.parent.user = None
+        self.parent.save()
+        self.assertFalse(self.sees(self.guardian))
+
+        newcomer = self.make_user('newcomer', 'Student')
+        self.assertTrue(self.sees(self.users['Student']))
+        self.student.user = newcomer
+        self.student.save()
+        self.assertFalse(self.sees(self.users['Student']))
+        self.assertTrue(self.sees(newcomer))
+
+    def test_deleting_a_parent_or_student(self):
+        self.parent.delete()
+        self.assertFalse(self.sees(self.users['Parent']))
+        self.assertFalse(StudentAccess.objects.filter(user=self.users['Parent']).exists())
+        pk = self.student.pk
+        self.student.delete()
+        self.assertFalse(StudentAccess.objects.filter(student_id=pk).exists())
+        self.client.force_login(self.users['Student'])
+        self.assertEqual(self.client.get('/api/students/').json()['results'], [])
+        self.assertEqual(self.client.get(f'/api/students/{pk}/').status_code, 404)
+
+    def test_changing_class_moves_the_student_between_rosters(self):
+        old_grade = self.student.grade
+        teacher = Teacher.objects.create(full_name='Tom Teacher', user=self.make_user('tom', 'Teacher'))
+        new_grade = Grade.objects.create(name=5, stream='West', teacher=teacher)
+
+        def roster(grade):
+            self.client.force_login(self.users['Admin'])
+            return [row['student'] for row in self.client.get(f'/api/grades/{grade.pk}/attendance/2024-03-04/').json()['students']]
+
+        def class_of(user):
+            self.client.force_login(user)
+            return [row['id'] for row in self.client.get('/api/grades/').json()['results']]
+
+        self.assertEqual((roster(old_grade), roster(new_grade)), ([self.student.pk], []))
+        self.assertEqual(class_of(self.users['Parent']), [old_grade.pk])
+        self.student.grade = new_grade
+        self.student.save()
+        self.assertEqual((roster(old_grade), roster(new_grade)), ([], [self.student.pk]))
+        self.assertEqual(class_of(self.users['Parent']), [new_grade.pk])
+        self.assertEqual(class_of(self.users['Student']), [new_grade.pk])
+        # The former class teacher can no longer mark the student, the new one can
+        self.client.force_login(self.users['Teacher'])
+        self.assertEqual(self.client.post(f'/api/grades/{old_grade.pk}/attendance/2024-03-04/', {self.student.pk: 1}, content_type='application/json').status_code, 400)
+        self.client.force_login(teacher.user)
+        self.assertEqual(self.client.post(f'/api/grades/{new_grade.pk}/attendance/2024-03-04/', {self.student.pk: 1}, content_type='application/json').status_code, 200)
+
+
+class ParentVisibilityTests(TestCase):
+    '''Students see their own parents/guardians, parents their own record, staff every parent'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.parent = Parent.objects.get()
+        cls.other = Parent.objects.create(full_name='Oscar Otieno', address='Kisumu')
+
+    def visible(self, role):
+        '''Parent ids of the api and records lists, and whether each detail page is served'''
+        self.client.force_login(self.users[role])
+        listed = [row['id'] for row in self.client.get('/api/parents/').json()['results']]
+        page = [parent.pk for parent in self.client.get('/records/parents/').context['parents']]
+        self.assertEqual(page, listed)
+        for parent in (self.parent, self.other):
+            status = self.client.get(f'/api/parents/{parent.pk}/').status_code
+            self.assertEqual(self.client.get(f'/records/parent/{parent.pk}/').status_code, status)
+            self.assertEqual(status, 200 if parent.pk in listed else 404)
+        return sorted(listed)
+
+    def test_visible_parents_per_role(self):
+        self.assertEqual(self.visible('Student'), [self.parent.pk])
+        self.assertEqual(self.visible('Parent'), [self.parent.pk])
+        self.assertEqual(self.visible('Teacher'), sorted([self.parent.pk, self.other.pk]))
+        self.assertEqual(self.visible('Admin'), sorted([self.parent.pk, self.other.pk]))
+
+
+class RollCallTests(TestCase):
+    '''A class teacher marks the whole class for a day in one request'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.grade = Grade.objects.get()
+        cls.student = Student.objects.get()
+        cls.url = f'/api/grades/{cls.grade.pk}/attendance/2024-03-04/'
+
+    def test_marks_are_upserted(self):
+        self.client.force_login(self.users['Teacher'])
+        self.assertEqual(self.client.post(self.url, {self.student.pk: 'present'}, content_type='application/json').status_code, 200)
+        response = self.client.post(self.url, {self.student.pk: 0}, content_type='application/json')
+        self.assertEqual(response.json()['students'][0]['status'], 0)
+        self.assertEqual(Attendance.objects.get().status, 0)
+
+    def test_students_outside_the_class_are_rejected(self):
+        outsider = Student.objects.create(first_name='Brian', last_name='Otieno', gender='M', date_of_birth='2014-01-01', address='12 Valley Road',
+                                          status='Enrolled', date_of_admission='2019-01-11', student_email='brian@example.com', grade=None)
+        self.client.force_login(self.users['Teacher'])
+        response = self.client.post(self.url, {self.student.pk: 1, outsider.pk: 1}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attendance.objects.exists())
+
+    def test_only_the_class_teacher_marks(self):
+        self.client.force_login(self.users['Student'])
+        self.assertEqual(self.client.post(self.url, {self.student.pk: 1}, content_type='application/json').status_code, 403)
+        self.client.force_login(self.users['Admin'])
+        self.assertEqual(self.client.get(self.url).json()['students'][0]['status'], None)
+
+
+class GradebookTests(TestCase):
+    '''The class score matrix of an exam is loaded in one query and saved in one upsert'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.grade = Grade.objects.get()
+        cls.student = Student.objects.get()
+        cls.maths = Subject.objects.get()
+        cls.english = Subject.objects.create(name='English', teacher=Teacher.objects.create(full_name='John Teacher'))
+        cls.url = f'/api/grades/{cls.grade.pk}/gradebook/'
+        cls.exam = {'exam_type': 'CAT', 'academic_year': 2024, 'term': 1}
+
+    def test_matrix_is_one_query(self):
+        Performance.objects.create(student=self.student, subject=self.maths, score=64, **self.exam)
+        self.client.force_login(self.users['Teacher'])
+        self.client.get(self.url, self.exam)
+        # Session, user, grade, teacher profile and the matrix, subjects are reference data
+        with self.assertNumQueries(5):
+            self.client.get(self.url, dict(self.exam, term=2))
+        # The matrix is cached until the class's scores change
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, self.exam)
+        # Only the subjects the teacher teaches
+        self.assertEqual(response.json()['students'][0]['scores'], {str(self.maths.pk): 64})
+
+    def test_admins_see_every_subject(self):
+        self.client.force_login(self.users['Admin'])
+        response = self.client.get(self.url, self.exam)
+        self.assertEqual([subject['name'] for subject in response.json()['subjects']], ['English', 'Maths'])
+        self.assertEqual(response.json()['students'][0]['scores'], {str(self.english.pk): None, str(self.maths.pk): None})
+
+    def test_teachers_enter_scores_for_their_subjects(self):
+        self.client.force_login(self.users['Teacher'])
+        scores = [{'student': self.student.pk, 'subject': self.maths.pk, 'score': 71}]
+        self.assertEqual(self.client.post(self.url, dict(self.exam, scores=scores), content_type='application/json').status_code, 200)
+        scores[0]['score'] = 75
+        self.client.post(self.url, dict(self.exam, scores=scores), content_type='application/json')
+        self.assertEqual(Performance.objects.get().score, 75)
+
+        scores = [{'student': self.student.pk, 'subject': self.english.pk, 'score': 71}]
+        self.assertEqual(self.client.post(self.url, dict(self.exam, scores=scores), content_type='application/json').status_code, 400)
+
+
+class ProfilingTests(TestCase):
+    '''Every response carries a Server-Timing header, sampled requests are logged as JSON'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+
+    def test_server_timing_and_log_line(self):
+        self.client.force_login(self.users['Admin'])
+        with self.settings(REQUEST_PROFILING_SAMPLE_RATE=1.0), self.assertLogs('student_records.profiling') as logs:
+            response = self.client.get('/api/students/')
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, .*total;dur=[\d.]+$')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual((line['view'], line['status'], line['role']), ('student-list', 200, 'admin'))
+
+
+class MetricsTests(TestCase):
+    '''/metrics adds up the metric files of every worker process'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+
+    def test_requests_and_failed_logins_are_counted(self):
+        with self.settings(METRICS_DIR=tempfile.mkdtemp(), METRICS_TOKEN='scrape'):
+            self.client.force_login(self.users['Teacher'])
+            self.client.get('/api/attendances/')
+            self.client.post('/api/login/', {'username': 'teacher', 'password': 'wrong'})
+            metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('http_requests_total{route="attendance-list",role="teacher",method="GET",status="200"} 1', metrics)
+        self.assertIn('http_request_duration_seconds_count{route="attendance-list",role="teacher"} 1', metrics)
+        self.assertIn('auth_login_failures_total{status="401"} 1', metrics)
+
+    def test_worker_files_are_added_up(self):
+        with self.settings(METRICS_DIR=tempfile.mkdtemp()):
+            workers = [MetricStore(), MetricStore()]
+            for worker in workers:
+                worker.inc('http_requests_total', ['student-list', 'admin', 'GET', '200'])
+                worker.observe('http_request_db_queries', ['student-list'], 3)
+                worker.flush()
+            metrics = render(MetricStore().collect())
+        self.assertIn('http_requests_total{route="student-list",role="admin",method="GET",status="200"} 2', metrics)
+        self.assertIn('http_request_db_queries_bucket{route="student-list",le="5"} 2', metrics)
+        self.assertIn('http_request_db_queries_bucket{route="student-list",le="2"} 0', metrics)
+
+    def test_test_runs_keep_their_own_metrics_dir(self):
+        self.assertNotEqual(settings.METRICS_DIR, settings_module.METRICS_DIR)
+
+    def test_token_required_outside_debug(self):
+        with self.settings(METRICS_DIR=tempfile.mkdtemp(), METRICS_TOKEN=None):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            with self.settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+        with self.settings(METRICS_DIR=tempfile.mkdtemp(), METRICS_TOKEN='scrape'):
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').status_code, 200)
+
+    def test_counters_are_flushed_without_observations(self):
+        with self.settings(METRICS_DIR=tempfile.mkdtemp(), METRICS_FLUSH_INTERVAL=0):
+            MetricStore().inc('auth_login_failures_total', ['401'])
+            metrics = render(MetricStore().collect())
+        self.assertIn('auth_login_failures_total{status="401"} 1', metrics)
+
+    def test_files_of_exited_processes_are_merged(self):
+        directory = tempfile.mkdtemp()
+        # Above any pid_max: no such process
+        with open(os.path.join(directory, 'metrics-999999999-deadbeef.json'), 'w') as exited:
+            json.dump({json.dumps(['auth_login_failures_total', ['401']]): 2}, exited)
+        with self.settings(METRICS_DIR=directory):
+            worker = MetricStore()
+            worker.inc('auth_login_failures_total', ['401'])
+            self.assertIn('auth_login_failures_total{status="401"} 3', render(worker.collect()))
+            self.assertEqual(os.listdir(directory), [worker.file_name])
+            self.assertIn('auth_login_failures_total{status="401"} 3', render(MetricStore().collect()))
+
+
+@override_settings(N_PLUS_ONE_DETECTION='raise')
+class NPlusOneTests(TestCase):
+    '''No api route or records list/detail view may run a query per row, for any role'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = benchmark.seed(students=30)
+        cls.samples = benchmark.sample_objects(cls.users)
+
+    def check(self, name, url, role, **headers):
+        with self.subTest(route=name, role=role):
+            try:
+                self.client.get(url, **headers)
+            except NPlusOneError as error:
+                self.fail(str(error))
+
+    def test_api_routes(self):
+        for role, user in self.users.items():
+            token = RoleRefreshToken.for_user(user).access_token
+            for name, url in benchmark.api_routes(self.samples):
+                self.check(name, url, role, HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_records_views(self):
+        for role, user in self.users.items():
+            self.client.force_login(user)
+            for name, url in benchmark.records_routes(self.samples):
+                self.check(name, url, role)
+
+    def test_reports_the_template_line(self):
+        # The list template without the view's select_related
+        with self.assertRaisesRegex(NPlusOneError, r'from records/templates/records/attendance_list.html:\d+'):
+            with detect_n_plus_one():
+                render_to_string('records/attendance_list.html', {'attendances': Attendance.objects.all()[:10]})
+
+    def test_query_count_does_not_grow_with_the_page(self):
+        token = RoleRefreshToken.for_user(self.users['Admin']).access_token
+        for url in ['/api/performances/', '/api/attendances/', '/api/invoices/', '/api/payments/', '/api/enrollments/']:
+            # Loads the reference data snapshot
+            self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}')
+            counts = []
+            for size in (5, 200):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url, {'page_size': size}, HTTP_AUTHORIZATION=f'Bearer {token}')
+                counts.append(len(queries))
+            with self.subTest(url=url):
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(counts[0], counts[1])
+
+    def test_display_fields(self):
+        token = RoleRefreshToken.for_user(self.users['Parent']).access_token
+        response = self.client.get('/api/performances/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        row = response.data['results'][0]
+        performance = Performance.objects.select_related('subject', 'student').get(pk=row['id'])
+        self.assertEqual(row['subject_name'], performance.subject.name)
+        self.assertEqual(row['student_name'], f'{performance.student.first_name} {performance.student.last_name}')
+
+    def test_context_manager(self):
+        with self.assertRaisesRegex(NPlusOneError, r'\d+x from api/tests.py:\d+'):
+            with detect_n_plus_one():
+                [attendance.grade for attendance in Attendance.objects.all()[:10]]
+
+
+class ConditionalGetTests(TestCase):
+    '''Unchanged lists and records are answered with a 304 and nothing serialized'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.performance = Performance.objects.create(student=cls.student, subject=Subject.objects.get(), score=64,
+                                                     exam_type='CAT', academic_year=2024, term=1)
+
+    def get(self, url, role='Parent', **headers):
+        token = RoleRefreshToken.for_user(self.users[role]).access_token
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}', **headers)
+
+    def test_detail_not_modified(self):
+        url = f'/api/performances/{self.performance.pk}/'
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        with patch.object(PerformanceSerializer, 'to_representation') as to_representation:
+            self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+            self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        to_representation.assert_not_called()
+
+        self.performance.score = 70
+        self.performance.save()
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_list_changes_with_its_rows(self):
+        response = self.get('/api/performances/')
+        etag = response['ETag']
+        self.assertEqual(self.get('/api/performances/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Another format or another user is another representation
+        self.assertNotEqual(self.get('/api/performances/', role='Student')['ETag'], etag)
+
+        Performance.objects.create(student=self.student, subject=Subject.objects.get(), score=50, exam_type='CAT', academic_year=2024, term=2)
+        response = self.get('/api/performances/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        Performance.objects.filter(term=2).delete()
+        self.assertEqual(self.get('/api/performances/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_list_validators_follow_the_scope_without_a_query(self):
+        token = RoleRefreshToken.for_user(self.users['Parent']).access_token
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+        etag = self.client.get('/api/performances/', **headers)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/performances/', HTTP_IF_NONE_MATCH=etag, **headers).status_code, 304)
+        # The parent loses access to the student, none of the performances changed
+        StudentParent.objects.filter(student=self.student).delete()
+        response = self.client.get('/api/performances/', HTTP_IF_NONE_MATCH=etag, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [])
+
+    def test_shown_records_change_the_etag(self):
+        etag = self.get('/api/performances/')['ETag']
+        self.student.first_name = 'Angie'
+        self.student.save()
+        response = self.get('/api/performances/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['student_name'], 'Angie Kwamboka')
+
+    def test_bulk_upserts_update_updated_at(self):
+        before = self.performance.updated_at
+        token = RoleRefreshToken.for_user(self.users['Admin']).access_token
+        rows = [{'student': self.student.pk, 'subject': self.performance.subject_id, 'score': 90, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1}]
+        self.client.post('/api/performances/', rows, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.performance.refresh_from_db()
+        self.assertEqual(self.performance.score, 90)
+        self.assertGreater(self.performance.updated_at, before)
+
+    def test_records_views(self):
+        self.client.force_login(self.users['Parent'])
+        response = self.client.get('/records/performances/')
+        self.assertEqual(self.client.get('/records/performances/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class ExportTests(TestCase):
+    '''Exports stream every record the user may see, as CSV or NDJSON'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        # Another family's child, out of the parent's scope
+        cls.other = Student.objects.create(first_name='Brian', last_name='Otieno', gender='M', date_of_birth='2014-02-01',
+                                           address='7, "Lake" Road\nKisumu', status='Enrolled', date_of_admission='2019-01-11',
+                                           student_email='brian@example.com', grade=cls.student.grade)
+        subject = Subject.objects.get()
+        for student in (cls.student, cls.other):
+            Performance.objects.create(student=student, subject=subject, score=64, exam_type='CAT', academic_year=2024, term=1)
+
+    def get(self, url, role='Admin', **extra):
+        token = RoleRefreshToken.for_user(self.users[role]).access_token
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}', **extra)
+
+    def test_csv_and_ndjson(self):
+        response = self.get('/api/performances/export/?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="performance.csv"')
+        self.assertEqual(len(list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))), 3)
+
+        for response in (self.get('/api/performances/export/?format=ndjson'),
+                         self.get('/api/performances/export/', HTTP_ACCEPT='application/x-ndjson')):
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+            self.assertEqual(sorted(json.loads(line)['student'] for line in lines), [self.student.pk, self.other.pk])
+        self.assertEqual(self.get('/api/performances/export/?format=xml').status_code, 404)
+
+    def test_header_row_and_escaping(self):
+        response = self.get('/api/students/export/?format=csv')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode(), newline='')))
+        self.assertEqual(rows[0], [field.name for field in Student._meta.concrete_fields])
+        address = rows[0].index('address')
+        self.assertEqual(sorted(row[address] for row in rows[1:]), ['100 Mountain View', '7, "Lake" Road\nKisumu'])
+
+        lines = b''.join(self.get('/api/students/export/?format=ndjson').streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[1])['address'], '7, "Lake" Road\nKisumu')
+
+    def test_rows_are_scoped_to_the_role(self):
+        for role, students in (('Parent', [self.student.pk]), ('Student', [self.student.pk]), ('Teacher', [self.student.pk, self.other.pk])):
+            with self.subTest(role=role):
+                lines = b''.join(self.get('/api/performances/export/?format=ndjson', role=role).streaming_content).decode().splitlines()
+                self.assertEqual(sorted(json.loads(line)['student'] for line in lines), students)
+        lines = b''.join(self.get('/api/students/export/?format=ndjson', role='Parent').streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.student.pk])
+
+    def test_rows_are_streamed_from_an_iterator(self):
+        with patch.object(QuerySet, 'iterator', autospec=True, side_effect=QuerySet.iterator) as iterator:
+            with patch.object(PerformanceViewSet, 'export_chunk_size', 1):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.get('/api/performances/export/?format=csv')
+                self.assertTrue(response.streaming)
+                # No row is read before the body is
+                self.assertFalse([query for query in queries if 'records_performance' in query['sql']])
+                chunks = list(response.streaming_content)
+        self.assertEqual(iterator.call_count, 1)
+        self.assertEqual(iterator.call_args.kwargs, {'chunk_size': 1})
+        # The header, then a chunk per row
+        self.assertEqual(len(chunks), 3)
+
+
+class BulkCreateTests(TestCase):
+    '''A list POSTed by an admin is upserted on the model's natural key, invalid rows reported per row'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.grade = Grade.objects.get()
+        cls.subject = Subject.objects.get()
+
+    def post(self, url, rows, role='Admin'):
+        token = RoleRefreshToken.for_user(self.users[role]).access_token
+        return self.client.post(url, rows, content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_upserts_on_the_natural_key(self):
+        cases = [
+            ('/api/performances/', Performance, {'student': self.student.pk, 'subject': self.subject.pk, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1},
+             'score', 60, 75),
+            ('/api/attendances/', Attendance, {'student': self.student.pk, 'grade': self.grade.pk, 'date': '2024-03-04'}, 'status', 0, 1),
+            ('/api/enrollments/', Enrollment, {'student': self.student.pk, 'grade': self.grade.pk, 'academic_year': 2024, 'date_enrolled': '2024-01-08'},
+             'status', 'ENROLLED', 'LEFT'),
+        ]
+        for url, model, key, field, first, second in cases:
+            with self.subTest(model=model.__name__):
+                response = self.post(url, [dict(key, **{field: first})])
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(response.json(), {'count': 1, 'errors': []})
+                self.assertEqual(self.post(url, [dict(key, **{field: second})]).status_code, 201)
+                self.assertEqual(list(model.objects.values_list(field, flat=True)), [second])
+
+    def test_backends_without_a_conflict_target(self):
+        row = {'student': self.student.pk, 'subject': self.subject.pk, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1, 'score': 60}
+        # MySQL upserts with ON DUPLICATE KEY UPDATE, which names no unique fields
+        with patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=lambda queryset, objs, **options: objs) as bulk_create:
+            self.assertEqual(self.post('/api/performances/', [row]).status_code, 201)
+        options = bulk_create.call_args_list[0].kwargs
+        self.assertTrue(options['update_conflicts'])
+        self.assertNotIn('unique_fields', options)
+
+    def test_invoices_are_plain_inserts(self):
+        row = {'student': self.student.pk, 'total_amount': '15000', 'amount_due': '15000', 'payment_due_date': '2024-02-05',
+               'status': 'PENDING', 'academic_year': 2024, 'term': 1}
+        self.assertEqual(self.post('/api/invoices/', [row, row]).json(), {'count': 2, 'errors': []})
+        self.post('/api/invoices/', [row])
+        self.assertEqual(Invoice.objects.filter(student=self.student).count(), 3)
+
+    def test_invalid_rows_are_reported_per_row(self):
+        row = {'student': self.student.pk, 'subject': self.subject.pk, 'score': 60, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1}
+        rows = [row, dict(row, term=2, student=0), 'row', dict(row, score=80), dict(row, term=3, score='high')]
+        response = self.post('/api/performances/', rows)
+        self.assertEqual(response.status_code, 207)
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual([error['index'] for error in data['errors']], [1, 2, 3, 4])
+        self.assertIn('student', data['errors'][0]['errors'])
+        self.assertEqual(data['errors'][1]['errors'], {'non_field_errors': ['Expected an object.']})
+        self.assertEqual(data['errors'][2]['errors'], {'non_field_errors': ['Duplicate of record 0 in this batch.']})
+        self.assertIn('score', data['errors'][3]['errors'])
+        self.assertEqual(list(Performance.objects.values_list('term', 'score')), [(1, 60)])
+
+        response = self.post('/api/performances/', [dict(row, student=0)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['count'], 0)
+        self.assertEqual(self.post('/api/performances/', []).status_code, 400)
+
+    def test_admins_only(self):
+        row = {'student': self.student.pk, 'subject': self.subject.pk, 'score': 60, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1}
+        for role in ('Teacher', 'Parent', 'Student'):
+            with self.subTest(role=role):
+                self.assertEqual(self.post('/api/performances/', [row], role=role).status_code, 403)
+        self.assertFalse(Performance.objects.exists())
+
+    def test_payload_size_limit(self):
+        rows = [{'student': self.student.pk, 'subject': self.subject.pk, 'score': 60, 'exam_type': 'CAT', 'academic_year': 2024, 'term': term}
+                for term in (1, 2, 3)]
+        with patch.object(PerformanceViewSet, 'bulk_max_rows', 2):
+            response = self.post('/api/performances/', rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), ['At most 2 records can be created at once.'])
+        self.assertFalse(Performance.objects.exists())
+
+
+@patch.object(SyncAPIView, 'settle_seconds', 0)
+class SyncTests(TestCase):
+    '''Offline clients fetch what changed after their token, deletions included'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.maths = Subject.objects.get()
+        cls.other = Student.objects.create(first_name='Brian', last_name='Otieno', gender='M', date_of_birth='2014-01-01', address='12 Valley Road',
+                                           status='Enrolled', date_of_admission='2019-01-11', student_email='brian@example.com', grade=cls.student.grade)
+
+    def sync(self, role='Parent', **params):
+        self.client.force_login(self.users[role])
+        response = self.client.get('/api/sync/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def performance(self, student, term=1):
+        return Performance.objects.create(student=student, subject=self.maths, score=64, exam_type='CAT', academic_year=2024, term=term)
+
+    def test_changes_and_tombstones_since_the_token(self):
+        token = self.sync()['next']
+        kept, removed = self.performance(self.student), self.performance(self.student, term=2)
+        self.performance(self.other)
+        removed_pk = removed.pk
+        removed.delete()
+        data = self.sync(since=token)
+        # The other student's score is not the parent's, the removed one is a tombstone
+        self.assertEqual([row['id'] for row in data['changes']['performance']['updated']], [kept.pk])
+        self.assertEqual(data['changes']['performance']['deleted'], [removed_pk])
+        self.assertEqual(self.sync(since=data['next']), {'changes': {}, 'next': data['next'], 'more': False})
+
+    def test_pages_follow_the_sequence(self):
+        token = self.sync(role='Admin')['next']
+        performances = [self.performance(self.student, term) for term in (1, 2, 3)]
+        first = self.sync(role='Admin', since=token, limit=2)
+        self.assertTrue(first['more'])
+        second = self.sync(role='Admin', since=first['next'], limit=2)
+        self.assertFalse(second['more'])
+        synced = [row['id'] for page in (first, second) for row in page['changes']['performance']['updated']]
+        self.assertEqual(synced, [performance.pk for performance in performances])
+
+    def test_cost_follows_the_changes(self):
+        token = self.sync()['next']
+        self.performance(self.other)
+        # Session, user, reset check and the log page: no change of the parent's, no records read
+        with self.assertNumQueries(4):
+            self.client.get('/api/sync/', {'since': token})
+
+    def test_rows_moved_out_of_scope_are_deleted(self):
+        performance = self.performance(self.student)
+        token = self.sync()['next']
+        performance.student = self.other
+        performance.save()
+        self.assertEqual(self.sync(since=token)['changes']['performance'], {'updated': [], 'deleted': [performance.pk]})
+
+    def test_role_models_and_bulk_writes(self):
+        token = self.sync(role='Teacher')['next']
+        self.client.force_login(self.users['Teacher'])
+        self.client.post(f'/api/grades/{self.student.grade_id}/attendance/2024-03-04/', {self.student.pk: 1}, content_type='application/json')
+        Invoice.objects.create(student=self.student, total_amount=1000, amount_due=1000, payment_due_date='2024-02-01', status='PENDING', academic_year=2024, term=1)
+        data = self.sync(role='Teacher', since=token)
+        # Teachers do not see invoices
+        self.assertEqual(list(data['changes']), ['attendance'])
+        self.assertEqual(data['changes']['attendance']['updated'][0]['student'], self.student.pk)
+
+    def test_unsettled_changes_are_held_back(self):
+        ChangeLog.objects.update(changed_at=timezone.now() - datetime.timedelta(minutes=1))
+        token = self.sync()['next']
+        performance = self.performance(self.student)
+        with patch.object(SyncAPIView, 'settle_seconds', 5):
+            # Its transaction may still be open, neither a page nor a new token goes past it
+            self.assertEqual(self.sync(since=token), {'changes': {}, 'next': token, 'more': False})
+            self.assertEqual(self.sync()['next'], token)
+        self.assertEqual([row['id'] for row in self.sync(since=token)['changes']['performance']['updated']], [performance.pk])
+
+    def test_reset_and_bad_tokens(self):
+        token = self.sync()['next']
+        changes.reset()
+        self.client.force_login(self.users['Parent'])
+        self.assertEqual(self.client.get('/api/sync/', {'since': token}).status_code, 410)
+        self.assertEqual(self.client.get('/api/sync/', {'since': 'nonsense'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/sync/', {'since': urlsafe_b64encode(b'{"c":true}').decode()}).status_code, 400)
+        self.assertEqual(self.sync(since=self.sync()['next'])['changes'], {})
+
+
+class SparseFieldsTests(TestCase):
+    '''?fields= and ?exclude= trim both the JSON and the SELECT'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.performance = Performance.objects.create(student=cls.student, subject=Subject.objects.get(), score=64,
+                                                     exam_type='CAT', academic_year=2024, term=1)
+
+    def get(self, url, role='Parent', **params):
+        self.client.force_login(self.users[role])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        return response, [query['sql'] for query in queries if 'records_performance' in query['sql'] or 'records_parent' in query['sql']]
+
+    def test_fields_trim_json_and_columns(self):
+        response, queries = self.get('/api/performances/', fields='id,score')
+        self.assertEqual(response.json()['results'], [{'id': self.performance.pk, 'score': 64}])
+        # Role scoped, no join to the student, no unused column
+        self.assertIn('records_studentaccess', queries[-1])
+        self.assertNotIn('records_student"."first_name', queries[-1])
+        self.assertNotIn('"exam_type"', queries[-1])
+
+    def test_related_display_fields_select_their_columns(self):
+        response, queries = self.get('/api/performances/', role='Admin', fields='id,student_name')
+        self.assertEqual(response.json()['results'], [{'id': self.performance.pk, 'student_name': 'Angela Kwamboka'}])
+        self.assertIn('records_student"."first_name', queries[-1])
+        self.assertNotIn('records_student"."address', queries[-1])
+
+        response, queries = self.get(f'/api/performances/{self.performance.pk}/', exclude='student_name,subject_name')
+        self.assertNotIn('student_name', response.json())
+        self.assertIn('exam_type', response.json())
+        self.assertNotIn('JOIN "records_student"', queries[-1])
+
+    def test_prefetches_of_left_out_fields_are_dropped(self):
+        response, queries = self.get('/api/parents/', fields='id,full_name')
+        self.assertEqual(list(response.json()['results'][0]), ['id', 'full_name'])
+        # The page alone, without the prefetch of the students
+        self.assertEqual(len(queries), 1)
+        response, queries = self.get('/api/parents/', fields='id,students')
+        self.assertEqual(response.json()['results'][0]['students'], [self.student.pk])
+
+    def test_unknown_fields_are_rejected(self):
+        response, _ = self.get('/api/students/', fields='id,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'fields': ['Unknown field "password".']})
+
+
+class ExpandTests(TestCase):
+    '''?expand= nests related records, one prefetch per edge, within the user's role scope'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.maths = Subject.objects.get()
+        for year in (2022, 2023, 2024):
+            Performance.objects.create(student=cls.student, subject=cls.maths, score=year - 1960, exam_type='CAT', academic_year=year, term=1)
+        Invoice.objects.create(student=cls.student, total_amount=1000, amount_due=1000, payment_due_date='2024-02-01',
+                               status='PENDING', academic_year=2024, term=1)
+
+    def get(self, url, role='Parent', **params):
+        self.client.force_login(self.users[role])
+        return self.client.get(url, params)
+
+    def test_parent_dashboard_in_one_request(self):
+        url = f'/api/students/{self.student.pk}/'
+        self.get(url, expand='grade.teacher')
+        self.client.force_login(self.users['Parent'])
+        # Session, user, student, one query per edge: grade, teacher, parents (and their
+        # students' ids), performance, then the object permission check
+        with self.assertNumQueries(9):
+            response = self.client.get(url, {'expand': 'grade.teacher,parents,performance'})
+        data = response.json()
+        self.assertEqual(data['grade']['teacher']['full_name'], 'Jane Teacher')
+        self.assertEqual([parent['full_name'] for parent in data['parents']], ['Mary Kwamboka'])
+        self.assertEqual([row['academic_year'] for row in data['performance']], [2024, 2023, 2022])
+        self.assertEqual(data['performance'][0]['subject_name'], 'Maths')
+
+    def test_lists_prefetch_per_edge_and_limit_to_many(self):
+        Student.objects.create(first_name='Brian', last_name='Otieno', gender='M', date_of_birth='2014-01-01', address='12 Valley Road',
+                               status='Enrolled', date_of_admission='2019-01-11', student_email='brian@example.com', grade=self.student.grade)
+        self.client.force_login(self.users['Admin'])
+        with patch('api.expand.ExpandMixin.expand_limit', 2):
+            with detect_n_plus_one('expand', threshold=2):
+                response = self.client.get('/api/students/', {'expand': 'performance,grade'})
+        rows = {row['first_name']: row for row in response.json()['results']}
+        self.assertEqual([row['academic_year'] for row in rows['Angela']['performance']], [2024, 2023])
+        self.assertEqual(rows['Brian']['performance'], [])
+        self.assertEqual(rows['Brian']['grade']['name'], self.student.grade.name)
+
+    def test_expansions_stay_in_the_role_scope(self):
+        # Teachers see students but not their invoices
+        response = self.get(f'/api/students/{self.student.pk}/', role='Teacher', expand='invoices')
+        self.assertEqual(response.json()['invoices'], [])
+        self.assertEqual(len(self.get(f'/api/students/{self.student.pk}/', expand='invoices').json()['invoices']), 1)
+
+    def test_expanded_records_change_the_etag(self):
+        url = f'/api/students/{self.student.pk}/'
+        etag = self.get(url, expand='grade.teacher')['ETag']
+        Teacher.objects.update(full_name='Jane Mwangi')
+        Teacher.objects.get().save()
+        response = self.client.get(url, {'expand': 'grade.teacher'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['grade']['teacher']['full_name'], 'Jane Mwangi')
+
+    def test_unknown_relations_are_rejected(self):
+        response = self.get('/api/students/', expand='grade.students')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'expand': ['"grade.students" cannot be expanded.']})
+
+
+class StudentRecordsTests(TestCase):
+    '''/api/students/<id>/performance/ and the other per-student lists'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        cls.other = Student.objects.create(first_name='Brian', last_name='Otieno', gender='M', date_of_birth='2014-01-01', address='12 Valley Road',
+                                           status='Enrolled', date_of_admission='2019-01-11', student_email='brian@example.com', grade=cls.student.grade)
+        maths = Subject.objects.get()
+        for student in (cls.student, cls.other):
+            for term in (1, 2, 3):
+                Performance.objects.create(student=student, subject=maths, score=60 + term, exam_type='CAT', academic_year=2024, term=term)
+        Invoice.objects.create(student=cls.student, total_amount=1000, amount_due=1000, payment_due_date='2024-02-01',
+                               status='PENDING', academic_year=2024, term=1)
+
+    def test_lists_the_students_records(self):
+        self.client.force_login(self.users['Parent'])
+        url = f'/api/students/{self.student.pk}/performance/'
+        self.client.get(url)
+        # Session, user, student, access check and the page
+        with self.assertNumQueries(5):
+            response = self.client.get(url, {'page_size': 2, 'fields': 'id,term'})
+        data = response.json()
+        self.assertEqual(data['results'], [{'id': row.pk, 'term': row.term} for row in self.student.performance.order_by('term')[:2]])
+        self.assertIn(f'/api/students/{self.student.pk}/performance/?', data['next'])
+        self.assertEqual([row['term'] for row in self.client.get(data['next']).json()['results']], [3])
+
+    def test_the_student_is_authorized_once(self):
+        self.client.force_login(self.users['Parent'])
+        self.assertEqual(self.client.get(f'/api/students/{self.other.pk}/performance/').status_code, 404)
+        self.assertEqual(len(self.client.get(f'/api/students/{self.student.pk}/invoices/').json()['results']), 1)
+        # Teachers see the student, not the invoices
+        self.client.force_login(self.users['Teacher'])
+        self.assertEqual(self.client.get(f'/api/students/{self.student.pk}/invoices/').json()['results'], [])
+        self.assertEqual(len(self.client.get(f'/api/students/{self.other.pk}/performance/').json()['results']), 3)
+
+
+class FilterTests(TestCase):
+    '''Declared, index-backed query parameter filters on the api lists'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        maths = Subject.objects.get()
+        for year in (2023, 2024):
+            for exam_type in ('CAT', 'FINAL'):
+                Performance.objects.create(student=cls.student, subject=maths, score=70, exam_type=exam_type, academic_year=year, term=1)
+        for day in (4, 5, 6):
+            Attendance.objects.create(student=cls.student, grade=cls.student.grade, date=datetime.date(2024, 3, day), status=day % 2)
+
+    def get(self, url, role='Admin', **params):
+        self.client.force_login(self.users[role])
+        return self.client.get(url, params)
+
+    def test_filters(self):
+        results = self.get('/api/performances/', academic_year=2024, exam_type='FINAL').json()['results']
+        self.assertEqual([(row['academic_year'], row['exam_type']) for row in results], [(2024, 'FINAL')])
+        results = self.get('/api/attendances/', date_after='2024-03-05', status=1).json()['results']
+        self.assertEqual([row['date'] for row in results], ['2024-03-05'])
+        self.assertEqual(len(self.get('/api/students/', status='Alumni').json()['results']), 0)
+
+    def test_unindexed_combinations_are_rejected(self):
+        response = self.get('/api/performances/', exam_type='FINAL')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('academic_year', response.json()['filters'][0])
+        self.assertEqual(self.get('/api/attendances/', status=1).status_code, 400)
+        # Rows already narrowed to a student
+        self.assertEqual(len(self.get('/api/performances/', role='Parent', exam_type='FINAL').json()['results']), 2)
+        response = self.get(f'/api/students/{self.student.pk}/attendance/', status=0)
+        self.assertEqual([row['date'] for row in response.json()['results']], ['2024-03-04', '2024-03-06'])
+        # Gender alone would scan the whole students table, with a status or class it is indexed
+        response = self.get('/api/students/', gender='M')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.json()['filters'][0])
+        self.assertEqual(self.get('/api/students/', gender='M', status='Enrolled').status_code, 200)
+        self.assertEqual(self.get('/api/grades/', stream='East').status_code, 400)
+        self.assertEqual(self.get('/api/grades/', name=1, stream='East').status_code, 200)
+
+    def test_invalid_values(self):
+        response = self.get('/api/attendances/', date_after='March', grade=self.student.grade_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'date_after': ['Enter a valid value.']})
+
+
+class ValuesListTests(TestCase):
+    '''Lists read with values() give the same JSON as the serializers, without running them'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = create_role_users()
+        cls.student = Student.objects.get()
+        subject = Subject.objects.get()
+        for term in (1, 2):
+            Performance.objects.create(student=cls.student, subject=subject, score=60 + term, exam_type='CAT', academic_year=2024, term=term)
+        for day in (4, 5):
+            Attendance.objects.create(student=cls.student, grade=cls.student.grade, date=datetime.date(2024, 3, day), status=day % 2)
+        invoice = Invoice.objects.create(student=cls.student, total_amount='15000.5', amount_due='7000', payment_due_date=datetime.date(2024, 2, 1),
+                                         status='PENDING', academic_year=2024, term=1)
+        Payment.objects.create(invoice=invoice, amount_paid='8000.50', payment_method='MPESA', payment_date=datetime.date(2024, 1, 20), reference_number='QX12')
+        Enrollment.objects.create(student=cls.student, grade=cls.student.grade, academic_year=2024, date_enrolled=datetime.date(2024, 1, 8), status='ENROLLED')
+
+    def get(self, url, role='Admin'):
+        self.client.force_login(self.users[role])
+        return self.client.get(url)
+
+    def test_same_json_as_the_serializers(self):
+        urls = ['/api/students/', '/api/performances/', '/api/attendances/', '/api/invoices/', '/api/payments/', '/api/enrollments/',
+                f'/api/students/{self.student.pk}/attendance/', '/api/performances/?fields=id,student_name,subject_name&page_size=1',
+                '/api/attendances/?exclude=grade_name,date']
+        for role in ('Admin', 'Parent'):
+            for url in urls:
+                with self.subTest(url=url, role=role):
+                    response = self.get(url, role)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertTrue(response.json()['results'])
+                    with patch('api.rows.ValuesListMixin.fast_list', False):
+                        self.assertEqual(self.get(url, role).content, response.content)
+
+    def test_reference_versions_checked_once_per_request(self):
+        with patch('records.cache.get_versions', wraps=records_cache.get_versions) as get_versions:
+            with patch('api.rows.ValuesListMixin.fast_list', False):
+                response = self.get('/api/performances/?fields=id,subject_name')
+        self.assertEqual([row['subject_name'] for row in response.json()['results']], ['Maths', 'Maths'])
+        self.assertEqual(sum(call.args[0] == reference.REFERENCE_MODELS for call in get_versions.call_args_list), 1)
+
+    def test_serializer_only_runs_for_expanded_lists(self):
+        with patch.object(AttendanceSerializer, 'to_representation') as to_representation:
+            self.get('/api/attendances/')
+            to_representation.assert_not_called()
+        response = self.get('/api/attendances/?expand=student')
+        self.assertEqual(response.json()['results'][0]['student']['full_name'], 'Angela Kwamboka')
@@ -1,11 +1,33 @@
+import datetime
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from django.shortcuts import render
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import FilteredRelation, Prefetch, Q
 from rest_framework import viewsets
-from records.models import Student, Parent, Grade, Teacher, Performance, Attendance, Invoice, Payment, Enrollment, Subject
-from .serializers import StudentSerializer, ParentSerializer, GradeSerializer, TeacherSerializer, PerformanceSerializer, AttendanceSerializer, InvoiceSerializer, PaymentSerializer, EnrollmentSerializer, SubjectSerializer, UserRegistrationSerializer
-from .permissions import AllRecordsPermission
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from django.core.exceptions import ValidationError as DjangoValidationError
+from records.models import Student, Parent, Grade, Teacher, Performance, Attendance, Invoice, Payment, Enrollment, Subject, StudentAccess, ChangeLog
+from .serializers import StudentSerializer, ParentSerializer, GradeSerializer, TeacherSerializer, PerformanceSerializer, AttendanceSerializer, InvoiceSerializer, PaymentSerializer, EnrollmentSerializer, SubjectSerializer, UserRegistrationSerializer, GradebookSerializer
+from .permissions import AllRecordsPermission, ClassTeacherPermission, TeacherOrAdminPermission
+from .bulk import BulkCreateMixin
+from .exports import ExportMixin
+from .conditional import ConditionalGetMixin
+from .sparse import SparseFieldsMixin
+from .expand import ExpandMixin
+from .rows import ValuesListMixin
+from .pagination import AttendanceCursorPagination, AcademicTermCursorPagination, PaymentCursorPagination, EnrollmentCursorPagination
 from records.views import is_admin, is_student, is_teacher, is_parent
+from records.roles import visible_parents
+from records.gradebook import Gradebook, editable_subjects, gradebook_subjects
+from records import cache as records_cache
+from records import reference
+from records import changes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework import generics
+from rest_framework.views import APIView
 from accounts.models import CustomUser
 from rest_framework.response import Response
 from rest_framework import status
@@ -33,78 +55,219 @@ class UserRegistrationAPIView(generics.CreateAPIView):
         }, status=201)
 
 
+# Accepted roll call statuses, 1 and 0 also match true and false
+ROLL_CALL_STATUSES = {1: 1, 0: 0, 'present': 1, 'absent': 0, '1': 1, '0': 0}
+
+
+def parse_roll_call(data):
+    '''Validates a roll call payload into {student id: 1 (present) or 0 (absent)}'''
+    if not isinstance(data, dict) or not data:
+        raise ValidationError('Expected a map of student id to present/absent.')
+    marks, errors = {}, []
+    for key, value in data.items():
+        try:
+            student_id = int(key)
+        except (TypeError, ValueError):
+            errors.append(f'"{key}" is not a student id.')
+            continue
+        status_value = None
+        if isinstance(value, (str, int)):
+            status_value = ROLL_CALL_STATUSES.get(value.lower() if isinstance(value, str) else value)
+        if status_value is None:
+            errors.append(f'"{value}" is not a valid status for student {key}.')
+            continue
+        marks[student_id] = status_value
+    if errors:
+        raise ValidationError({'students': errors})
+    return marks
+
+
+def encode_sync_token(sequence):
+    return urlsafe_b64encode(json.dumps({'c': sequence}, separators=(',', ':')).encode()).decode('ascii')
+
+
+def decode_sync_token(token):
+    '''The change sequence number of a token from /api/sync/'''
+    try:
+        sequence = json.loads(urlsafe_b64decode(token.encode('ascii')))['c']
+        # type() rather than isinstance(): json gives True/False for true/false, which are ints too
+        if type(sequence) is not int or sequence < 0:
+            raise ValueError('bad sequence')
+        return sequence
+    except (TypeError, ValueError, KeyError, UnicodeError):
+        raise ValidationError({'since': 'Invalid sync token.'})
+
+
 # DRF ViewSet views- do all CRUD operations
 # =========================================
 # Student ViewSet view
-class StudentViewSet(viewsets.ModelViewSet):
+class StudentViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, ExportMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = StudentSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    query_filters = {'status': 'status', 'grade': 'grade', 'gender': 'gender'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''Restrict students and parents to view of their own/their children's records'''
         user = self.request.user
 
-        # For students
-        if is_student(user):
-            return Student.objects.filter(user=user)
-        # For parents
-        elif is_parent(user):
-            return Student.objects.filter(parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return Student.objects.filter(pk__in=StudentAccess.student_ids(user))
         # For teacher and admin
         elif is_admin(user) or is_teacher(user):
             return Student.objects.all()
         else:
             return Student.objects.none()
 
+    def student_records(self, request, viewset_class):
+        '''
+        The student's records served by viewset_class, as its list: the student is looked up
+        and authorized once, then the records are read through their student index, scoped,
+        filtered, paginated and serialized by viewset_class
+        '''
+        student = self.get_object()
+        viewset = viewset_class(request=request, args=(), kwargs={}, format_kwarg=self.format_kwarg, action='list')
+        viewset.parent_lookup = {'student': student.pk}
+        return viewset.list(request)
+
+    @action(detail=True, methods=['get'])
+    def enrollments(self, request, pk=None):
+        return self.student_records(request, EnrollmentViewSet)
+
+    @action(detail=True, methods=['get'])
+    def performance(self, request, pk=None):
+        return self.student_records(request, PerformanceViewSet)
+
+    @action(detail=True, methods=['get'])
+    def attendance(self, request, pk=None):
+        return self.student_records(request, AttendanceViewSet)
+
+    @action(detail=True, methods=['get'])
+    def invoices(self, request, pk=None):
+        return self.student_records(request, InvoiceViewSet)
+
 
 # Parent ViewSet view
-class ParentViewSet(viewsets.ModelViewSet):
+class ParentViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = ParentSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
     
     def get_queryset(self):
         '''Restrict parents/students to view of their own/their parent's records'''
-        user = self.request.user
-
-        # For students
-        if is_student(user):
-            return Parent.objects.filter(user=user)
-        # For parents
-        elif is_parent(user):
-            return Parent.objects.filter(students__student__user=user)
-        # For teacher and admin
-        elif is_teacher(user) or is_admin(user):
-            return Parent.objects.all()
-        else:
-            return Parent.objects.none()
+        # Student ids of every parent on the page in one query
+        parents = Parent.objects.prefetch_related(Prefetch('students', queryset=Student.objects.only('pk')))
+        return visible_parents(self.request.user, parents)
 
 
 # Grade ViewSet view
-class GradeViewSet(viewsets.ModelViewSet):
+class GradeViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = GradeSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    query_filters = {'name': 'name', 'stream': 'stream', 'teacher': 'teacher'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''Restrict parents/students to view of their own/their parent's records'''
         user = self.request.user
 
-        # For students
-        if is_student(user):
-            return Grade.objects.filter(students=user.student_profile)
-        # For parents
-        elif is_parent(user):
-            return Grade.objects.filter(students__in=user.parent_profile.students.all())
+        # For students and parents, the classes of the students in their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return Grade.objects.filter(pk__in=Student.objects.filter(pk__in=StudentAccess.student_ids(user)).values('grade'))
         # For teacher and admin
         elif is_teacher(user) or is_admin(user):
             return Grade.objects.all()
         else:
             return Grade.objects.none()
 
+    @action(detail=True, methods=['get', 'post'], url_path=r'attendance/(?P<date>\d{4}-\d{2}-\d{2})',
+            permission_classes=[IsAuthenticated, ClassTeacherPermission])
+    def roll_call(self, request, pk=None, date=None):
+        '''
+        GET: the class roster with each student's mark for the day, in one query
+        POST: marks the whole class at once from a {student id: status} map, status being
+        1/0, true/false or "present"/"absent". Membership is checked against Grade.students
+        in one query and all marks are upserted in one statement, so concurrent roll calls
+        of different classes only ever touch their own students' rows
+        '''
+        try:
+            day = datetime.date.fromisoformat(date)
+        except ValueError:
+            raise ValidationError({'date': 'Enter a valid date.'})
+        grade = self.get_object()
+
+        if request.method == 'POST':
+            marks = parse_roll_call(request.data)
+            members = set(grade.students.filter(pk__in=marks).order_by().values_list('pk', flat=True))
+            outsiders = sorted(set(marks) - members)
+            if outsiders:
+                raise ValidationError({'students': [f'Student {pk} is not in this class.' for pk in outsiders]})
+            rows = [Attendance(grade=grade, student_id=student_id, date=day, status=mark) for student_id, mark in marks.items()]
+            with transaction.atomic():
+                changes.upsert(Attendance, rows, ['student', 'date'], ['grade', 'status', 'updated_at'])
+                records_cache.bump(Attendance, {f'grade:{grade.pk}'} | {f'student:{pk}' for pk in marks})
+
+        def load_roster():
+            roster = (grade.students.order_by('last_name', 'first_name', 'pk')
+                      .annotate(mark=FilteredRelation('attendance', condition=Q(attendance__date=day)))
+                      .values('id', 'first_name', 'last_name', 'mark__status'))
+            return [{'student': row['id'], 'first_name': row['first_name'], 'last_name': row['last_name'],
+                     'status': row['mark__status']} for row in roster]
+
+        scope = f'grade:{grade.pk}'
+        students = records_cache.cached(f'roster:{grade.pk}:{day}', [(Student, scope), (Attendance, scope)], load_roster)
+        return Response({'grade': grade.pk, 'date': day, 'students': students})
+
+    @action(detail=True, methods=['get', 'post'], permission_classes=[IsAuthenticated, TeacherOrAdminPermission])
+    def gradebook(self, request, pk=None):
+        '''
+        GET ?exam_type=&academic_year=&term=[&subject=]: the class's score matrix for the exam,
+        every student against the subjects the teacher teaches, every subject for admins (or the
+        one subject), in one aggregated query
+        POST the same fields in the body with "scores": [{"student", "subject", "score"}, ...]
+        to save the changed cells in one upsert. Teachers enter scores for the subjects they teach
+        '''
+        serializer = GradebookSerializer(data=request.query_params if request.method == 'GET' else request.data)
+        serializer.is_valid(raise_exception=True)
+        exam = serializer.validated_data
+        if 'subject' in exam:
+            subjects = [reference.get(Subject, exam['subject'])]
+            if subjects[0] is None:
+                raise ValidationError({'subject': f'Subject {exam["subject"]} does not exist.'})
+        else:
+            subjects = gradebook_subjects(request.user)
+        gradebook = Gradebook(self.get_object(), exam['exam_type'], exam['academic_year'], exam['term'], subjects)
+        editable = editable_subjects(request.user, gradebook.subjects)
+
+        if request.method == 'POST':
+            cells = {}
+            for cell in exam.get('scores', []):
+                key = (cell['student'], cell['subject'])
+                if key in cells:
+                    raise ValidationError({'scores': f'Student {key[0]} has more than one score for subject {key[1]}.'})
+                cells[key] = cell['score']
+            try:
+                gradebook.save(cells, editable)
+            except DjangoValidationError as error:
+                raise ValidationError({'scores': error.messages})
+
+        return Response({
+            'grade': gradebook.grade.pk,
+            'exam_type': gradebook.exam_type,
+            'academic_year': gradebook.academic_year,
+            'term': gradebook.term,
+            'subjects': [{'subject': subject.pk, 'name': subject.name, 'editable': editable is None or subject.pk in editable}
+                         for subject in gradebook.subjects],
+            'students': [{'student': row['id'], 'first_name': row['first_name'], 'last_name': row['last_name'],
+                          'scores': row['scores']} for row in gradebook.rows()],
+        })
+
 
 # Subject ViewSet view
-class SubjectViewSet(viewsets.ModelViewSet):
+class SubjectViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = SubjectSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    query_filters = {'teacher': 'teacher'}
     
     def get_queryset(self):
         '''All roles can see Subject model information'''
@@ -112,7 +275,7 @@ class SubjectViewSet(viewsets.ModelViewSet):
 
 
 # Teacher ViewSet view
-class TeacherViewSet(viewsets.ModelViewSet):
+class TeacherViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, ExportMixin, viewsets.ModelViewSet):
     serializer_class = TeacherSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
     
@@ -122,119 +285,222 @@ class TeacherViewSet(viewsets.ModelViewSet):
 
 
 # Performance ViewSet view
-class PerformanceViewSet(viewsets.ModelViewSet):
+class PerformanceViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, BulkCreateMixin, ExportMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = PerformanceSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    pagination_class = AcademicTermCursorPagination
+    bulk_unique_fields = ('student', 'subject', 'exam_type', 'academic_year', 'term')
+    query_filters = {'academic_year': 'academic_year', 'term': 'term', 'exam_type': 'exam_type', 'subject': 'subject', 'student': 'student'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''
         Restrict students and parents to view of their own/their children's performance records
         '''
         user = self.request.user
+        performances = Performance.objects.select_related('student')
 
-        # For students
-        if is_student(user):
-            return Performance.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Performance.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return performances.filter(student__in=StudentAccess.student_ids(user))
         # For teacher and admin
         elif is_teacher(user) or is_admin(user):
-            return Performance.objects.all()
+            return performances.all()
         else:
             return Performance.objects.none()
             
 
 # Attendance ViewSet view
-class AttendanceViewSet(viewsets.ModelViewSet):
+class AttendanceViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, BulkCreateMixin, ExportMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = AttendanceSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    pagination_class = AttendanceCursorPagination
+    bulk_unique_fields = ('student', 'date')
+    query_filters = {'grade': 'grade', 'student': 'student', 'status': 'status', 'date': 'date', 'date_after': 'date__gte', 'date_before': 'date__lte'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''
         Restrict students and parents to view of their own/their children's attendance records
         '''
         user = self.request.user
+        attendances = Attendance.objects.select_related('student')
 
-        # For students
-        if is_student(user):
-            return Attendance.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Attendance.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return attendances.filter(student__in=StudentAccess.student_ids(user))
         # For teacher and admin
         elif is_teacher(user) or is_admin(user):
-            return Attendance.objects.all()
+            return attendances.all()
         else:
             return Attendance.objects.none()
 
 
 # Invoice ViewSet view
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, BulkCreateMixin, ExportMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = InvoiceSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    pagination_class = AcademicTermCursorPagination
+    query_filters = {'status': 'status', 'academic_year': 'academic_year', 'term': 'term', 'student': 'student',
+                     'due_after': 'payment_due_date__gte', 'due_before': 'payment_due_date__lte'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''
         Restrict students and parents to view of their own/their children's invoice records
         '''
         user = self.request.user
+        invoices = Invoice.objects.select_related('student')
 
-        # For students
-        if is_student(user):
-            return Invoice.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Invoice.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return invoices.filter(student__in=StudentAccess.student_ids(user))
         # For admin
         elif is_admin(user):
-            return Invoice.objects.all()
+            return invoices.all()
         else:
             return Invoice.objects.none()
 
 
 # Payment ViewSet view
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, ExportMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    pagination_class = PaymentCursorPagination
+    query_filters = {'invoice': 'invoice', 'payment_method': 'payment_method', 'paid_after': 'payment_date__gte', 'paid_before': 'payment_date__lte'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''
         Restrict students and parents to view of their own/their children's payment records
         '''
         user = self.request.user
+        payments = Payment.objects.select_related('invoice__student')
 
-        # For students
-        if is_student(user):
-            return Payment.objects.filter(invoice__student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Payment.objects.filter(invoice__student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return payments.filter(invoice__student__in=StudentAccess.student_ids(user))
         # For admin
         elif is_admin(user):
-            return Payment.objects.all()
+            return payments.all()
         else:
             return Payment.objects.none()
 
 # Enrollment ViewSet view
-class EnrollmentViewSet(viewsets.ModelViewSet):
+class EnrollmentViewSet(ExpandMixin, ConditionalGetMixin, SparseFieldsMixin, BulkCreateMixin, ExportMixin, ValuesListMixin, viewsets.ModelViewSet):
     serializer_class = EnrollmentSerializer
     permission_classes = [IsAuthenticated, AllRecordsPermission]
+    pagination_class = EnrollmentCursorPagination
+    bulk_unique_fields = ('student', 'grade', 'academic_year')
+    query_filters = {'grade': 'grade', 'student': 'student', 'academic_year': 'academic_year', 'status': 'status'}
+    filters_require_index = True
     
     def get_queryset(self):
         '''
         Restrict students and parents to view of their own/their children's enrollment records
         '''
         user = self.request.user
+        enrollments = Enrollment.objects.select_related('student')
 
-        # For students
-        if is_student(user):
-            return Enrollment.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Enrollment.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return enrollments.filter(student__in=StudentAccess.student_ids(user))
         # For teacher and admin
         elif is_teacher(user) or is_admin(user):
-            return Enrollment.objects.all()
+            return enrollments.all()
         else:
             return Enrollment.objects.none()
+
+
+# Sync API view
+class SyncAPIView(APIView):
+    '''
+    GET ?since=<token>[&limit=]: the synced records (records/changes.py) the user may see that
+    were created, changed or deleted after the token, as {"changes": {model: {"updated": [records],
+    "deleted": [ids]}}, "next": token, "more": bool}. The change log is read in sequence order,
+    limit entries at a time, with one query for the page and one per model with updated rows,
+    whatever the size of the tables. A row that left the user's scope is reported deleted.
+    Without since, only the token of the current end of the log: take it, download the
+    collections, then sync from it. 410 when the token predates a reset of the log.
+    Log ids are taken at INSERT but only visible at COMMIT, so a write whose transaction commits
+    late can land below a token already handed out and be skipped by it. Entries younger than
+    settle_seconds, and everything after them, are held back until a later request; a
+    transaction left open longer than that between its write and its commit can still be missed
+    '''
+    permission_classes = [IsAuthenticated]
+    # Records, scoped and serialized as by their viewsets
+    synced_viewsets = (StudentViewSet, AttendanceViewSet, PerformanceViewSet, InvoiceViewSet, PaymentViewSet, EnrollmentViewSet)
+    default_limit = 500
+    max_limit = 5000
+    settle_seconds = 5
+
+    def get_viewsets(self, request):
+        '''{model name: viewset} of the synced models the user may see'''
+        viewsets_by_model = {}
+        for viewset_class in self.synced_viewsets:
+            viewset = viewset_class(request=request, args=(), kwargs={}, format_kwarg=None, action='list')
+            queryset = viewset.get_queryset()
+            if not queryset.query.is_empty():
+                viewsets_by_model[queryset.model._meta.model_name] = viewset
+        return viewsets_by_model
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Enter a whole number.'})
+        return max(1, min(limit, self.max_limit))
+
+    def settled_before(self):
+        '''Log entries changed after this are not handed out yet'''
+        return timezone.now() - datetime.timedelta(seconds=self.settle_seconds)
+
+    def start_sequence(self):
+        '''The end of the log, short of its newest unsettled entries'''
+        settled_before = self.settled_before()
+        sequence = 0
+        for pk, changed_at in ChangeLog.objects.order_by('-pk').values_list('pk', 'changed_at')[:self.max_limit]:
+            if changed_at <= settled_before:
+                return pk
+            sequence = pk - 1
+        return sequence
+
+    def get(self, request, *args, **kwargs):
+        if 'since' not in request.query_params:
+            return Response({'changes': {}, 'next': encode_sync_token(self.start_sequence()), 'more': False})
+        since = decode_sync_token(request.query_params['since'])
+        limit = self.get_limit(request)
+        if ChangeLog.objects.filter(model=ChangeLog.RESET, pk__gt=since).exists():
+            return Response({'detail': 'The records were reloaded since this token, download them again.'}, status=status.HTTP_410_GONE)
+
+        user = request.user
+        viewsets_by_model = self.get_viewsets(request)
+        log = ChangeLog.objects.filter(pk__gt=since, model__in=list(viewsets_by_model))
+        # Students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            log = log.filter(student_id__in=StudentAccess.student_ids(user))
+        entries = list(log.order_by('pk').values_list('pk', 'model', 'object_id', 'deleted', 'changed_at')[:limit + 1])
+        more = len(entries) > limit
+        entries = entries[:limit]
+        # The page stops at the first unsettled entry, the client asks again later
+        settled_before = self.settled_before()
+        for index, entry in enumerate(entries):
+            if entry[4] > settled_before:
+                entries, more = entries[:index], False
+                break
+
+        # Latest change of each record on the page
+        latest = {}
+        for _, model_name, object_id, deleted, _ in entries:
+            latest.setdefault(model_name, {})[object_id] = deleted
+        delta = {}
+        for model_name, records in latest.items():
+            viewset = viewsets_by_model[model_name]
+            updated_ids = [pk for pk, deleted in records.items() if not deleted]
+            updated = list(viewset.get_queryset().filter(pk__in=updated_ids).order_by('pk')) if updated_ids else []
+            found = {obj.pk for obj in updated}
+            delta[model_name] = {
+                'updated': viewset.get_serializer(updated, many=True).data,
+                'deleted': sorted(pk for pk in records if pk not in found),
+            }
+        return Response({'changes': delta, 'next': encode_sync_token(entries[-1][0] if entries else since), 'more': more})
@@ -1,30 +1,61 @@
 from django.contrib import admin
 from .models import Grade, Invoice, Parent, Subject, Teacher, Payment, Enrollment, Attendance, StudentParent, Performance, Student, UserProfile
+from .pagination import RecordsPaginator
 
-class StudentAdmin(admin.ModelAdmin):
+class RecordsAdmin(admin.ModelAdmin):
+    '''
+    Changelists counted by RecordsPaginator, without the second count
+    of the whole unfiltered table next to the filtered one
+    '''
+    paginator = RecordsPaginator
+    show_full_result_count = False
+
+class StudentAdmin(RecordsAdmin):
     list_display = ('first_name', 'last_name', 'gender', 'date_of_birth',  'status', 'grade')
+    list_select_related = ('grade',)
 
-class GradeAdmin(admin.ModelAdmin):
+class GradeAdmin(RecordsAdmin):
     list_display = ('name', 'stream', 'teacher')
+    list_select_related = ('teacher',)
 
-class TeacherAdmin(admin.ModelAdmin):
+class TeacherAdmin(RecordsAdmin):
     list_display = ('full_name',)
 
-class UserProfileAdmin(admin.ModelAdmin):
+class PerformanceAdmin(RecordsAdmin):
+    list_display = ('student', 'subject', 'academic_year', 'term', 'exam_type', 'score')
+    list_select_related = ('student', 'subject')
+
+class AttendanceAdmin(RecordsAdmin):
+    list_display = ('student', 'grade', 'date', 'status')
+    list_select_related = ('student', 'grade')
+
+class InvoiceAdmin(RecordsAdmin):
+    list_display = ('student', 'academic_year', 'term', 'status', 'payment_due_date')
+    list_select_related = ('student',)
+
+class PaymentAdmin(RecordsAdmin):
+    list_display = ('invoice', 'amount_paid', 'payment_method', 'payment_date')
+    list_select_related = ('invoice',)
+
+class EnrollmentAdmin(RecordsAdmin):
+    list_display = ('student', 'grade', 'academic_year', 'status')
+    list_select_related = ('student', 'grade')
+
+class UserProfileAdmin(RecordsAdmin):
     list_display = ('user', 'role')
     list_filter = ('role',)
     search_fields = ('user__username',)
 
 # Register your models here.
 admin.site.register(Student, StudentAdmin)
-admin.site.register(Parent)
-admin.site.register(StudentParent)
+admin.site.register(Parent, RecordsAdmin)
+admin.site.register(StudentParent, RecordsAdmin)
 admin.site.register(Teacher, TeacherAdmin)
-admin.site.register(Subject)
-admin.site.register(Performance)
-admin.site.register(Attendance)
-admin.site.register(Invoice)
-admin.site.register(Payment)
-admin.site.register(Enrollment)
+admin.site.register(Subject, RecordsAdmin)
+admin.site.register(Performance, PerformanceAdmin)
+admin.site.register(Attendance, AttendanceAdmin)
+admin.site.register(Invoice, InvoiceAdmin)
+admin.site.register(Payment, PaymentAdmin)
+admin.site.register(Enrollment, EnrollmentAdmin)
 admin.site.register(Grade, GradeAdmin)
 admin.site.register(UserProfile, UserProfileAdmin)
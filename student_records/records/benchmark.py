@@ -0,0 +1,221 @@
+import gc
+import math
+import time
+
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.template.base import Template
+from rest_framework import serializers
+from accounts.models import CustomUser
+from .generator import SchoolGenerator
+from .models import Student, Parent, Grade, Teacher, Subject, Performance, Attendance, Invoice, Payment, Enrollment, StudentAccess, UserProfile
+
+ROLES = ['Admin', 'Teacher', 'Student', 'Parent', 'Pending']
+BENCHMARK_PASSWORD = 'Benchmark123##'
+
+
+def seed(students=100, seed_value=1):
+    '''
+    Fills the (test) database with a small school from SchoolGenerator, with ten school days of
+    attendance a term, plus one user per role: the teacher is the class teacher of the student,
+    the parent one of the student's parents. Returns {role: user}
+    '''
+    SchoolGenerator(students=students, school_days=10, seed=seed_value).generate()
+    users = {}
+    for i, role in enumerate(ROLES):
+        user = CustomUser.objects.create_user(username=f'bench_{role.lower()}', password=BENCHMARK_PASSWORD, phone_number=f'2547990000{i:02d}')
+        UserProfile.objects.create(user=user, role=role)
+        users[role] = user
+
+    student = Student.objects.filter(status='Enrolled', parents__isnull=False).order_by('pk').first()
+    Student.objects.filter(pk=student.pk).update(user=users['Student'])
+    Teacher.objects.filter(pk=student.grade.teacher_id).update(user=users['Teacher'])
+    Parent.objects.filter(pk=student.parents.order_by('pk').values('parent')[:1]).update(user=users['Parent'])
+    StudentAccess.sync()
+    return users
+
+
+def sample_objects(users):
+    '''One record per model that every role may see: the benchmark student's own records'''
+    student = Student.objects.get(user=users['Student'])
+    return {
+        Student: student,
+        Parent: Parent.objects.get(user=users['Parent']),
+        Grade: student.grade,
+        Teacher: student.grade.teacher,
+        Subject: Subject.objects.order_by('pk').first(),
+        Performance: student.performance.order_by('pk').first(),
+        Attendance: student.attendance.order_by('pk').first(),
+        Invoice: student.invoices.order_by('pk').first(),
+        Payment: Payment.objects.filter(invoice__student=student).order_by('pk').first(),
+        Enrollment: student.enrollments.order_by('pk').first(),
+    }
+
+
+def api_routes(samples):
+    '''(name, url) of the list, detail and GET extra actions of every viewset registered in api/urls.py'''
+    from api.urls import router
+    exam = '?exam_type=CAT&academic_year=2024&term=1'
+    action_urls = {
+        'export': lambda basename, obj: reverse(f'{basename}-export'),
+        'roll_call': lambda basename, obj: reverse(f'{basename}-roll-call', args=[obj.pk, '2024-01-15']),
+        'gradebook': lambda basename, obj: reverse(f'{basename}-gradebook', args=[obj.pk]) + exam,
+        'enrollments': lambda basename, obj: reverse(f'{basename}-enrollments', args=[obj.pk]),
+        'performance': lambda basename, obj: reverse(f'{basename}-performance', args=[obj.pk]),
+        'attendance': lambda basename, obj: reverse(f'{basename}-attendance', args=[obj.pk]),
+        'invoices': lambda basename, obj: reverse(f'{basename}-invoices', args=[obj.pk]),
+    }
+    routes = []
+    for prefix, viewset, basename in router.registry:
+        model = viewset.serializer_class.Meta.model
+        routes.append((f'{basename}-list', reverse(f'{basename}-list')))
+        routes.append((f'{basename}-detail', reverse(f'{basename}-detail', args=[samples[model].pk])))
+        for extra in viewset.get_extra_actions():
+            if 'get' in extra.mapping and extra.__name__ in action_urls:
+                routes.append((f'{basename}-{extra.url_name}', action_urls[extra.__name__](basename, samples[model])))
+    return routes
+
+
+def records_routes(samples):
+    '''(name, url) of every list and detail view in records/urls.py'''
+    from .urls import urlpatterns
+    routes = []
+    for pattern in urlpatterns:
+        if pattern.name.endswith('_list'):
+            routes.append((pattern.name, reverse(pattern.name)))
+        elif pattern.name.endswith('_detail'):
+            routes.append((pattern.name, reverse(pattern.name, args=[samples[pattern.callback.view_class.model].pk])))
+    return routes
+
+
+class Timed:
+    '''
+    Adds up the time spent in the outermost call of the wrapped methods/properties while active,
+    e.g. serializer.data or Template.render, which nest into each other
+    '''
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.elapsed = 0.0
+        self.depth = 0
+        self.originals = []
+
+    def wrap(self, func):
+        def timed(*args, **kwargs):
+            self.depth += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.depth -= 1
+                if not self.depth:
+                    self.elapsed += time.perf_counter() - start
+        return timed
+
+    def __enter__(self):
+        for owner, name in self.targets:
+            original = owner.__dict__[name]
+            self.originals.append((owner, name, original))
+            if isinstance(original, property):
+                setattr(owner, name, property(self.wrap(original.fget)))
+            else:
+                setattr(owner, name, self.wrap(original))
+        return self
+
+    def __exit__(self, *exc_info):
+        for owner, name, original in reversed(self.originals):
+            setattr(owner, name, original)
+        self.originals = []
+
+
+class QueryTimer:
+    '''connection.execute_wrapper counting the queries of a request and the time spent running them'''
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.elapsed += time.perf_counter() - start
+            self.count += 1
+
+
+def percentile(values, fraction):
+    '''Nearest-rank percentile'''
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def measure(client, url, repeat, headers=None):
+    '''Requests url repeat times after a warm-up request and summarises the runs'''
+    headers = headers or {}
+    client.get(url, **headers)
+    # Garbage left by the previous route is not billed to this one
+    gc.collect()
+    walls, sql, rendering, queries, status = [], [], [], [], None
+    for _ in range(repeat):
+        timer = Timed([(serializers.Serializer, 'data'), (serializers.ListSerializer, 'data'), (Template, 'render')])
+        query_timer = QueryTimer()
+        with connection.execute_wrapper(query_timer), timer:
+            start = time.perf_counter()
+            response = client.get(url, **headers)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            walls.append(time.perf_counter() - start)
+        sql.append(query_timer.elapsed)
+        rendering.append(timer.elapsed)
+        queries.append(query_timer.count)
+        status = response.status_code
+    return {
+        'status': status,
+        # Fewest queries of the runs: a role cache entry expiring mid-run is not the route's doing
+        'queries': min(queries),
+        'sql_ms': round(percentile(sql, 0.5) * 1000, 2),
+        'serialize_ms': round(percentile(rendering, 0.5) * 1000, 2),
+        'p50_ms': round(percentile(walls, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(walls, 0.95) * 1000, 2),
+    }
+
+
+def run(users, repeat=10):
+    '''
+    Every api route (JWT authenticated) and records list/detail view (session authenticated)
+    as every role: {"<route name> as <role>": {status, queries, sql_ms, serialize_ms, p50_ms, p95_ms}}
+    '''
+    from api.authentication import RoleRefreshToken
+    samples = sample_objects(users)
+    results = {}
+    for role, user in users.items():
+        client = Client()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {RoleRefreshToken.for_user(user).access_token}'}
+        for name, url in api_routes(samples):
+            results[f'{name} as {role}'] = dict(measure(client, url, repeat, headers), url=url)
+        client.force_login(user)
+        for name, url in records_routes(samples):
+            results[f'{name} as {role}'] = dict(measure(client, url, repeat), url=url)
+    return results
+
+
+def compare(baseline, current, tolerance=0.5, slack_ms=5.0):
+    '''
+    Regressions of current against baseline: any extra query, a changed status, or a p95 more
+    than tolerance (a fraction) and slack_ms above the baseline. Returns a list of messages
+    '''
+    problems = []
+    for key, before in sorted(baseline.items()):
+        after = current.get(key)
+        if after is None:
+            problems.append(f'{key}: missing from this run')
+            continue
+        if after['status'] != before['status']:
+            problems.append(f'{key}: status {before["status"]} -> {after["status"]}')
+        if after['queries'] > before['queries']:
+            problems.append(f'{key}: {before["queries"]} -> {after["queries"]} queries')
+        if after['p95_ms'] > before['p95_ms'] * (1 + tolerance) + slack_ms:
+            problems.append(f'{key}: p95 {before["p95_ms"]}ms -> {after["p95_ms"]}ms')
+    return problems
@@ -0,0 +1,167 @@
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, transaction
+from .models import Student, Parent, StudentParent, Grade, Teacher, Subject, Performance, Attendance, Invoice, Payment, Enrollment, StudentAccess
+
+# Versioned models and the scopes their rows belong to: scope name -> id(s) of the row's student,
+# class or family, as attributes of the row or lookups through one of its foreign keys
+SCOPES = {
+    Student: {'student': 'pk', 'grade': 'grade_id'},
+    Parent: {'parent': 'pk'},
+    StudentParent: {'student': 'student_id', 'parent': 'parent_id'},
+    Grade: {'grade': 'pk'},
+    Teacher: {},
+    Subject: {},
+    Performance: {'student': 'student_id', 'grade': 'student__grade_id'},
+    # The class the mark was taken in and the student's current class, whose roster shows it
+    Attendance: {'student': 'student_id', 'grade': ('grade_id', 'student__grade_id')},
+    Invoice: {'student': 'student_id'},
+    Payment: {'student': 'invoice__student_id'},
+    Enrollment: {'student': 'student_id', 'grade': 'grade_id'},
+    # Who may see a student, read by the role-scoped querysets
+    StudentAccess: {'student': 'student_id'},
+}
+
+MISSING = object()
+
+
+def local_cache():
+    '''Per-process tier (LocMemCache)'''
+    return caches[getattr(settings, 'RECORDS_LOCAL_CACHE', 'default')]
+
+
+def shared_cache():
+    '''Tier shared by every process of the host (FileBasedCache), also holding the versions'''
+    return caches[getattr(settings, 'RECORDS_SHARED_CACHE', 'shared')]
+
+
+def version_key(model, scope=None):
+    '''records:version:records.attendance, or records:version:records.attendance:grade:3 for one class'''
+    key = f'records:version:{model._meta.label_lower}'
+    return f'{key}:{scope}' if scope else key
+
+
+def new_version():
+    '''
+    Versions are stamps rather than counters from 1: a version evicted from the shared cache,
+    or two processes bumping it at once, still never comes back to a value already used in a key
+    '''
+    return time.time_ns()
+
+
+def get_versions(dependencies):
+    '''
+    Current version of every (model, scope) dependency, a model alone meaning the whole table,
+    as seen by this transaction: its own uncommitted bumps included
+    '''
+    cache = shared_cache()
+    keys = [version_key(*dependency) if isinstance(dependency, tuple) else version_key(dependency) for dependency in dependencies]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    versions.update({key: version for key, version in pending_versions().items() if key in versions})
+    return [versions[key] for key in keys]
+
+
+def query_dependencies(queryset, sql):
+    '''The versioned models the sql of queryset reads, None when it reads a table writes do not version'''
+    connection = connections[queryset.db]
+    dependencies = []
+    for model in apps.get_models():
+        if connection.ops.quote_name(model._meta.db_table) in sql:
+            if model not in SCOPES:
+                return None
+            dependencies.append(model)
+    return dependencies
+
+
+def scope_ids(model, objs, path):
+    '''Ids that objs hold along path, one query for the batch when it goes through a foreign key'''
+    if '__' not in path:
+        return {getattr(obj, path) for obj in objs} - {None}
+    name, rest = path.split('__', 1)
+    field = model._meta.get_field(name)
+    related_ids = {getattr(obj, field.attname) for obj in objs} - {None}
+    if not related_ids:
+        return set()
+    return set(field.related_model._base_manager.filter(pk__in=related_ids).values_list(rest, flat=True)) - {None}
+
+
+def scopes_of(model, objs):
+    '''Every scope ("student:12", "grade:3", ...) objs belong to'''
+    scopes = set()
+    for name, paths in SCOPES[model].items():
+        for path in (paths if isinstance(paths, tuple) else (paths,)):
+            scopes.update(f'{name}:{pk}' for pk in scope_ids(model, objs, path))
+    return scopes
+
+
+class VersionBump:
+    '''on_commit callback publishing the new versions of a transaction to every process'''
+
+    def __init__(self, versions):
+        self.versions = versions
+
+    def __call__(self):
+        shared_cache().set_many(self.versions, None)
+
+
+def pending_versions():
+    '''
+    Versions bumped by the current transaction and not committed yet. Django drops the
+    callbacks of a rolled back transaction or savepoint, and its bumps with them
+    '''
+    pending = {}
+    for callback in transaction.get_connection().run_on_commit:
+        if isinstance(callback[1], VersionBump):
+            pending.update(callback[1].versions)
+    return pending
+
+
+def bump(model, scopes=()):
+    '''
+    Invalidates what was cached from model: the whole-table version and the given scopes.
+    Other processes see the new versions once the transaction commits, this transaction at once.
+    Values cached meanwhile are stored under versions that only exist if it commits
+    '''
+    transaction.on_commit(VersionBump({version_key(model, scope): new_version() for scope in [None, *set(scopes)]}))
+
+
+def bump_objects(model, objs, previous_scopes=()):
+    '''Bumps the versions of rows written without signals, e.g. by bulk_create'''
+    bump(model, scopes_of(model, objs) | set(previous_scopes))
+
+
+def cache_key(name, dependencies):
+    versions = '.'.join(str(version) for version in get_versions(dependencies))
+    return f'records:{name}:{versions}'
+
+
+def cached(name, dependencies, compute, timeout=None):
+    '''
+    The value computed by compute() for name, kept in both tiers until a dependency's version
+    changes. name must identify the value (e.g. "roster:3:2024-01-15"), dependencies are
+    the models, or (model, scope) pairs, it is computed from
+    '''
+    if timeout is None:
+        timeout = getattr(settings, 'RECORDS_CACHE_TIMEOUT', 3600)
+    key = cache_key(name, dependencies)
+    value = local_cache().get(key, MISSING)
+    if value is MISSING:
+        value = shared_cache().get(key, MISSING)
+        if value is MISSING:
+            value = compute()
+            shared_cache().set(key, value, timeout)
+        local_cache().set(key, value, timeout)
+    return value
+
+
+def clear():
+    '''Drops every cached value and version, after writes that bypass the ORM or a database reset'''
+    local_cache().clear()
+    shared_cache().clear()
@@ -0,0 +1,74 @@
+from django.db import connection
+from .models import Student, Attendance, Performance, Invoice, Payment, Enrollment, ChangeLog
+
+# Models offline clients sync through /api/sync/, and the student each row belongs to:
+# an attribute of the row or a lookup through one of its foreign keys
+SYNCED = {
+    Student: 'pk',
+    Attendance: 'student_id',
+    Performance: 'student_id',
+    Invoice: 'student_id',
+    Payment: 'invoice__student_id',
+    Enrollment: 'student_id',
+}
+
+
+def label(model):
+    return model._meta.model_name
+
+
+def students_of(model, objs):
+    '''{pk: student id} of objs, one query for the batch when the student is behind a foreign key'''
+    path = SYNCED[model]
+    if '__' not in path:
+        return {obj.pk: getattr(obj, path) for obj in objs}
+    name, rest = path.split('__', 1)
+    field = model._meta.get_field(name)
+    related_ids = {getattr(obj, field.attname) for obj in objs} - {None}
+    related = dict(field.related_model._base_manager.filter(pk__in=related_ids).values_list('pk', rest)) if related_ids else {}
+    return {obj.pk: related.get(getattr(obj, field.attname)) for obj in objs}
+
+
+def record(model, objs, deleted=False, previous_students=()):
+    '''
+    Logs a write of objs, in one insert. previous_students are the students an update moved the
+    rows away from: their clients get the change too, and find the row gone
+    '''
+    entries = []
+    for pk, student_id in students_of(model, objs).items():
+        entries.append(ChangeLog(model=label(model), object_id=pk, student_id=student_id, deleted=deleted))
+        entries += [ChangeLog(model=label(model), object_id=pk, student_id=previous, deleted=deleted)
+                    for previous in set(previous_students) - {student_id}]
+    ChangeLog.objects.bulk_create(entries)
+
+
+def record_upserted(model, objs, unique_fields):
+    '''
+    Logs rows written by a bulk_create upsert, which does not return primary keys: the rows are
+    read back by their natural key, one query for the batch
+    '''
+    attnames = [model._meta.get_field(name).attname for name in unique_fields]
+    keys = {tuple(getattr(obj, attname) for attname in attnames) for obj in objs}
+    filters = {f'{attname}__in': {key[i] for key in keys} for i, attname in enumerate(attnames)}
+    written = model._base_manager.filter(**filters).only('pk', *attnames)
+    record(model, [obj for obj in written if tuple(getattr(obj, attname) for attname in attnames) in keys])
+
+
+def upsert(model, objs, unique_fields, update_fields, batch_size=None):
+    '''
+    Writes objs with a bulk_create upsert on their natural key (unique_fields), overwriting
+    update_fields of the rows already there, and logs them. Backends that cannot name the
+    conflict target (MySQL: ON DUPLICATE KEY UPDATE) upsert on any unique key of the table, the
+    natural key being the only one besides the primary key of the models written this way
+    '''
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = unique_fields
+    model.objects.bulk_create(objs, batch_size=batch_size, **options)
+    if model in SYNCED:
+        record_upserted(model, objs, unique_fields)
+
+
+def reset():
+    '''Marks writes that were not logged: every client downloads its records again'''
+    ChangeLog.objects.create(model=ChangeLog.RESET)
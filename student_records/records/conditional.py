@@ -0,0 +1,111 @@
+import datetime
+import hashlib
+
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from .models import Student, Parent, StudentParent, Grade, Teacher, Subject, Performance, Attendance, Invoice, Payment, Enrollment
+from . import cache as records_cache
+
+# Models whose rows are shown along with a model's own fields: display names, linked ids
+SHOWN_WITH = {
+    Student: (Grade,),
+    Parent: (StudentParent,),
+    Grade: (Teacher,),
+    Subject: (Teacher,),
+    Performance: (Student, Subject),
+    Attendance: (Student, Grade),
+    Invoice: (Student,),
+    Payment: (Invoice, Student),
+    Enrollment: (Student, Grade),
+}
+
+
+def make_etag(*parts):
+    '''Strong ETag: the same parts always give the same bytes'''
+    return '"%s"' % hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def stamp_time(version):
+    '''When a records cache version stamp was bumped'''
+    return datetime.datetime.fromtimestamp(version / 1e9, tz=datetime.timezone.utc)
+
+
+def latest(*times):
+    times = [value for value in times if value is not None]
+    return max(times) if times else None
+
+
+def list_stamp(queryset):
+    '''max(updated_at) of a list, an index-only read rather than a count of its rows'''
+    return queryset.order_by().aggregate(last=Max('updated_at'))['last']
+
+
+def list_validators(queryset, *parts, shown_with=()):
+    '''
+    (ETag, Last-Modified) of a list, from the version stamps of the tables its query reads
+    (the model and the role scope, e.g. StudentAccess) and of the models shown with it,
+    shown_with adding those of the request (e.g. expanded relations). parts identify the
+    scope and the page (user, path). Every save and delete bumps these versions, so the
+    validators cost no query; a list reading a table writes do not version also takes its
+    max(updated_at)
+    '''
+    model = queryset.model
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        # none(): no table is read
+        sql = ''
+    dependencies = records_cache.query_dependencies(queryset, sql)
+    last = list_stamp(queryset) if dependencies is None else None
+    dependencies = {model, *(dependencies or ()), *SHOWN_WITH.get(model, ()), *shown_with}
+    # A stable order of the versions in the ETag
+    versions = records_cache.get_versions(sorted(dependencies, key=lambda dependency: dependency._meta.label))
+    etag = make_etag(model._meta.label, last, *versions, *parts)
+    return etag, latest(last, *[stamp_time(version) for version in versions])
+
+
+def detail_validators(obj, *parts, shown_with=()):
+    '''(ETag, Last-Modified) of one record, from its updated_at and the models shown with it'''
+    model = type(obj)
+    versions = records_cache.get_versions(SHOWN_WITH.get(model, ()) + tuple(shown_with))
+    etag = make_etag(model._meta.label, obj.pk, obj.updated_at, *versions, *parts)
+    return etag, latest(obj.updated_at, *[stamp_time(version) for version in versions])
+
+
+def not_modified(request, etag, last_modified):
+    '''The 304 (or 412) answering request's If-None-Match/If-Modified-Since, None to send the full response'''
+    # Whole seconds, as sent in Last-Modified
+    return get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None)
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code == 200:
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+class ConditionalListMixin:
+    '''ListView answering conditional GETs with a 304 before anything is rendered'''
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = list_validators(self.get_queryset(), request.get_full_path(), request.user.pk)
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
+
+class ConditionalDetailMixin:
+    '''DetailView answering conditional GETs with a 304 before anything is rendered'''
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        etag, last_modified = detail_validators(self.object, request.get_full_path(), request.user.pk)
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = self.render_to_response(self.get_context_data(object=self.object))
+        return set_validators(response, etag, last_modified)
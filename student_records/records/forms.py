@@ -1,5 +1,36 @@
 from django import forms
+from django.forms.models import ModelChoiceIterator
 from .models import Student, Parent, Grade, Teacher, Subject, Performance, Attendance, Enrollment, Payment, Invoice
+from . import reference
+
+
+class ReferenceChoiceIterator(ModelChoiceIterator):
+    '''Choices from the reference data snapshot instead of a query per form'''
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for obj in reference.rows(self.queryset.model):
+            yield self.choice(obj)
+
+    def __len__(self):
+        return len(reference.rows(self.queryset.model)) + (self.field.empty_label is not None)
+
+
+class ReferenceChoiceField(forms.ModelChoiceField):
+    '''
+    ModelChoiceField for a Teacher, Subject or Grade: the dropdown is rendered and the
+    submitted id checked against the reference data snapshot (records/reference.py)
+    '''
+    iterator = ReferenceChoiceIterator
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        obj = reference.get(self.queryset.model, value)
+        if obj is None:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice', params={'value': value})
+        return obj
+
 
 
 class StudentForm(forms.ModelForm):
@@ -8,6 +39,7 @@ class StudentForm(forms.ModelForm):
         model = Student
         fields = ('first_name', 'last_name', 'gender', 'date_of_birth', 'address', 
                 'status', 'date_of_admission', 'grade',)
+        field_classes = {'grade': ReferenceChoiceField}
 
 class ParentForm(forms.ModelForm):
     '''Form to handle the creation and updating of parent records'''
@@ -32,12 +64,14 @@ class SubjectForm(forms.ModelForm):
     class Meta:
         model = Subject
         fields = ('name', 'teacher')
+        field_classes = {'teacher': ReferenceChoiceField}
 
 class PerformanceForm(forms.ModelForm):
     '''Form to handle the creation and updating of performance records'''
     class Meta:
         model = Performance
         fields = ('subject', 'score', 'exam_type', 'academic_year', 'term')
+        field_classes = {'subject': ReferenceChoiceField}
 
 class PaymentForm(forms.ModelForm):
     '''Form to handle the creation and updating of payment records'''
@@ -56,9 +90,37 @@ class AttendanceForm(forms.ModelForm):
     class Meta:
         model = Attendance
         fields = ('grade', 'status', 'date')
+        field_classes = {'grade': ReferenceChoiceField}
 
 class EnrollmentForm(forms.ModelForm):
     '''Form to handle the creation and updating of enrollment records'''
     class Meta:
         model = Enrollment
         fields = ('grade', 'academic_year', 'date_enrolled', 'date_left', 'status')
+        field_classes = {'grade': ReferenceChoiceField}
+
+class GradebookExamForm(forms.Form):
+    '''Picks the exam shown in the gradebook'''
+    exam_type = forms.ChoiceField(choices=Performance.EXAM_CHOICES)
+    academic_year = forms.IntegerField(min_value=2000, max_value=2100)
+    term = forms.TypedChoiceField(choices=Performance.TERMS, coerce=int)
+    subject = ReferenceChoiceField(queryset=Subject.objects.all(), required=False, empty_label='All subjects')
+
+class GradebookRowForm(forms.Form):
+    '''One student's row of the gradebook: a score field per subject column'''
+    student = forms.IntegerField(widget=forms.HiddenInput)
+
+    def __init__(self, *args, subjects=(), editable_subjects=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        for subject in subjects:
+            self.fields[f'subject_{subject.pk}'] = forms.IntegerField(
+                label=subject.name, required=False, min_value=0,
+                disabled=editable_subjects is not None and subject.pk not in editable_subjects)
+
+    def changed_scores(self):
+        '''{(student id, subject id): score} of the cells edited in this row, cleared cells are left as they were'''
+        student_id = self.cleaned_data['student']
+        return {(student_id, int(name[len('subject_'):])): self.cleaned_data[name]
+                for name in self.changed_data if name.startswith('subject_') and self.cleaned_data[name] is not None}
+
+GradebookFormSet = forms.formset_factory(GradebookRowForm, extra=0)
@@ -0,0 +1,229 @@
+import datetime
+import random
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from accounts.models import CustomUser
+from . import cache as records_cache
+from . import changes
+from .models import Student, Parent, StudentParent, Grade, Teacher, Subject, Performance, Attendance, Invoice, Payment, Enrollment, StudentAccess, UserProfile
+
+STREAMS = ['East', 'West', 'North', 'South', 'Central', 'Lake']
+SUBJECTS = ['Maths', 'English', 'Kiswahili', 'Science', 'Social Studies', 'CRE', 'Art', 'Music', 'Physical Education',
+            'Agriculture', 'Home Science', 'Computer Studies']
+FIRST_NAMES = ['Angela', 'Brian', 'Cynthia', 'David', 'Esther', 'Felix', 'Grace', 'Hassan', 'Irene', 'James', 'Kevin', 'Lucy',
+               'Mercy', 'Nelson', 'Otieno', 'Purity', 'Quincy', 'Ruth', 'Samuel', 'Tabitha', 'Umar', 'Violet', 'Wanjiru', 'Zawadi']
+LAST_NAMES = ['Kwamboka', 'Otieno', 'Wanjiku', 'Kamau', 'Mwangi', 'Achieng', 'Mutua', 'Njoroge', 'Wekesa', 'Chebet', 'Kiprop',
+              'Omondi', 'Nyambura', 'Barasa', 'Cherono', 'Macharia', 'Onyango', 'Wambui', 'Kariuki', 'Jepkosgei']
+PAYMENT_METHODS = ['M-Pesa', 'Bank transfer', 'Cash', 'Cheque']
+# First day of each term
+TERM_STARTS = {1: (1, 8), 2: (5, 6), 3: (9, 2)}
+
+
+class SchoolGenerator:
+    '''
+    Generates a consistent school history with bulk_create: classes (level x stream) with their
+    class teachers, subject teachers, students admitted into level 1 and moving up a level a year
+    (Alumni once past the last level), parent/guardian families with siblings, yearly enrollments,
+    scores for every exam of every term, daily attendance and fee invoices with their payments.
+
+    Students are generated and written chunk_size at a time, each chunk in one transaction, so
+    memory stays flat whatever the size of the school. Primary keys are assigned here rather than
+    read back from the database, and the output only depends on the seed and the options
+    '''
+
+    def __init__(self, students=1000, levels=8, streams=3, subjects=8, first_year=2020, years=5, terms=3,
+                 school_days=60, attendance_years=1, accounts=False, password='Password123##', seed=0,
+                 chunk_size=2000, batch_size=5000, log=None):
+        self.students = students
+        self.levels = levels
+        self.streams = STREAMS[:streams]
+        self.subject_names = SUBJECTS[:subjects]
+        self.years = list(range(first_year, first_year + years))
+        self.terms = list(range(1, terms + 1))
+        self.school_days = school_days
+        self.attendance_years = set(self.years[-attendance_years:]) if attendance_years else set()
+        self.accounts = accounts
+        self.password = password
+        self.rng = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.log = log or (lambda message: None)
+        self.counts = {}
+        self.next_ids = {}
+
+    def allocate(self, model):
+        '''Next free primary key of model'''
+        if model not in self.next_ids:
+            self.next_ids[model] = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        pk = self.next_ids[model]
+        self.next_ids[model] += 1
+        return pk
+
+    def write(self, model, objs):
+        if objs:
+            model.objects.bulk_create(objs, batch_size=self.batch_size)
+            self.counts[model.__name__] = self.counts.get(model.__name__, 0) + len(objs)
+
+    def school_days_of(self, year, term):
+        '''The first school_days weekdays of a term'''
+        month, day = TERM_STARTS[term]
+        date = datetime.date(year, month, day)
+        days = []
+        while len(days) < self.school_days:
+            if date.weekday() < 5:
+                days.append(date)
+            date += datetime.timedelta(days=1)
+        return days
+
+    def create_user(self, role, username):
+        pk = self.allocate(CustomUser)
+        self.users.append(CustomUser(pk=pk, username=username, password=self.password_hash, phone_number=f'2547{pk:08d}'))
+        self.profiles.append(UserProfile(pk=self.allocate(UserProfile), user_id=pk, role=role))
+        return pk
+
+    def create_staff(self):
+        '''Classes, their class teachers and the subject teachers'''
+        self.users, self.profiles = [], []
+        teachers = []
+        for i in range(self.levels * len(self.streams) + len(self.subject_names)):
+            pk = self.allocate(Teacher)
+            user_id = self.create_user('Teacher', f'teacher{pk}') if self.accounts else None
+            teachers.append(Teacher(pk=pk, full_name=f'{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}', user_id=user_id))
+
+        self.grades = {}
+        for level in range(1, self.levels + 1):
+            for stream in self.streams:
+                self.grades[level, stream] = Grade(pk=self.allocate(Grade), name=level, stream=stream, teacher=teachers[len(self.grades)])
+        subject_teachers = teachers[len(self.grades):]
+        self.subjects = [Subject(pk=self.allocate(Subject), name=name, teacher=subject_teachers[i]) for i, name in enumerate(self.subject_names)]
+
+        with transaction.atomic():
+            self.write(CustomUser, self.users)
+            self.write(UserProfile, self.profiles)
+            self.write(Teacher, teachers)
+            self.write(Grade, list(self.grades.values()))
+            self.write(Subject, self.subjects)
+
+    def create_students(self, count):
+        '''One chunk of students with their families and full history'''
+        self.users, self.profiles = [], []
+        students, parents, links, enrollments, performances, attendances, invoices, payments = [], [], [], [], [], [], [], []
+        family = []
+        last_year = self.years[-1]
+
+        for _ in range(count):
+            pk = self.allocate(Student)
+            admitted = self.rng.randint(self.years[0] - self.levels + 1, last_year)
+            stream = self.rng.choice(self.streams)
+            # Years in school within the generated window, cut short for transfers
+            attended = [year for year in self.years if 1 <= year - admitted + 1 <= self.levels]
+            transferred = len(attended) > 1 and self.rng.random() < 0.03
+            if transferred:
+                attended = attended[:self.rng.randint(1, len(attended) - 1)]
+            current_level = last_year - admitted + 1
+            if transferred:
+                status, grade = 'Transferred', None
+            elif current_level > self.levels:
+                status, grade = 'Alumni', None
+            else:
+                status, grade = 'Enrolled', self.grades[current_level, stream]
+
+            # Siblings share the parents of the previous student
+            if not family or self.rng.random() > 0.3:
+                last_name = self.rng.choice(LAST_NAMES)
+                family = []
+                for relationship in (['M', 'F'] if self.rng.random() < 0.7 else [self.rng.choice('MFG')]):
+                    parent_pk = self.allocate(Parent)
+                    user_id = self.create_user('Parent', f'parent{parent_pk}') if self.accounts else None
+                    parents.append(Parent(pk=parent_pk, full_name=f'{self.rng.choice(FIRST_NAMES)} {last_name}',
+                                          address=f'{self.rng.randint(1, 999)} {self.rng.choice(LAST_NAMES)} Road', user_id=user_id))
+                    family.append((parent_pk, relationship, parents[-1].address, last_name))
+            address, last_name = family[0][2], family[0][3]
+            user_id = self.create_user('Student', f'student{pk}') if self.accounts else None
+            students.append(Student(
+                pk=pk, first_name=self.rng.choice(FIRST_NAMES), last_name=last_name, gender=self.rng.choice('FM'),
+                date_of_birth=datetime.date(admitted - 6, self.rng.randint(1, 12), self.rng.randint(1, 28)), address=address,
+                status=status, date_of_admission=datetime.date(admitted, 1, 8), student_email=f'student{pk}@example.com',
+                grade_id=grade.pk if grade else None, user_id=user_id))
+            for i, (parent_pk, relationship, _, _) in enumerate(family):
+                links.append(StudentParent(pk=self.allocate(StudentParent), student_id=pk, parent_id=parent_pk,
+                                           relationship_type=relationship, is_primary_guardian=i == 0))
+
+            ability = self.rng.gauss(62, 12)
+            for year in attended:
+                level = year - admitted + 1
+                year_grade = self.grades[level, stream]
+                left = year != last_year or transferred
+                enrollments.append(Enrollment(pk=self.allocate(Enrollment), grade_id=year_grade.pk, student_id=pk, academic_year=year,
+                                              date_enrolled=datetime.date(year, 1, 8), date_left=datetime.date(year, 11, 30) if left else None,
+                                              status='LEFT' if left else 'ENROLLED'))
+                for term in self.terms:
+                    for subject in self.subjects:
+                        for exam_type, _ in Performance.EXAM_CHOICES:
+                            score = min(100, max(0, round(self.rng.gauss(ability, 10))))
+                            performances.append(Performance(pk=self.allocate(Performance), student_id=pk, subject_id=subject.pk, score=score,
+                                                            exam_type=exam_type, academic_year=year, term=term))
+                    if year in self.attendance_years:
+                        for day in self.school_days_of(year, term):
+                            attendances.append(Attendance(pk=self.allocate(Attendance), grade_id=year_grade.pk, student_id=pk, date=day,
+                                                          status=int(self.rng.random() < 0.94)))
+                    invoices.extend(self.fee_ledger(pk, level, year, term, payments))
+
+        with transaction.atomic():
+            self.write(CustomUser, self.users)
+            self.write(UserProfile, self.profiles)
+            self.write(Parent, parents)
+            self.write(Student, students)
+            self.write(StudentParent, links)
+            self.write(Enrollment, enrollments)
+            self.write(Performance, performances)
+            self.write(Attendance, attendances)
+            self.write(Invoice, invoices)
+            self.write(Payment, payments)
+
+    def fee_ledger(self, student_id, level, year, term, payments):
+        '''The term's invoice of a student, its payments are appended to payments'''
+        month, day = TERM_STARTS[term]
+        total = Decimal(12000 + 1500 * level)
+        # Most past terms are settled, the current one is partly paid
+        settled = year != self.years[-1] or term != self.terms[-1]
+        paid = total if settled and self.rng.random() < 0.9 else (total * Decimal(self.rng.randint(0, 10)) / 10).quantize(Decimal('1'))
+        invoice = Invoice(pk=self.allocate(Invoice), student_id=student_id, total_amount=total, amount_due=total - paid,
+                          payment_due_date=datetime.date(year, month, day) + datetime.timedelta(days=28),
+                          status='PAID' if paid == total else 'PENDING', academic_year=year, term=term)
+        installments = self.rng.randint(1, 3) if paid else 0
+        for i in range(installments):
+            amount = (paid / installments).quantize(Decimal('0.01')) if i < installments - 1 else paid - (paid / installments).quantize(Decimal('0.01')) * (installments - 1)
+            method = self.rng.choice(PAYMENT_METHODS)
+            payment_pk = self.allocate(Payment)
+            payments.append(Payment(pk=payment_pk, invoice_id=invoice.pk, amount_paid=amount, payment_method=method,
+                                    payment_date=datetime.date(year, month, day) + datetime.timedelta(days=7 * i + self.rng.randint(0, 20)),
+                                    reference_number=f'{method[:3].upper()}{payment_pk:010d}'))
+        return [invoice]
+
+    def generate(self):
+        '''Writes the whole school and returns {model name: rows written}'''
+        self.password_hash = make_password(self.password) if self.accounts else None
+        self.create_staff()
+        done = 0
+        while done < self.students:
+            count = min(self.chunk_size, self.students - done)
+            self.create_students(count)
+            done += count
+            self.log(f'{done}/{self.students} students')
+
+        # Explicit primary keys leave sequences behind on databases that have them
+        models = [CustomUser, UserProfile, Teacher, Grade, Subject, Parent, Student, StudentParent, Enrollment, Performance, Attendance, Invoice, Payment]
+        with connection.cursor() as cursor:
+            for statement in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(statement)
+        if self.accounts:
+            StudentAccess.sync()
+        # Nothing was written through the ORM signals that bump the cache versions and log changes
+        records_cache.clear()
+        changes.reset()
+        return self.counts
@@ -0,0 +1,97 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import FilteredRelation, Max, Q
+from .models import Student, Subject, Performance
+from . import cache as records_cache
+from . import reference
+from . import changes
+from .roles import get_role
+
+
+class Gradebook:
+    '''
+    Score matrix of one class for one exam: a row per student of the grade, a column per subject.
+    Used by the gradebook screen (records/views.py) and the gradebook api action (api/views.py)
+    '''
+
+    def __init__(self, grade, exam_type, academic_year, term, subjects=None):
+        self.grade = grade
+        self.exam_type = exam_type
+        self.academic_year = academic_year
+        self.term = term
+        if subjects is None:
+            subjects = reference.rows(Subject)
+        self.subjects = list(subjects)
+
+    def column(self, subject):
+        return f'subject_{subject.pk}'
+
+    def rows(self):
+        '''
+        The matrix in one aggregated query, students left-joined to their scores for the exam
+        and grouped per student: [{'id', 'first_name', 'last_name', 'scores': {subject id: score}}].
+        Cached until the class's students or scores change
+        '''
+        name = f'gradebook:{self.grade.pk}:{self.exam_type}:{self.academic_year}:{self.term}:{",".join(str(subject.pk) for subject in self.subjects)}'
+        scope = f'grade:{self.grade.pk}'
+        return records_cache.cached(name, [(Student, scope), (Performance, scope)], self.load_rows)
+
+    def load_rows(self):
+        # Only the exam's scores are joined, through the (student, academic_year, term) index
+        exam = FilteredRelation('performance', condition=Q(performance__exam_type=self.exam_type,
+                                                           performance__academic_year=self.academic_year,
+                                                           performance__term=self.term))
+        columns = {self.column(subject): Max('exam__score', filter=Q(exam__subject=subject.pk)) for subject in self.subjects}
+        students = (self.grade.students.annotate(exam=exam).order_by('last_name', 'first_name', 'pk')
+                    .values('id', 'first_name', 'last_name').annotate(**columns))
+        return [{
+            'id': row['id'],
+            'first_name': row['first_name'],
+            'last_name': row['last_name'],
+            'scores': {subject.pk: row[self.column(subject)] for subject in self.subjects},
+        } for row in students]
+
+    def save(self, cells, editable_subjects=None):
+        '''
+        Upserts {(student id, subject id): score} in one statement on the unique_performance_exam
+        key, after checking every student is in the class with one query. Cells of subjects not in
+        editable_subjects (ids, all subjects of the gradebook when None) are rejected.
+        Returns the number of scores written
+        '''
+        if not cells:
+            return 0
+        allowed = {subject.pk for subject in self.subjects}
+        if editable_subjects is not None:
+            allowed &= set(editable_subjects)
+        student_ids = {student_id for student_id, _ in cells}
+        members = set(self.grade.students.filter(pk__in=student_ids).order_by().values_list('pk', flat=True))
+
+        errors = [f'Student {pk} is not in this class.' for pk in sorted(student_ids - members)]
+        errors += [f'Scores for subject {pk} cannot be entered here.' for pk in sorted({subject_id for _, subject_id in cells} - allowed)]
+        if errors:
+            raise ValidationError(errors)
+
+        scores = [Performance(student_id=student_id, subject_id=subject_id, score=score, exam_type=self.exam_type,
+                              academic_year=self.academic_year, term=self.term)
+                  for (student_id, subject_id), score in cells.items()]
+        with transaction.atomic():
+            changes.upsert(Performance, scores, ['student', 'subject', 'exam_type', 'academic_year', 'term'], ['score', 'updated_at'])
+            records_cache.bump(Performance, {f'grade:{self.grade.pk}'} | {f'student:{pk}' for pk in student_ids})
+        return len(scores)
+
+
+def editable_subjects(user, subjects):
+    '''Ids of the subjects whose scores the user may enter: all for admins, the ones they teach for teachers'''
+    if get_role(user) == 'admin':
+        return None
+    teacher_id = getattr(user, 'teacher_id', None)
+    if teacher_id is None:
+        teacher_id = getattr(getattr(user, 'teacher_profile', None), 'pk', None)
+    return {subject.pk for subject in subjects if teacher_id is not None and subject.teacher_id == teacher_id}
+
+
+def gradebook_subjects(user):
+    '''The subjects of the user's gradebook columns: the ones they teach for teachers, every subject for admins'''
+    subjects = reference.rows(Subject)
+    editable = editable_subjects(user, subjects)
+    return subjects if editable is None else [subject for subject in subjects if subject.pk in editable]
@@ -0,0 +1,63 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from records import benchmark
+from student_records.testing import isolated_storage
+
+
+class Command(BaseCommand):
+    help = '''
+    Seeds a throwaway test database and measures every api route and records list/detail view
+    as each role: query count, SQL time, serialization/render time and wall-clock p50/p95.
+    Writes the results as a JSON baseline, or with --compare fails on regressions against one
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='benchmark_baseline.json', help='File the results are written to')
+        parser.add_argument('--compare', metavar='BASELINE', help='Baseline file to compare against, exits with an error on regressions')
+        parser.add_argument('--students', type=int, default=100, help='Students in the seeded school')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed requests per route and role')
+        parser.add_argument('--tolerance', type=float, default=0.5, help='Allowed p95 slowdown as a fraction of the baseline')
+        parser.add_argument('--slack-ms', type=float, default=5.0, help='Allowed p95 slowdown in milliseconds on top of --tolerance')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as baseline_file:
+                    baseline = json.load(baseline_file)
+            except (OSError, ValueError) as error:
+                raise CommandError(f'Cannot read baseline {options["compare"]}: {error}')
+
+        # The seeded school's cached values never reach the cache of the real database
+        with isolated_storage():
+            setup_test_environment()
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                start = time.perf_counter()
+                users = benchmark.seed(students=options['students'])
+                self.stdout.write(f'Seeded {options["students"]} students in {time.perf_counter() - start:.1f}s')
+                results = benchmark.run(users, repeat=options['repeat'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+
+        for key, result in sorted(results.items()):
+            self.stdout.write(f'{key:45} {result["status"]} {result["queries"]:3} queries  sql {result["sql_ms"]:7.2f}ms  '
+                              f'serialize {result["serialize_ms"]:7.2f}ms  p50 {result["p50_ms"]:7.2f}ms  p95 {result["p95_ms"]:7.2f}ms')
+
+        if baseline is None:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+                output.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Wrote {len(results)} results to {options["output"]}'))
+            return
+
+        problems = benchmark.compare(baseline, results, tolerance=options['tolerance'], slack_ms=options['slack_ms'])
+        if problems:
+            raise CommandError('Regressions against {}:\n{}'.format(options['compare'], '\n'.join(problems)))
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {options["compare"]}'))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from records.generator import SchoolGenerator, STREAMS, SUBJECTS
+
+
+class Command(BaseCommand):
+    help = '''
+    Fills the records models with a synthetic school: classes, teachers, subjects, students and
+    their families, enrollments, exam scores, daily attendance and fee ledgers. The same seed
+    and options always generate the same school
+    '''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=1000, help='Students admitted over the whole history')
+        parser.add_argument('--grades', type=int, default=8, help='Class levels, a student moves up one level a year')
+        parser.add_argument('--streams', type=int, default=3, help=f'Streams per level (at most {len(STREAMS)})')
+        parser.add_argument('--subjects', type=int, default=8, help=f'Subjects taught (at most {len(SUBJECTS)})')
+        parser.add_argument('--first-year', type=int, default=2020, help='First academic year of the history')
+        parser.add_argument('--years', type=int, default=5, help='Academic years of history')
+        parser.add_argument('--terms', type=int, default=3, help='Terms per year (at most 3)')
+        parser.add_argument('--school-days', type=int, default=60, help='School days per term with attendance')
+        parser.add_argument('--attendance-years', type=int, default=1, help='Latest years that get daily attendance, 0 for none')
+        parser.add_argument('--accounts', action='store_true', help='Create a login (and StudentAccess rows) for every student, parent and teacher')
+        parser.add_argument('--password', default='Password123##', help='Password of the --accounts logins')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Students generated and written per transaction')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT')
+
+    def handle(self, *args, **options):
+        if not 1 <= options['streams'] <= len(STREAMS):
+            raise CommandError(f'--streams must be between 1 and {len(STREAMS)}.')
+        if not 1 <= options['subjects'] <= len(SUBJECTS):
+            raise CommandError(f'--subjects must be between 1 and {len(SUBJECTS)}.')
+        if not 1 <= options['terms'] <= 3:
+            raise CommandError('--terms must be between 1 and 3.')
+        if options['years'] < 1 or options['grades'] < 1 or options['students'] < 0:
+            raise CommandError('--years and --grades must be at least 1, --students at least 0.')
+        if not 0 <= options['attendance_years'] <= options['years']:
+            raise CommandError('--attendance-years must be between 0 and --years.')
+
+        start = time.perf_counter()
+        generator = SchoolGenerator(
+            students=options['students'], levels=options['grades'], streams=options['streams'], subjects=options['subjects'],
+            first_year=options['first_year'], years=options['years'], terms=options['terms'], school_days=options['school_days'],
+            attendance_years=options['attendance_years'], accounts=options['accounts'], password=options['password'],
+            seed=options['seed'], chunk_size=options['chunk_size'], batch_size=options['batch_size'],
+            log=lambda message: self.stdout.write(f'{message} ({time.perf_counter() - start:.0f}s)'))
+        counts = generator.generate()
+
+        for model, count in counts.items():
+            self.stdout.write(f'{model:15} {count:>12,}')
+        self.stdout.write(self.style.SUCCESS(f'Generated the school in {time.perf_counter() - start:.1f}s'))
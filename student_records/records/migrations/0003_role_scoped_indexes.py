@@ -0,0 +1,86 @@
+# Generated by Django 4.2.27 on 2026-10-18 06:48
+
+from django.db import IntegrityError, migrations, models
+from django.db.models import Count
+
+# Rows the constraints below make unique: model name -> natural key
+NATURAL_KEYS = {
+    'attendance': ('student', 'date'),
+    'enrollment': ('student', 'grade', 'academic_year'),
+    'performance': ('student', 'subject', 'exam_type', 'academic_year', 'term'),
+    'studentparent': ('parent', 'student'),
+}
+
+
+def check_duplicates(apps, schema_editor):
+    '''
+    Stops before the unique constraints below with the natural keys repeated by existing rows.
+    Those rows may hold different scores or statuses: which one is right is for an operator to
+    decide, then migrate again
+    '''
+    conflicts = []
+    for model_name, fields in NATURAL_KEYS.items():
+        model = apps.get_model('records', model_name)
+        columns = [model._meta.get_field(field).attname for field in fields]
+        repeated = model.objects.order_by().values(*columns).annotate(rows=Count('id')).filter(rows__gt=1).order_by(*columns)
+        for key in repeated:
+            ids = model.objects.filter(**{column: key[column] for column in columns}).order_by('id').values_list('id', flat=True)
+            conflicts.append(f'  {model_name} {", ".join(f"{column}={key[column]}" for column in columns)}: ids {", ".join(map(str, ids))}')
+    if conflicts:
+        raise IntegrityError('Rows share the natural key that migration 0003 makes unique. Delete or merge them, '
+                             'then migrate again:\n' + '\n'.join(conflicts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0002_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['grade', 'date'], name='attendance_grade_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['grade', 'academic_year'], name='enrollment_grade_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['student', 'academic_year', 'term'], name='invoice_student_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['status', 'payment_due_date'], name='invoice_status_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['invoice', 'payment_date'], name='payment_invoice_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['student', 'academic_year', 'term'], name='performance_student_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='performance',
+            index=models.Index(fields=['subject', 'academic_year', 'term'], name='performance_subject_term_idx'),
+        ),
+        migrations.RunPython(check_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendance',
+            constraint=models.UniqueConstraint(fields=('student', 'date'), name='unique_attendance_student_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='enrollment',
+            constraint=models.UniqueConstraint(fields=('student', 'grade', 'academic_year'), name='unique_enrollment_year'),
+        ),
+        migrations.AddConstraint(
+            model_name='performance',
+            constraint=models.UniqueConstraint(fields=('student', 'subject', 'exam_type', 'academic_year', 'term'), name='unique_performance_exam'),
+        ),
+        migrations.AddConstraint(
+            model_name='studentparent',
+            constraint=models.UniqueConstraint(fields=('parent', 'student'), name='unique_parent_student'),
+        ),
+    ]
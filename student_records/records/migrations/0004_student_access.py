@@ -0,0 +1,42 @@
+# Generated by Django 4.2.27 on 2026-10-18 06:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_student_access(apps, schema_editor):
+    '''Fills StudentAccess from the existing Student.user and StudentParent links'''
+    Student = apps.get_model('records', 'Student')
+    StudentParent = apps.get_model('records', 'StudentParent')
+    StudentAccess = apps.get_model('records', 'StudentAccess')
+
+    pairs = set(Student.objects.filter(user__isnull=False).values_list('user_id', 'id'))
+    pairs.update(StudentParent.objects.filter(student__isnull=False, parent__user__isnull=False)
+                 .values_list('parent__user_id', 'student_id'))
+    StudentAccess.objects.bulk_create([StudentAccess(user_id=user_id, student_id=student_id) for user_id, student_id in pairs],
+                                      batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('records', '0003_role_scoped_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='records.student')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='student_access', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='studentaccess',
+            constraint=models.UniqueConstraint(fields=('user', 'student'), name='unique_student_access'),
+        ),
+        migrations.RunPython(backfill_student_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.27 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0006_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(blank=True, max_length=20)),
+                ('object_id', models.BigIntegerField(null=True)),
+                ('student_id', models.BigIntegerField(null=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['student_id', 'id'], name='changelog_student_id_idx'), models.Index(fields=['model', 'id'], name='changelog_model_id_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.27 on 2026-10-18 08:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('records', '0007_changelog'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['name', 'stream'], name='grade_name_stream_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['status', 'grade'], name='student_status_grade_idx'),
+        ),
+    ]
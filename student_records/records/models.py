@@ -29,15 +29,25 @@ class Student(models.Model):
     student_email = models.EmailField(unique=True, blank=True)
     grade = models.ForeignKey("Grade", on_delete=models.SET_NULL, null=True, blank=True, default="N/A", related_name="students")
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='student_profile', null=True, blank=True)
+    # Last write, bulk upserts included: HTTP validators (records/conditional.py)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         '''Default order and name for model in admin and forms'''
         ordering=['first_name', 'last_name']
         verbose_name='Student detail'
+        indexes = [
+            # Backs the ?status= and ?status=&grade= api filters
+            models.Index(fields=['status', 'grade'], name='student_status_grade_idx'),
+        ]
 
     def __str__(self):
         return f'Student: {self.first_name} {self.last_name}'
 
+    @property
+    def full_name(self):
+        return f'{self.first_name} {self.last_name}'
+
 
 # Parent table/model
 class Parent(models.Model):
@@ -46,6 +56,7 @@ class Parent(models.Model):
     address = models.CharField(max_length=100)
     students = models.ManyToManyField(Student, through='StudentParent', related_name='parentstudentlink')
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='parent_profile', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         '''Default order and name for model in admin and forms'''
@@ -70,11 +81,15 @@ class StudentParent(models.Model):
 
     relationship_type = models.CharField(max_length=1, choices=RELATIONSHIP_CHOICES)
     is_primary_guardian = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
-        '''Name for model in admin and forms'''
+        '''Name for model in admin and forms, one link per student/parent pair'''
         ordering=['student', 'parent', 'relationship_type', 'is_primary_guardian']
         verbose_name='Student-Parent join'
+        constraints = [
+            models.UniqueConstraint(fields=['parent', 'student'], name='unique_parent_student'),
+        ]
 
 # Grade/Class table/model
 class Grade(models.Model):
@@ -82,11 +97,16 @@ class Grade(models.Model):
     name = models.IntegerField(help_text="Enter name of the class")
     stream = models.CharField(max_length=20,help_text="Enter stream name")
     teacher = models.ForeignKey("Teacher", on_delete=models.SET_NULL, null=True, related_name="classes")
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         '''Default order and name for model in admin and forms'''
         ordering=['name']
         verbose_name='Class detail'
+        indexes = [
+            # Backs the ?name= and ?name=&stream= api filters
+            models.Index(fields=['name', 'stream'], name='grade_name_stream_idx'),
+        ]
 
     def __str__(self):
         return f'Grade: {self.name} {self.stream}'
@@ -97,6 +117,7 @@ class Teacher(models.Model):
     '''Class that defines teacher instance attributes'''
     full_name = models.CharField(max_length=100, help_text="Enter teacher's full name")
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='teacher_profile', null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         '''Default order and name for model in admin and forms'''
@@ -112,6 +133,7 @@ class Subject(models.Model):
     '''Class that defines subject instance attributes'''
     name = models.CharField(max_length=100, help_text="Enter name of the subject")
     teacher = models.ForeignKey(Teacher, on_delete=models.SET_NULL, null=True, related_name="subjects")
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         '''Default order and name for model in admin and forms'''
@@ -146,11 +168,25 @@ class Performance(models.Model):
 
     term = models.IntegerField(choices=TERMS)
     date_entered = models.DateField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        '''Default order and name for model in admin and forms'''
+        '''Default order, name for model in admin and forms and indexes for the role-scoped queries'''
         ordering=['academic_year', 'term']
         verbose_name='Exam detail'
+        indexes = [
+            # Backs the api keyset pagination order
+            models.Index(fields=['academic_year', 'term', 'id'], name='performance_year_term_id_idx'),
+            # Student/parent scoped lists in pagination order
+            models.Index(fields=['student', 'academic_year', 'term'], name='performance_student_term_idx'),
+            # Class/subject result sheets
+            models.Index(fields=['subject', 'academic_year', 'term'], name='performance_subject_term_idx'),
+        ]
+        constraints = [
+            # One score per student, subject and exam in a term
+            models.UniqueConstraint(fields=['student', 'subject', 'exam_type', 'academic_year', 'term'],
+                                    name='unique_performance_exam'),
+        ]
 
 # Attendance model/table
 class Attendance(models.Model):
@@ -165,6 +201,18 @@ class Attendance(models.Model):
 
     status= models.IntegerField(choices=STATUS_CHOICES)
     date = models.DateField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        '''Indexes for the pagination order and class registers, one mark per student per day'''
+        indexes = [
+            models.Index(fields=['date', 'id'], name='attendance_date_id_idx'),
+            models.Index(fields=['grade', 'date'], name='attendance_grade_date_idx'),
+        ]
+        constraints = [
+            # Also serves the student/parent scoped lists: (student_id, date)
+            models.UniqueConstraint(fields=['student', 'date'], name='unique_attendance_student_date'),
+        ]
 
 
 # Invoice table/model
@@ -190,10 +238,16 @@ class Invoice(models.Model):
     ]
 
     term = models.IntegerField(choices=TERMS)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        '''Default order'''
+        '''Default order and indexes for the pagination order and role-scoped queries'''
         ordering=['academic_year', 'term']
+        indexes = [
+            models.Index(fields=['academic_year', 'term', 'id'], name='invoice_year_term_id_idx'),
+            models.Index(fields=['student', 'academic_year', 'term'], name='invoice_student_term_idx'),
+            models.Index(fields=['status', 'payment_due_date'], name='invoice_status_due_idx'),
+        ]
 
 
 # Payment table/model
@@ -204,10 +258,15 @@ class Payment(models.Model):
     payment_method = models.CharField(max_length=50)
     payment_date =models.DateField()
     reference_number = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        '''Default order'''
+        '''Default order and indexes for the pagination order and role-scoped queries'''
         ordering=['payment_date']
+        indexes = [
+            models.Index(fields=['payment_date', 'id'], name='payment_date_id_idx'),
+            models.Index(fields=['invoice', 'payment_date'], name='payment_invoice_date_idx'),
+        ]
 
 
 # Enrollment table/model
@@ -225,10 +284,89 @@ class Enrollment(models.Model):
     ]
 
     status = models.CharField(max_length=10, choices=ENROLLMENT_STATUS_CHOICES)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        '''Default order'''
+        '''Default order and indexes for the pagination order and role-scoped queries'''
         ordering=['date_enrolled']
+        indexes = [
+            models.Index(fields=['date_enrolled', 'id'], name='enrollment_date_id_idx'),
+            models.Index(fields=['grade', 'academic_year'], name='enrollment_grade_year_idx'),
+        ]
+        constraints = [
+            # A student is enrolled in a class once per academic year
+            models.UniqueConstraint(fields=['student', 'grade', 'academic_year'], name='unique_enrollment_year'),
+        ]
+
+
+# StudentAccess table/model
+class StudentAccess(models.Model):
+    '''
+    Denormalized (user, student) pairs: the student's own user and the users of their
+    parents/guardians. Kept in sync by the signals in records/signals.py so scoped
+    querysets and permission checks resolve with one indexed semi-join instead of
+    walking Student -> StudentParent -> Parent -> user
+    '''
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='student_access')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='access')
+
+    class Meta:
+        '''One row per pair, the unique index doubles as the (user_id, student_id) lookup index'''
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'student'], name='unique_student_access'),
+        ]
+
+    @classmethod
+    def student_ids(cls, user):
+        '''Subquery of the ids of the students user may see (own record or children)'''
+        return cls.objects.filter(user_id=user.pk).values('student_id')
+
+    @classmethod
+    def sync(cls, student_ids=None):
+        '''Recomputes the access rows of the given students, or of every student if None, returns the rows added'''
+        students = Student.objects.filter(user__isnull=False)
+        links = StudentParent.objects.filter(student__isnull=False, parent__user__isnull=False)
+        existing = cls.objects.all()
+        if student_ids is not None:
+            student_ids = list(student_ids)
+            students = students.filter(pk__in=student_ids)
+            links = links.filter(student_id__in=student_ids)
+            existing = existing.filter(student_id__in=student_ids)
+
+        wanted = set(students.values_list('user_id', 'id'))
+        wanted.update(links.values_list('parent__user_id', 'student_id'))
+        current = dict(((row[1], row[2]), row[0]) for row in existing.values_list('id', 'user_id', 'student_id'))
+
+        stale = [pk for pair, pk in current.items() if pair not in wanted]
+        if stale:
+            cls.objects.filter(pk__in=stale).delete()
+        missing = [cls(user_id=user_id, student_id=student_id) for user_id, student_id in wanted if (user_id, student_id) not in current]
+        return cls.objects.bulk_create(missing, ignore_conflicts=True)
+
+
+# ChangeLog table/model
+class ChangeLog(models.Model):
+    '''
+    One row per write of a synced record (records/changes.py), in the transaction of the write:
+    its id is the change sequence the /api/sync/ cursor moves along. Deletions stay as tombstones.
+    A row with an empty model marks a reset, writes that were not logged (records/generator.py):
+    clients holding an older cursor must download everything again
+    '''
+    RESET = ''
+
+    model = models.CharField(max_length=20, blank=True)
+    object_id = models.BigIntegerField(null=True)
+    # The student the record belongs to, no foreign key so tombstones outlive the student
+    student_id = models.BigIntegerField(null=True)
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        '''Indexes for the scoped (students/parents) and the per-model (teachers, resets) scans of the sequence'''
+        indexes = [
+            models.Index(fields=['student_id', 'id'], name='changelog_student_id_idx'),
+            models.Index(fields=['model', 'id'], name='changelog_model_id_idx'),
+        ]
 
 
 # UserProfile model
@@ -247,6 +385,18 @@ class UserProfile(models.Model):
             ("Pending", "Registered, pending approval"),
             ]
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
+    # Carried in the 'rv' claim of access tokens, tokens minted before a change are rejected
+    role_version = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        '''Bump role_version when the role of an existing profile changes'''
+        if self.pk is not None:
+            previous = UserProfile.objects.filter(pk=self.pk).values_list('role', flat=True).first()
+            if previous is not None and previous != self.role:
+                self.role_version += 1
+                if kwargs.get('update_fields') is not None:
+                    kwargs['update_fields'] = {*kwargs['update_fields'], 'role_version'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return self.role
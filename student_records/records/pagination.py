@@ -0,0 +1,76 @@
+import hashlib
+
+from django.conf import settings
+from django.core.paginator import EmptyPage, Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from . import cache as records_cache
+
+
+def estimated_count(queryset):
+    '''The database's own estimate of the rows of queryset's table, None where it keeps none'''
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+        row = cursor.fetchone()
+    # -1 until the table is first analyzed
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+class RecordsPaginator(Paginator):
+    '''
+    Paginator whose count does not grow with the table: rows are counted exactly up to
+    RECORDS_EXACT_COUNT_LIMIT, by a count that stops there. Past it, a whole table is counted
+    by the database's estimate where it keeps one (PostgreSQL), and a filtered list is counted
+    once and kept in the records cache until a write to a table it reads. count_is_exact is
+    False for estimates, which the page numbers only approximate
+    '''
+
+    def __init__(self, object_list, per_page, *args, **kwargs):
+        super().__init__(object_list, per_page, *args, **kwargs)
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return len(queryset)
+        queryset = queryset.order_by()
+        limit = getattr(settings, 'RECORDS_EXACT_COUNT_LIMIT', 10000)
+        bounded = queryset[:limit + 1].count()
+        if bounded <= limit:
+            return bounded
+        if not queryset.query.where:
+            estimate = estimated_count(queryset)
+            if estimate is not None:
+                self.count_is_exact = False
+                return max(estimate, bounded)
+        sql, params = queryset.query.sql_with_params()
+        dependencies = records_cache.query_dependencies(queryset, sql)
+        if dependencies is None:
+            return queryset.count()
+        name = 'count:' + hashlib.sha1(f'{sql}|{params!r}'.encode()).hexdigest()
+        return records_cache.cached(name, dependencies, queryset.count)
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            # An estimate may fall short of the last pages, which are served rather than a 404
+            if self.count_is_exact or int(number) < 1:
+                raise
+            return int(number)
+
+
+class PaginatedListMixin:
+    '''Page-number pagination of a records ListView, counted by RecordsPaginator'''
+    paginate_by = 50
+    paginator_class = RecordsPaginator
+
+    def paginate_queryset(self, queryset, page_size):
+        # The same order on every page: the list's own order, then the primary key
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        return super().paginate_queryset(queryset.order_by(*ordering, 'pk'), page_size)
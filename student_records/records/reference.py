@@ -0,0 +1,63 @@
+import threading
+
+from .models import Grade, Teacher, Subject
+from . import cache as records_cache
+
+# Small tables read by nearly every page: dropdowns, display names, foreign key validation
+REFERENCE_MODELS = (Teacher, Subject, Grade)
+
+
+class Snapshot:
+    '''Every row of the reference tables at the versions they were loaded at'''
+
+    def __init__(self, versions):
+        self.versions = versions
+        self.rows = {}
+        self.by_id = {}
+        for model in REFERENCE_MODELS:
+            self.rows[model] = list(model.objects.order_by(*model._meta.ordering, 'pk'))
+            self.by_id[model] = {obj.pk: obj for obj in self.rows[model]}
+
+
+_snapshot = None
+_lock = threading.Lock()
+
+
+def snapshot(request=None):
+    '''
+    The reference data snapshot of this process. Its versions (records/cache.py) are checked in
+    the shared cache on every call, no query; the tables are reloaded, three queries, only after
+    a Teacher, Subject or Grade was written by any process. Given the request, the versions are
+    checked once for the request and later calls return the same snapshot
+    '''
+    global _snapshot
+    if request is not None:
+        current = getattr(request, '_reference_snapshot', None)
+        if current is None:
+            current = request._reference_snapshot = snapshot()
+        return current
+    versions = records_cache.get_versions(REFERENCE_MODELS)
+    current = _snapshot
+    if current is None or current.versions != versions:
+        with _lock:
+            current = _snapshot
+            if current is None or current.versions != versions:
+                current = Snapshot(versions)
+                # A snapshot loaded from a transaction's uncommitted writes carries versions that
+                # only become current if it commits
+                _snapshot = current
+    return current
+
+
+def get(model, pk, request=None):
+    '''The model instance with that primary key, None if there is none. Shared, do not modify it'''
+    try:
+        pk = int(pk)
+    except (TypeError, ValueError):
+        return None
+    return snapshot(request).by_id[model].get(pk)
+
+
+def rows(model, request=None):
+    '''Every row of a reference model, in the model's default order'''
+    return snapshot(request).rows[model]
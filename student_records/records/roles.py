@@ -0,0 +1,78 @@
+import time
+
+from django.conf import settings
+from .models import UserProfile, Parent, StudentAccess
+
+
+# Process-local role cache: user id -> (lower-cased role, role_version, time it was loaded)
+# Entries are replaced when the UserProfile is saved or deleted in this process (see signals.py)
+# and expire after ROLE_CACHE_TTL seconds so other worker processes pick up role changes too
+_role_cache = {}
+
+
+def get_role(user):
+    '''
+    Returns the lower-cased role of the user, or None for anonymous users and users without a profile.
+    The role is resolved once per request: it is memoized on the user object and comes from
+    the process-local cache, or from the signed 'role' claim of a JWT (see api/authentication.py),
+    so only the first request of a user in a process queries UserProfile
+    '''
+    if not getattr(user, 'is_authenticated', False):
+        return None
+
+    role = getattr(user, '_role', None)
+    if role is None:
+        role = user._role = role_for_user_id(user.pk)
+    return role or None
+
+
+def _load(user_id):
+    cached = _role_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[2] < getattr(settings, 'ROLE_CACHE_TTL', 60):
+        return cached
+    profile = UserProfile.objects.filter(user_id=user_id).values_list('role', 'role_version').first()
+    role, version = profile if profile else ('', 0)
+    return remember_role(user_id, role, version)
+
+
+def role_for_user_id(user_id):
+    '''Lower-cased role for a user id from the process-local cache, '' when the user has no profile'''
+    return _load(user_id)[0]
+
+
+def role_version_for_user_id(user_id):
+    '''UserProfile.role_version for a user id from the process-local cache'''
+    return _load(user_id)[1]
+
+
+def set_role(user, role):
+    '''Memoizes a role already known for this request, e.g. from a verified token claim'''
+    user._role = role.lower() if role else ''
+
+
+def remember_role(user_id, role, version):
+    '''Caches the current role of a user, called when their UserProfile changes'''
+    entry = _role_cache[user_id] = ((role or '').lower(), version, time.monotonic())
+    return entry
+
+
+def invalidate_role(user_id):
+    '''Drops the cached role of a user'''
+    _role_cache.pop(user_id, None)
+
+
+def visible_parents(user, parents=None):
+    '''
+    The parent records user may see, of parents (all parents by default): a student sees
+    the parents/guardians linked to them, a parent their own record, teachers and admins
+    every parent, anyone else none
+    '''
+    parents = Parent.objects.all() if parents is None else parents
+    role = get_role(user)
+    if role == 'student':
+        return parents.filter(parent_students__student__in=StudentAccess.student_ids(user))
+    if role == 'parent':
+        return parents.filter(user_id=user.pk)
+    if role in ('teacher', 'admin'):
+        return parents
+    return parents.none()
@@ -2,13 +2,123 @@
 # to autocreate UserProfile when new user is registered
 # Defaults role to pending, waiting for approval and role assignment
 
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.core import mail
+from django.db.models.signals import post_save, pre_save, post_delete, post_migrate
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Student, Parent, StudentParent, StudentAccess
+from .roles import remember_role
+from . import cache as records_cache
+from . import changes
 
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance, role="Pending")
+
+
+@receiver(post_save, sender=UserProfile)
+def cache_changed_role(sender, instance, **kwargs):
+    '''Role changed, replace it in the role cache of this process'''
+    remember_role(instance.user_id, instance.role, instance.role_version)
+    if UserProfile.user.is_cached(instance):
+        instance.user.__dict__.pop('_role', None)
+
+@receiver(post_delete, sender=UserProfile)
+def cache_removed_role(sender, instance, **kwargs):
+    '''Profile removed: no role, and tokens carrying the last role_version are no longer valid'''
+    remember_role(instance.user_id, '', instance.role_version + 1)
+    if UserProfile.user.is_cached(instance):
+        instance.user.__dict__.pop('_role', None)
+
+
+# Keep the StudentAccess table in sync with Student.user, Parent.user and StudentParent
+# ====================================================================================
+def sync_access(student_ids):
+    '''Rows removed bump the cache versions through post_delete, rows added by bulk_create here'''
+    added = StudentAccess.sync(student_ids)
+    if added:
+        records_cache.bump_objects(StudentAccess, added)
+
+@receiver(post_save, sender=Student)
+def sync_student_access(sender, instance, raw=False, **kwargs):
+    '''The student's own user may have been linked, changed or removed'''
+    if not raw:
+        sync_access([instance.pk])
+
+@receiver(post_save, sender=Parent)
+def sync_parent_access(sender, instance, raw=False, **kwargs):
+    '''The parent's user may have changed, resync every child of the parent'''
+    if not raw:
+        sync_access(StudentParent.objects.filter(parent=instance, student__isnull=False).values_list('student_id', flat=True))
+
+@receiver(pre_save, sender=StudentParent)
+def remember_linked_student(sender, instance, raw=False, **kwargs):
+    '''Remember the student a link pointed to before an update moves it'''
+    if instance.pk and not raw:
+        instance._previous_student_id = StudentParent.objects.filter(pk=instance.pk).values_list('student_id', flat=True).first()
+
+@receiver(post_save, sender=StudentParent)
+def sync_link_access(sender, instance, raw=False, **kwargs):
+    if not raw:
+        student_ids = {instance.student_id, getattr(instance, '_previous_student_id', None)} - {None}
+        sync_access(student_ids)
+
+@receiver(post_delete, sender=StudentParent)
+def sync_unlinked_access(sender, instance, **kwargs):
+    if instance.student_id is not None:
+        sync_access([instance.student_id])
+
+
+# Bump the records cache versions (records/cache.py) of every row written through the ORM
+# =======================================================================================
+def remember_previous_scopes(sender, instance, raw=False, **kwargs):
+    '''An update may move the row to another student/class, the old scopes are stale too'''
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    if any(paths != 'pk' for paths in records_cache.SCOPES[sender].values()):
+        previous = sender._base_manager.filter(pk=instance.pk).first()
+        instance._previous_scopes = records_cache.scopes_of(sender, [previous]) if previous else set()
+
+def bump_saved_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        records_cache.bump_objects(sender, [instance], getattr(instance, '_previous_scopes', ()))
+
+def bump_deleted_version(sender, instance, **kwargs):
+    records_cache.bump_objects(sender, [instance])
+
+for versioned_model in records_cache.SCOPES:
+    pre_save.connect(remember_previous_scopes, sender=versioned_model, dispatch_uid=f'records_cache_pre_save_{versioned_model.__name__}')
+    post_save.connect(bump_saved_version, sender=versioned_model, dispatch_uid=f'records_cache_post_save_{versioned_model.__name__}')
+    post_delete.connect(bump_deleted_version, sender=versioned_model, dispatch_uid=f'records_cache_post_delete_{versioned_model.__name__}')
+
+
+# Log every write of a synced record (records/changes.py) for /api/sync/
+# ======================================================================
+def log_saved_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        previous = {int(scope.split(':')[1]) for scope in getattr(instance, '_previous_scopes', ()) if scope.startswith('student:')}
+        changes.record(sender, [instance], previous_students=previous)
+
+def log_deleted_change(sender, instance, **kwargs):
+    changes.record(sender, [instance], deleted=True)
+
+for synced_model in changes.SYNCED:
+    post_save.connect(log_saved_change, sender=synced_model, dispatch_uid=f'changes_post_save_{synced_model.__name__}')
+    post_delete.connect(log_deleted_change, sender=synced_model, dispatch_uid=f'changes_post_delete_{synced_model.__name__}')
+
+
+@receiver(post_migrate)
+def clear_records_cache(sender, **kwargs):
+    '''
+    The database was created or reset: cached values may belong to another one. A test database
+    clears the cache only when it is isolated (student_records/testing.py), never the real one
+    '''
+    if sender.name != 'records':
+        return
+    # setup_test_environment() installs mail.outbox: the migrated database is a test database
+    if hasattr(mail, 'outbox') and not getattr(settings, 'RECORDS_CACHE_ISOLATED', False):
+        return
+    records_cache.clear()
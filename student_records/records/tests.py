@@ -1,3 +1,350 @@
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Sum
+from django.db.migrations.executor import MigrationExecutor
 
 # Create your tests here.
+from accounts.models import CustomUser
+import datetime
+from unittest.mock import patch
+from .models import UserProfile, Student, Parent, StudentParent, Grade, Teacher, Subject, Performance, Attendance, Invoice, Payment, Enrollment, StudentAccess
+from .roles import _role_cache
+from .signals import clear_records_cache
+from student_records import settings as settings_module
+from . import cache as records_cache
+from . import reference
+from .forms import PerformanceForm
+from .benchmark import compare
+from .generator import SchoolGenerator
+from .pagination import RecordsPaginator
+from .views import is_admin, is_student, is_teacher, is_parent, is_pending
+
+
+class RoleResolutionTests(TestCase):
+    '''Role checks load UserProfile once per process, later requests resolve roles with no queries'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='jane', password='Password123##', phone_number='254700000001')
+        cls.profile = UserProfile.objects.create(user=cls.user, role='Teacher')
+
+    def setUp(self):
+        _role_cache.clear()
+
+    def fresh_user(self):
+        '''The user as a new request would load it'''
+        return CustomUser.objects.get(pk=self.user.pk)
+
+    def check_all_roles(self, user):
+        return [is_admin(user), is_student(user), is_teacher(user), is_parent(user), is_pending(user)]
+
+    def test_role_loaded_once_per_request(self):
+        user = self.fresh_user()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.check_all_roles(user), [False, False, True, False, False])
+            self.check_all_roles(user)
+
+    def test_no_queries_for_later_requests(self):
+        self.check_all_roles(self.fresh_user())
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.check_all_roles(user), [False, False, True, False, False])
+
+    def test_profile_save_invalidates_cached_role(self):
+        self.check_all_roles(self.fresh_user())
+        self.profile.role = 'Admin'
+        self.profile.save()
+        self.assertTrue(is_admin(self.fresh_user()))
+
+    def test_user_without_profile(self):
+        user = CustomUser.objects.create_user(username='nobody', password='Password123##', phone_number='254700000002')
+        self.assertEqual(self.check_all_roles(user), [False] * 5)
+        with self.assertNumQueries(0):
+            self.check_all_roles(CustomUser(pk=user.pk))
+
+
+class BenchmarkCompareTests(SimpleTestCase):
+    '''manage.py benchmark --compare fails on any extra query and on large slowdowns only'''
+
+    baseline = {'student-list as Admin': {'status': 200, 'queries': 1, 'p95_ms': 10.0}}
+
+    def test_noise_is_not_a_regression(self):
+        self.assertEqual(compare(self.baseline, {'student-list as Admin': {'status': 200, 'queries': 1, 'p95_ms': 19.0}}), [])
+
+    def test_regressions(self):
+        current = {'student-list as Admin': {'status': 200, 'queries': 51, 'p95_ms': 40.0}}
+        self.assertEqual(compare(self.baseline, current), ['student-list as Admin: 1 -> 51 queries', 'student-list as Admin: p95 10.0ms -> 40.0ms'])
+        self.assertEqual(compare(self.baseline, {}), ['student-list as Admin: missing from this run'])
+
+
+class RecordsCacheTests(TestCase):
+    '''Cached values are kept until a write bumps the version of a model/scope they depend on'''
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher = Teacher.objects.create(full_name='Tom Teacher')
+        cls.grade = Grade.objects.create(name=4, stream='East', teacher=teacher)
+        cls.other_grade = Grade.objects.create(name=5, stream='West', teacher=teacher)
+        cls.subject = Subject.objects.create(name='Maths', teacher=teacher)
+        cls.student = cls.make_student('Amina', cls.grade)
+        cls.other = cls.make_student('Brian', cls.other_grade)
+
+    @classmethod
+    def make_student(cls, name, grade):
+        return Student.objects.create(first_name=name, last_name='Otieno', gender='F', date_of_birth=datetime.date(2012, 1, 1),
+                                      address='Nairobi', status='Enrolled', date_of_admission=datetime.date(2020, 1, 1),
+                                      student_email=f'{name.lower()}@example.com', grade=grade)
+
+    def setUp(self):
+        records_cache.clear()
+        self.calls = 0
+
+    def test_test_runs_keep_their_own_shared_cache(self):
+        real = settings_module.CACHES['shared']['LOCATION']
+        self.assertNotEqual(settings.CACHES['shared']['LOCATION'], real)
+        records_cache.shared_cache().set('kept', 1)
+        # A test database migrated without the isolation leaves the shared tier alone
+        with self.settings(RECORDS_CACHE_ISOLATED=False):
+            clear_records_cache(sender=apps.get_app_config('records'))
+        self.assertEqual(records_cache.shared_cache().get('kept'), 1)
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def cached(self, dependencies):
+        return records_cache.cached('test', dependencies, self.compute)
+
+    def test_value_is_reused_until_a_dependency_changes(self):
+        dependencies = [(Attendance, f'grade:{self.grade.pk}')]
+        self.assertEqual(self.cached(dependencies), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.cached(dependencies), 1)
+        Attendance.objects.create(grade=self.grade, student=self.student, date=datetime.date(2024, 1, 15), status=1)
+        self.assertEqual(self.cached(dependencies), 2)
+
+    def test_writes_only_invalidate_their_scopes(self):
+        dependencies = [(Performance, f'student:{self.student.pk}'), (Performance, f'grade:{self.grade.pk}')]
+        self.cached(dependencies)
+        Performance.objects.create(student=self.other, subject=self.subject, score=70, exam_type='CAT', academic_year=2024, term=1)
+        self.assertEqual(self.cached(dependencies), 1)
+        self.assertEqual(self.cached([Performance]), 2)
+
+    def test_moving_a_row_invalidates_the_old_scope(self):
+        dependencies = [(Student, f'grade:{self.grade.pk}')]
+        self.cached(dependencies)
+        self.student.grade = self.other_grade
+        self.student.save()
+        self.assertEqual(self.cached(dependencies), 2)
+
+    def test_bulk_writes_bump_explicitly(self):
+        dependencies = [(Attendance, f'student:{self.student.pk}')]
+        self.cached(dependencies)
+        marks = [Attendance(grade=self.grade, student=self.student, date=datetime.date(2024, 1, 16), status=1)]
+        Attendance.objects.bulk_create(marks)
+        self.assertEqual(self.cached(dependencies), 1)
+        records_cache.bump_objects(Attendance, marks)
+        self.assertEqual(self.cached(dependencies), 2)
+
+    def test_shared_tier_serves_other_processes(self):
+        self.cached([Subject])
+        records_cache.local_cache().clear()
+        self.assertEqual(self.cached([Subject]), 1)
+
+
+class PaginationTests(TestCase):
+    '''Page counts are exact below RECORDS_EXACT_COUNT_LIMIT, cached above it until a write'''
+
+    @classmethod
+    def setUpTestData(cls):
+        teacher = Teacher.objects.create(full_name='Tom Teacher')
+        cls.grade = Grade.objects.create(name=4, stream='East', teacher=teacher)
+        cls.student = RecordsCacheTests.make_student('Amina', cls.grade)
+        for day in range(1, 4):
+            Attendance.objects.create(grade=cls.grade, student=cls.student, date=datetime.date(2024, 1, day), status=1)
+        cls.user = CustomUser.objects.create_superuser(username='admin', password='Password123##', phone_number='254700000009')
+        UserProfile.objects.create(user=cls.user, role='Admin')
+
+    def setUp(self):
+        records_cache.clear()
+        _role_cache.clear()
+
+    def count(self):
+        return RecordsPaginator(Attendance.objects.filter(grade=self.grade).order_by('date'), 2).count
+
+    def test_exact_count_below_the_limit(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.count(), 3)
+
+    @override_settings(RECORDS_EXACT_COUNT_LIMIT=2)
+    def test_cached_count_above_the_limit(self):
+        self.assertEqual(self.count(), 3)
+        # Only the count bounded by the limit
+        with self.assertNumQueries(1):
+            self.assertEqual(self.count(), 3)
+        Attendance.objects.create(grade=self.grade, student=self.student, date=datetime.date(2024, 1, 4), status=1)
+        self.assertEqual(self.count(), 4)
+
+    @override_settings(RECORDS_EXACT_COUNT_LIMIT=2)
+    def test_list_pages_count_with_bounds_past_the_limit(self):
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/records/attendances/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 3)
+        self.assertEqual([attendance.date.day for attendance in response.context['attendances']], [1, 2, 3])
+        counts = [query['sql'] for query in queries if 'COUNT(' in query['sql'].upper()]
+        # The bounded count, then the full count kept in the records cache: the validators count nothing
+        self.assertEqual(len(counts), 2)
+        self.assertIn('LIMIT 3', counts[0])
+
+    def test_admin_skips_the_full_count(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/admin/records/attendance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertIsNone(response.context['cl'].full_result_count)
+
+
+class NaturalKeyMigrationTests(TransactionTestCase):
+    '''Migration 0003 stops on repeated natural keys, listing them, rather than deleting rows'''
+    before = [('records', '0002_keyset_pagination_indexes')]
+    after = [('records', '0003_role_scoped_indexes')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_repeated_keys_stop_the_migration(self):
+        apps = self.migrate(self.before)
+        teacher = apps.get_model('records', 'Teacher').objects.create(full_name='Tom Teacher')
+        grade = apps.get_model('records', 'Grade').objects.create(name=4, stream='East', teacher=teacher)
+        subject = apps.get_model('records', 'Subject').objects.create(name='Maths', teacher=teacher)
+        student = apps.get_model('records', 'Student').objects.create(
+            first_name='Amina', last_name='Otieno', gender='F', date_of_birth=datetime.date(2012, 1, 1), address='Nairobi',
+            status='Enrolled', date_of_admission=datetime.date(2020, 1, 1), student_email='amina@example.com', grade=grade)
+        Attendance = apps.get_model('records', 'Attendance')
+        Performance = apps.get_model('records', 'Performance')
+        marks = [Attendance.objects.create(student=student, grade=grade, date=datetime.date(2024, 1, 15), status=status) for status in (0, 1)]
+        Attendance.objects.create(student=student, grade=grade, date=datetime.date(2024, 1, 16), status=0)
+        scores = [Performance.objects.create(student=student, subject=subject, score=score, exam_type='CAT', academic_year=2024, term=1)
+                  for score in (40, 80)]
+
+        with self.assertRaises(IntegrityError) as raised:
+            self.migrate(self.after)
+        message = str(raised.exception)
+        self.assertIn(f'attendance student_id={student.pk}, date=2024-01-15: ids {marks[0].pk}, {marks[1].pk}', message)
+        self.assertIn(f'performance student_id={student.pk}, subject_id={subject.pk}, exam_type=CAT, academic_year=2024, term=1: '
+                      f'ids {scores[0].pk}, {scores[1].pk}', message)
+        # Nothing was deleted
+        self.assertEqual(Attendance.objects.count(), 3)
+        self.assertEqual(Performance.objects.count(), 2)
+
+        Attendance.objects.filter(pk=marks[0].pk).delete()
+        Performance.objects.filter(pk=scores[0].pk).delete()
+        apps = self.migrate(self.after)
+        self.assertEqual(apps.get_model('records', 'Attendance').objects.count(), 2)
+
+
+class ReferenceDataTests(TestCase):
+    '''Teachers, subjects and classes are served from a per-process snapshot reloaded after writes only'''
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = Teacher.objects.create(full_name='Tom Teacher')
+        cls.maths = Subject.objects.create(name='Maths', teacher=cls.teacher)
+        cls.grade = Grade.objects.create(name=4, stream='East', teacher=cls.teacher)
+
+    def test_lookups_without_queries(self):
+        reference.snapshot()
+        with self.assertNumQueries(0):
+            self.assertEqual(reference.get(Subject, self.maths.pk).name, 'Maths')
+            self.assertEqual(str(reference.get(Grade, str(self.grade.pk))), 'Grade: 4 East')
+            self.assertIsNone(reference.get(Teacher, 'x'))
+            self.assertEqual([subject.name for subject in reference.rows(Subject)], ['Maths'])
+
+    def test_versions_checked_once_per_request(self):
+        request = RequestFactory().get('/')
+        with patch.object(records_cache, 'get_versions', wraps=records_cache.get_versions) as get_versions:
+            for _ in range(3):
+                self.assertEqual(reference.get(Subject, self.maths.pk, request).name, 'Maths')
+            self.assertIs(reference.snapshot(request), reference.snapshot(request))
+        self.assertEqual(get_versions.call_count, 1)
+
+    def test_reloaded_after_a_write(self):
+        reference.snapshot()
+        Subject.objects.create(name='English', teacher=self.teacher)
+        with self.assertNumQueries(3):
+            self.assertEqual([subject.name for subject in reference.rows(Subject)], ['English', 'Maths'])
+
+    def test_form_dropdown_and_validation(self):
+        reference.snapshot()
+        form = PerformanceForm(data={'subject': self.maths.pk, 'score': 80, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1})
+        with self.assertNumQueries(0):
+            self.assertIn('Maths', str(form['subject']))
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['subject'], self.maths)
+        form = PerformanceForm(data={'subject': 0, 'score': 80, 'exam_type': 'CAT', 'academic_year': 2024, 'term': 1})
+        self.assertIn('subject', form.errors)
+
+
+class SchoolGeneratorTests(TestCase):
+    '''A generated school only depends on the seed and the options, and its rows agree with each other'''
+    options = {'students': 12, 'levels': 2, 'streams': 2, 'subjects': 3, 'first_year': 2023, 'years': 2, 'terms': 2,
+               'school_days': 3, 'accounts': True, 'seed': 7, 'chunk_size': 5}
+    models = [CustomUser, UserProfile, Teacher, Grade, Subject, Parent, Student, StudentParent, Enrollment, Performance, Attendance, Invoice, Payment]
+
+    def rows(self):
+        '''Every generated row but the columns set at write time (updated_at, date_joined, salted passwords)'''
+        rows = {}
+        for model in self.models:
+            fields = [field.attname for field in model._meta.concrete_fields if field.name not in ('updated_at', 'date_joined', 'password')]
+            rows[model.__name__] = list(model.objects.order_by('pk').values_list(*fields))
+        return rows
+
+    def test_same_seed_same_school(self):
+        with transaction.atomic():
+            SchoolGenerator(**self.options).generate()
+            first = self.rows()
+            transaction.set_rollback(True)
+        SchoolGenerator(**self.options).generate()
+        self.assertEqual(self.rows(), first)
+        self.assertEqual(len(first['Student']), 12)
+        with transaction.atomic():
+            SchoolGenerator(**dict(self.options, seed=8)).generate()
+            self.assertNotEqual(self.rows()['Student'], first['Student'])
+            transaction.set_rollback(True)
+
+    def test_rows_are_consistent(self):
+        SchoolGenerator(**self.options).generate()
+        # One class teacher per class, subject teachers apart
+        grades = list(Grade.objects.all())
+        self.assertEqual(len(grades), 4)
+        self.assertEqual(len({grade.teacher_id for grade in grades}), 4)
+        self.assertFalse(Subject.objects.filter(teacher__in=[grade.teacher_id for grade in grades]).exists())
+
+        # Payments add up to what was paid of each invoice
+        for invoice in Invoice.objects.annotate(paid=Sum('payments__amount_paid')):
+            self.assertEqual(invoice.paid or 0, invoice.total_amount - invoice.amount_due)
+            self.assertEqual(invoice.status, 'PAID' if invoice.amount_due == 0 else 'PENDING')
+
+        # A yearly enrollment in the class of the student's level, the current one in their class
+        for enrollment in Enrollment.objects.select_related('student', 'grade'):
+            self.assertEqual(enrollment.grade.name, enrollment.academic_year - enrollment.student.date_of_admission.year + 1)
+        for student in Student.objects.filter(status='Enrolled'):
+            self.assertEqual(list(student.enrollments.filter(status='ENROLLED').values_list('grade_id', 'academic_year')), [(student.grade_id, 2024)])
+        self.assertFalse(Student.objects.exclude(status='Enrolled').filter(enrollments__status='ENROLLED').exists())
+
+        # Every account has its profile, students and parents their StudentAccess rows
+        self.assertEqual(UserProfile.objects.count(), CustomUser.objects.count())
+        expected = set(Student.objects.values_list('user_id', 'pk'))
+        expected |= set(StudentParent.objects.values_list('parent__user_id', 'student_id'))
+        self.assertEqual(set(StudentAccess.objects.values_list('user_id', 'student_id')), expected)
@@ -1,6 +1,6 @@
 # records/urls.py
 from django.urls import path
-from .views import admin_view, student_view, teacher_view, parent_view, pending_view, login_redirect, StudentListView, StudentDetailView, StudentCreateView, StudentUpdateView, StudentDeleteView, ParentListView, ParentDetailView, ParentCreateView, ParentUpdateView, ParentDeleteView, GradeListView, GradeDetailView, GradeCreateView, GradeUpdateView, GradeDeleteView, TeacherListView, TeacherDetailView, TeacherCreateView, TeacherUpdateView, TeacherDeleteView, SubjectListView, SubjectDetailView, SubjectCreateView, SubjectUpdateView, SubjectDeleteView, PerformanceListView, PerformanceDetailView, PerformanceCreateView, PerformanceUpdateView, PerformanceDeleteView, AttendanceListView, AttendanceDetailView, AttendanceCreateView, AttendanceUpdateView, AttendanceDeleteView, InvoiceListView, InvoiceDetailView, InvoiceCreateView, InvoiceUpdateView, InvoiceDeleteView, PaymentListView, PaymentDetailView, PaymentCreateView, PaymentUpdateView, PaymentDeleteView, EnrollmentListView, EnrollmentDetailView, EnrollmentCreateView, EnrollmentUpdateView, EnrollmentDeleteView
+from .views import admin_view, student_view, teacher_view, parent_view, pending_view, login_redirect, StudentListView, StudentDetailView, StudentCreateView, StudentUpdateView, StudentDeleteView, ParentListView, ParentDetailView, ParentCreateView, ParentUpdateView, ParentDeleteView, GradeListView, GradeDetailView, GradeCreateView, GradeUpdateView, GradeDeleteView, GradebookView, TeacherListView, TeacherDetailView, TeacherCreateView, TeacherUpdateView, TeacherDeleteView, SubjectListView, SubjectDetailView, SubjectCreateView, SubjectUpdateView, SubjectDeleteView, PerformanceListView, PerformanceDetailView, PerformanceCreateView, PerformanceUpdateView, PerformanceDeleteView, AttendanceListView, AttendanceDetailView, AttendanceCreateView, AttendanceUpdateView, AttendanceDeleteView, InvoiceListView, InvoiceDetailView, InvoiceCreateView, InvoiceUpdateView, InvoiceDeleteView, PaymentListView, PaymentDetailView, PaymentCreateView, PaymentUpdateView, PaymentDeleteView, EnrollmentListView, EnrollmentDetailView, EnrollmentCreateView, EnrollmentUpdateView, EnrollmentDeleteView
 
 urlpatterns = [
     # Role views url mapping
@@ -28,6 +28,7 @@ urlpatterns = [
     path('grade/new/', GradeCreateView.as_view(), name='grade_create'),
     path('grade/<int:pk>/update/', GradeUpdateView.as_view(), name='grade_update'),
     path('grade/<int:pk>/delete/', GradeDeleteView.as_view(), name='grade_delete'),
+    path('grade/<int:pk>/gradebook/', GradebookView.as_view(), name='gradebook'),
     # teacher model CRUD views url mapping
     path('teachers/', TeacherListView.as_view(), name='teacher_list'),
     path('teacher/<int:pk>/', TeacherDetailView.as_view(), name='teacher_detail'),
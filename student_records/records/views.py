@@ -1,11 +1,17 @@
 from django.shortcuts import render, redirect
-from django.views.generic import CreateView, UpdateView, ListView, DetailView, DeleteView
+from django.views.generic import CreateView, UpdateView, ListView, DetailView, DeleteView, TemplateView
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.contrib.auth.decorators import login_required
-from .models import Student, Parent, Grade, Teacher, Performance, Attendance, Invoice, Payment, Enrollment, Subject
-from .forms import StudentForm, ParentForm, GradeForm, TeacherForm, PerformanceForm, AttendanceForm, InvoiceForm, PaymentForm, EnrollmentForm, SubjectForm
+from .models import Student, Parent, Grade, Teacher, Performance, Attendance, Invoice, Payment, Enrollment, Subject, StudentAccess
+from .forms import StudentForm, ParentForm, GradeForm, TeacherForm, PerformanceForm, AttendanceForm, InvoiceForm, PaymentForm, EnrollmentForm, SubjectForm, GradebookExamForm, GradebookFormSet
+from .gradebook import Gradebook, editable_subjects, gradebook_subjects
+from .conditional import ConditionalListMixin, ConditionalDetailMixin
+from .pagination import PaginatedListMixin
 from django.contrib.auth.decorators import user_passes_test
+from .roles import get_role, visible_parents
 
 
 # Create your views here.
@@ -14,26 +20,26 @@ from django.contrib.auth.decorators import user_passes_test
 # =====================================================
 def is_admin(user):
     '''Checks if user has a profile and is admin, returns True/False'''
-    return hasattr(user, 'userprofile') and user.userprofile.role.lower() == 'admin'
+    return get_role(user) == 'admin'
 
 def is_student(user):
     '''Checks if user has a profile and is student, returns True/False'''
-    return hasattr(user, 'userprofile') and user.userprofile.role.lower() == 'student'
+    return get_role(user) == 'student'
 
 def is_teacher(user):
     '''Checks if user has a profile and is a teacher, returns True/False'''
-    return hasattr(user, 'userprofile') and user.userprofile.role.lower() == 'teacher'
+    return get_role(user) == 'teacher'
 
 def is_parent(user):
     '''Checks if user has a profile and is a parent, returns True/False'''
-    return hasattr(user, 'userprofile') and user.userprofile.role.lower() == 'parent'
+    return get_role(user) == 'parent'
 
 def is_pending(user):
     '''
     For user who just registered, waiting for approval, returns True/False
     To ensure the right people access the records
     '''
-    return hasattr(user, 'userprofile') and user.userprofile.role.lower() == 'pending'
+    return get_role(user) == 'pending'
 
 
 # Views for the different roles once logged in
@@ -84,7 +90,7 @@ def login_redirect(request):
 
 # Student model views for CRUD operations
 # =======================================
-class StudentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class StudentListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all student records, login required for Admin or Teacher
     Student and parents  only views their own/their children's  records
@@ -105,17 +111,14 @@ class StudentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         '''Restrict students and parents to view of their own/their children's records'''
         user = self.request.user
 
-        # For students
-        if is_student(user):
-            return Student.objects.filter(user=user)
-        # For parents
-        elif is_parent(user):
-            return Student.objects.filter(parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return Student.objects.filter(pk__in=StudentAccess.student_ids(user))
         # For teacher and admin
         else:
             return Student.objects.all()
 
-class StudentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class StudentDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific student
     Student/Parents view only their/their children's records
@@ -140,12 +143,9 @@ class StudentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Student.objects.get(pk=pk, user=user)
-        # For parents
-        elif is_parent(user):
-            return Student.objects.get(pk=pk, parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Student.objects.filter(pk__in=StudentAccess.student_ids(user)), pk=pk)
         # For admin and teachers
         return super().get_object()
 
@@ -185,7 +185,7 @@ class StudentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Parent model views for CRUD operations
 # =======================================
-class ParentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class ParentListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all parent records
     Student and parents only view their own/their parents'/guardians' records
@@ -204,19 +204,9 @@ class ParentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
 
     def get_queryset(self):
         '''Restrict parents/students to view of their own/their parent's records'''
-        user = self.request.user
-
-        # For students
-        if is_student(user):
-            return Parent.objects.filter(user=user)
-        # For parents
-        elif is_parent(user):
-            return Parent.objects.filter(students__student=user.student_profile)
-        # For teacher and admin
-        else:
-            return Parent.objects.all()
+        return visible_parents(self.request.user)
 
-class ParentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class ParentDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific parent
     Parents/Students view only their/their parents'/guardians' records
@@ -236,19 +226,9 @@ class ParentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
 
     def get_object(self):
         '''
-        override get_object method
+        override get_object method: 404 for parents the user may not see
         '''
-        user = self.request.user
-        pk = self.kwargs['pk']
-
-        # For students
-        if is_student(user):
-            return Parent.objects.get(pk=pk, user=user)
-        # For parents
-        elif is_parent(user):
-            return Parent.objects.get(pk=pk, students__student=user.student_profile)
-        # For admin and teachers
-        return super().get_object()
+        return get_object_or_404(visible_parents(self.request.user), pk=self.kwargs['pk'])
 
 class ParentCreateView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
     '''allow admins to add new parents/guardians'''
@@ -285,7 +265,7 @@ class ParentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Grade model views for CRUD operations
 # =======================================
-class GradeListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class GradeListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all grade records
     Student and parents only view their own/their parents'/guardians' record
@@ -306,17 +286,14 @@ class GradeListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         '''Restrict parents/students to view of their own/their parent's records'''
         user = self.request.user
 
-        # For students
-        if is_student(user):
-            return Grade.objects.filter(students=user.student_profile)
-        # For parents
-        elif is_parent(user):
-            return Grade.objects.filter(students__in=user.parent_profile.students.all())
+        # For students and parents, the classes of the students in their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return Grade.objects.filter(pk__in=Student.objects.filter(pk__in=StudentAccess.student_ids(user)).values('grade'))
         # For teacher and admin
         else:
             return Grade.objects.all()
 
-class GradeDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class GradeDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific grade
     Students/Parents view only their own children's records
@@ -341,12 +318,9 @@ class GradeDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Grade.objects.get(pk=pk, students=user.student_profile)
-        # For parents
-        elif is_parent(user):
-            return Grade.objects.get(pk=pk, students__in=user.parent_profile.students.all())
+        # For students and parents, the classes of the students in their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Grade.objects.filter(pk__in=Student.objects.filter(pk__in=StudentAccess.student_ids(user)).values('grade')), pk=pk)
         # For admin and teachers
         return super().get_object()
 
@@ -386,7 +360,7 @@ class GradeDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Teacher model views for CRUD operations
 # =======================================
-class TeacherListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class TeacherListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all teacher records for all roles(Admin/Teacher/Student/Parent)
     '''
@@ -402,7 +376,7 @@ class TeacherListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         user = self.request.user
         return is_admin(user) or is_teacher(user) or is_student(user) or is_parent(user)
 
-class TeacherDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class TeacherDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific teacher to all roles
     '''
@@ -454,7 +428,7 @@ class TeacherDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Subject model views for CRUD operations
 # =======================================
-class SubjectListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class SubjectListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all subject records for all roles(Admin/Teacher/Student/Parent)
     '''
@@ -470,7 +444,7 @@ class SubjectListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         user = self.request.user
         return is_admin(user) or is_teacher(user) or is_student(user) or is_parent(user)
 
-class SubjectDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class SubjectDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific subject to all roles
     '''
@@ -522,7 +496,7 @@ class SubjectDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Performance model views for CRUD operations
 # =======================================
-class PerformanceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class PerformanceListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all performance records for Admin/Teacher
     Student/Parent can only view their own/own children's records
@@ -544,18 +518,17 @@ class PerformanceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         Restrict students and parents to view of their own/their children's performance records
         '''
         user = self.request.user
+        # Relations shown in the list, joined in the same query
+        performances = Performance.objects.select_related('subject', 'student')
 
-        # For students
-        if is_student(user):
-            return Performance.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Performance.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return performances.filter(student__in=StudentAccess.student_ids(user))
         # For teacher and admin
         else:
-            return Performance.objects.all()
+            return performances.all()
 
-class PerformanceDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class PerformanceDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific performance
     Admin/Teacher can view all performances
@@ -580,12 +553,9 @@ class PerformanceDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView)
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Performance.objects.get(pk=pk, student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Performance.objects.get(pk=pk, student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Performance, pk=pk, student__in=StudentAccess.student_ids(user))
         # For admin and teachers
         return super().get_object()
 
@@ -622,10 +592,75 @@ class PerformanceDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView)
         '''A test that the current logged-in user must pass to access the view- must be admin'''
         return is_admin(self.request.user)
 
+class GradebookView(LoginRequiredMixin, UserPassesTestMixin, TemplateView):
+    '''
+    Gradebook of a class for one exam (?exam_type=&academic_year=&term=, optionally &subject=):
+    every student of the grade against every subject as one editable matrix.
+    The matrix is loaded with one aggregated query and the changed cells are saved with one upsert.
+    Admins can enter scores for every subject, teachers for the subjects they teach
+    '''
+    template_name = 'records/gradebook.html'
+
+    def test_func(self):
+        '''A test that the current logged-in user must pass to access the view- must be admin/teacher'''
+        user = self.request.user
+        return is_admin(user) or is_teacher(user)
+
+    def get_gradebook(self):
+        '''The Gradebook picked by the query string, None until a valid exam is picked'''
+        self.grade = get_object_or_404(Grade, pk=self.kwargs['pk'])
+        self.exam_form = GradebookExamForm(self.request.GET or None)
+        if not self.exam_form.is_valid():
+            return None
+        exam = self.exam_form.cleaned_data
+        subjects = [exam['subject']] if exam['subject'] else gradebook_subjects(self.request.user)
+        return Gradebook(self.grade, exam['exam_type'], exam['academic_year'], exam['term'], subjects)
+
+    def get_formset(self, gradebook, rows, data=None):
+        initial = []
+        for row in rows:
+            values = {gradebook.column(subject): row['scores'][subject.pk] for subject in gradebook.subjects}
+            values['student'] = row['id']
+            initial.append(values)
+        form_kwargs = {'subjects': gradebook.subjects, 'editable_subjects': self.editable}
+        return GradebookFormSet(data, initial=initial, form_kwargs=form_kwargs)
+
+    def render_gradebook(self, gradebook, rows, formset, errors=()):
+        return self.render_to_response(self.get_context_data(
+            grade=self.grade, exam_form=self.exam_form, gradebook=gradebook, formset=formset,
+            rows=list(zip(rows, formset)) if formset is not None else [], errors=errors))
+
+    def get(self, request, *args, **kwargs):
+        gradebook = self.get_gradebook()
+        if gradebook is None:
+            return self.render_gradebook(None, [], None)
+        self.editable = editable_subjects(request.user, gradebook.subjects)
+        rows = gradebook.rows()
+        return self.render_gradebook(gradebook, rows, self.get_formset(gradebook, rows))
+
+    def post(self, request, *args, **kwargs):
+        gradebook = self.get_gradebook()
+        if gradebook is None:
+            return self.render_gradebook(None, [], None)
+        self.editable = editable_subjects(request.user, gradebook.subjects)
+        rows = gradebook.rows()
+        formset = self.get_formset(gradebook, rows, request.POST)
+        if not formset.is_valid():
+            return self.render_gradebook(gradebook, rows, formset)
+
+        cells = {}
+        for form in formset:
+            cells.update(form.changed_scores())
+        try:
+            gradebook.save(cells, self.editable)
+        except ValidationError as error:
+            return self.render_gradebook(gradebook, rows, formset, error.messages)
+        return redirect(f'{request.path}?{request.GET.urlencode()}')
+
 
 # Attendance model views for CRUD operations
 # =======================================
-class AttendanceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class AttendanceListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all attendance records for Admin/Teacher
     Student/Parent can only view their own/own children's records
@@ -647,18 +682,17 @@ class AttendanceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         Restrict students and parents to view of their own/their children's attendance records
         '''
         user = self.request.user
+        # Relations shown in the list, joined in the same query
+        attendances = Attendance.objects.select_related('grade', 'student')
 
-        # For students
-        if is_student(user):
-            return Attendance.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Attendance.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return attendances.filter(student__in=StudentAccess.student_ids(user))
         # For teacher and admin
         else:
-            return Attendance.objects.all()
+            return attendances.all()
 
-class AttendanceDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class AttendanceDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific attendance for a student
     Admin/Teacher can view all attendances
@@ -683,12 +717,9 @@ class AttendanceDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Attendance.objects.get(pk=pk, student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Attendance.objects.get(pk=pk, student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Attendance, pk=pk, student__in=StudentAccess.student_ids(user))
         # For admin and teachers
         return super().get_object()
 
@@ -728,7 +759,7 @@ class AttendanceDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Invoice model views for CRUD operations
 # =======================================
-class InvoiceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class InvoiceListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all invoice records for Admin
     Student/Parent can only view their own/own children's invoice records
@@ -751,18 +782,17 @@ class InvoiceListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         Restrict students and parents to view of their own/their children's invoice records
         '''
         user = self.request.user
+        # Relations shown in the list, joined in the same query
+        invoices = Invoice.objects.select_related('student')
 
-        # For students
-        if is_student(user):
-            return Invoice.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Invoice.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return invoices.filter(student__in=StudentAccess.student_ids(user))
         # For admin
         else:
-            return Invoice.objects.all()
+            return invoices.all()
 
-class InvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class InvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific invoice
     Admin can view all invoices
@@ -788,12 +818,9 @@ class InvoiceDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Invoice.objects.get(pk=pk, student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Invoice.objects.get(pk=pk, student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Invoice, pk=pk, student__in=StudentAccess.student_ids(user))
         # For teachers
         return super().get_object()
 
@@ -833,7 +860,7 @@ class InvoiceDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Payment model views for CRUD operations
 # =======================================
-class PaymentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class PaymentListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all payment records for Admin
     Student/Parent can only view their own/own children's payment records
@@ -856,18 +883,17 @@ class PaymentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         Restrict students and parents to view of their own/their children's payment records
         '''
         user = self.request.user
+        # Relations shown in the list, joined in the same query
+        payments = Payment.objects.select_related('invoice')
 
-        # For students
-        if is_student(user):
-            return Payment.objects.filter(invoice__student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Payment.objects.filter(invoice__student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return payments.filter(invoice__student__in=StudentAccess.student_ids(user))
         # For admin
         else:
-            return Payment.objects.all()
+            return payments.all()
 
-class PaymentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class PaymentDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific payment
     Admin can view all payments
@@ -893,12 +919,9 @@ class PaymentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Payment.objects.get(pk=pk, invoice__student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Payment.objects.get(pk=pk, invoice__student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Payment, pk=pk, invoice__student__in=StudentAccess.student_ids(user))
         # For admin
         return super().get_object()
 
@@ -938,7 +961,7 @@ class PaymentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 # Enrollment model views for CRUD operations
 # =======================================
-class EnrollmentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
+class EnrollmentListView(LoginRequiredMixin, UserPassesTestMixin, ConditionalListMixin, PaginatedListMixin, ListView):
     '''
     display all enrollment records for Admin/Teacher
     Student/Parent can only view their own/own children's enrollment records
@@ -960,18 +983,17 @@ class EnrollmentListView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         Restrict students and parents to view of their own/their children's enrollment records
         '''
         user = self.request.user
+        # Relations shown in the list, joined in the same query
+        enrollments = Enrollment.objects.select_related('grade', 'student')
 
-        # For students
-        if is_student(user):
-            return Enrollment.objects.filter(student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Enrollment.objects.filter(student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return enrollments.filter(student__in=StudentAccess.student_ids(user))
         # For teacher and admin
         else:
-            return Enrollment.objects.all()
+            return enrollments.all()
 
-class EnrollmentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class EnrollmentDetailView(LoginRequiredMixin, UserPassesTestMixin, ConditionalDetailMixin, DetailView):
     '''
     show details of a specific enrollment for a student
     Admin/Teacher can view all enrollments
@@ -996,12 +1018,9 @@ class EnrollmentDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
         user = self.request.user
         pk = self.kwargs['pk']
 
-        # For students
-        if is_student(user):
-            return Enrollment.objects.get(pk=pk, student__user=user)
-        # For parents
-        elif is_parent(user):
-            return Enrollment.objects.get(pk=pk, student__parents__parent__user=user)
+        # For students and parents, through their StudentAccess rows
+        if is_student(user) or is_parent(user):
+            return get_object_or_404(Enrollment, pk=pk, student__in=StudentAccess.student_ids(user))
         # For admin and teachers
         return super().get_object()
 
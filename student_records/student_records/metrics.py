@@ -0,0 +1,237 @@
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from .profiling import current_profile, resolved_role
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', 'Requests handled', ('route', 'role', 'method', 'status'), None),
+    'http_request_duration_seconds': ('histogram', 'Request latency', ('route', 'role'),
+                                      (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)),
+    'http_request_db_queries': ('histogram', 'Database queries per request', ('route',),
+                                (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)),
+    'http_response_size_bytes': ('histogram', 'Response body size, streamed responses excluded', ('route',),
+                                 (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)),
+    'auth_login_failures_total': ('counter', 'Rejected /api/login/ attempts', ('status',), None),
+}
+
+
+class MetricStore:
+    '''
+    Metrics of this process, flushed to a file of its own in METRICS_DIR at most every
+    METRICS_FLUSH_INTERVAL seconds and at exit. The /metrics view adds up the files of every
+    process, gunicorn workers included, so counters and histograms stay correct across workers.
+    The file of a process that has exited is merged into the file of the process collecting,
+    so recycled workers keep their totals without one file per worker ever started
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        self.pid = os.getpid()
+        self.file_name = f'metrics-{self.pid}-{uuid.uuid4().hex[:8]}.json'
+
+    def directory(self):
+        return getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'student_records_metrics')
+
+    def inc(self, name, labels, amount=1):
+        key = json.dumps([name, labels])
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self.dirty = True
+        self.maybe_flush()
+
+    def reset(self):
+        '''Drops the metrics of this process that were not flushed yet'''
+        with self.lock:
+            self.values = {}
+            self.dirty = False
+
+    def observe(self, name, labels, value):
+        '''Adds value to the cumulative buckets, sum and count of a histogram'''
+        buckets = METRICS[name][3]
+        key = json.dumps([name, labels])
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+            self.dirty = True
+        self.maybe_flush()
+
+    def maybe_flush(self):
+        if time.monotonic() - self.last_flush >= getattr(settings, 'METRICS_FLUSH_INTERVAL', 5):
+            self.flush()
+
+    def flush(self):
+        '''Writes this process's metrics file, atomically so a scrape never reads half a file'''
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.values)
+            self.dirty = False
+            self.last_flush = time.monotonic()
+        directory = self.directory()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, self.file_name)
+        with open(path + '.tmp', 'w') as output:
+            output.write(data)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        '''The metrics of every process, added up'''
+        self.merge_exited()
+        self.flush()
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory(), 'metrics-*.json')):
+            try:
+                with open(path) as metrics_file:
+                    values = json.load(metrics_file)
+            except (OSError, ValueError):
+                continue
+            add_values(totals, values)
+        return totals
+
+    def merge_exited(self):
+        '''Adds the files of processes that have exited to this process's metrics, and removes them'''
+        for path in glob.glob(os.path.join(self.directory(), 'metrics-*.json')):
+            pid = file_pid(path)
+            if pid is None or pid == self.pid or process_alive(pid):
+                continue
+            # The rename claims the file: a process collecting at the same time skips it
+            claimed = f'{path}.{self.pid}.merging'
+            try:
+                os.rename(path, claimed)
+                with open(claimed) as metrics_file:
+                    values = json.load(metrics_file)
+            except (OSError, ValueError):
+                continue
+            with self.lock:
+                add_values(self.values, values)
+                self.dirty = True
+            self.flush()
+            os.remove(claimed)
+
+
+def add_values(totals, values):
+    '''Adds the counters and histogram series of values to totals'''
+    for key, value in values.items():
+        if isinstance(value, list):
+            current = totals.setdefault(key, [0] * len(value))
+            for i, item in enumerate(value):
+                current[i] += item
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def file_pid(path):
+    '''The pid in a metrics-<pid>-<id>.json file name, None for any other name'''
+    try:
+        return int(os.path.basename(path).split('-')[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, under another user
+        return True
+    return True
+
+
+store = MetricStore()
+atexit.register(store.flush)
+
+
+def label_text(names, labels, extra=()):
+    pairs = list(zip(names, labels)) + list(extra)
+    escaped = [(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def render(totals):
+    '''Prometheus text exposition format 0.0.4'''
+    series = {}
+    for key, value in totals.items():
+        name, labels = json.loads(key)
+        series.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, label_names, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series.get(name, [])):
+            if kind == 'counter':
+                lines.append(f'{name}{label_text(label_names, labels)} {value}')
+                continue
+            for bound, count in zip(buckets, value):
+                lines.append(f'{name}_bucket{label_text(label_names, labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{label_text(label_names, labels, [("le", "+Inf")])} {value[-1]}')
+            lines.append(f'{name}_sum{label_text(label_names, labels)} {value[-2]}')
+            lines.append(f'{name}_count{label_text(label_names, labels)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    '''
+    GET /metrics for Prometheus, behind "Authorization: Bearer <METRICS_TOKEN>". Without the
+    setting it is only served with DEBUG on
+    '''
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        return HttpResponseForbidden()
+    return HttpResponse(render(store.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MetricsMiddleware:
+    '''
+    Records every request in the metric store: count and latency by URL name and role, query
+    count (from ProfilingMiddleware, which must come before this one), response size and failed
+    logins. Requests to /metrics itself are not recorded
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        if route == 'metrics':
+            return response
+        # 'none' when the view never needed the role
+        role = resolved_role(request) or 'none'
+        store.inc('http_requests_total', [route, role, request.method, str(response.status_code)])
+        store.observe('http_request_duration_seconds', [route, role], elapsed)
+        profile = current_profile()
+        if profile is not None:
+            store.observe('http_request_db_queries', [route], profile.queries)
+        if not response.streaming:
+            store.observe('http_response_size_bytes', [route], len(response.content))
+        if route == 'token_login' and request.method == 'POST' and response.status_code >= 400:
+            store.inc('auth_login_failures_total', [str(response.status_code)])
+        return response
@@ -0,0 +1,105 @@
+import logging
+import os
+import re
+import sys
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('student_records.nplusone')
+
+IN_LIST = re.compile(r'\bIN \((?:%s, )*%s\)')
+SPACES = re.compile(r'\s+')
+
+
+class NPlusOneError(AssertionError):
+    '''Raised when N_PLUS_ONE_DETECTION is 'raise' and a request repeated a query per row'''
+
+
+def fingerprint(sql):
+    '''The shape of a statement: the parameters are already placeholders, IN lists of any length match'''
+    return IN_LIST.sub('IN (...)', SPACES.sub(' ', sql)).strip()
+
+
+def call_site(frame):
+    '''
+    Where a query comes from, searched from the innermost frame out: the template line
+    ({{ attendance.student }}), the serializer field, or else the first line of project code
+    '''
+    root = str(settings.BASE_DIR)
+    while frame is not None:
+        code = frame.f_code
+        node = frame.f_locals.get('self') if code.co_name == 'render_annotated' else None
+        if node is not None and getattr(node, 'origin', None) is not None and getattr(node, 'token', None) is not None:
+            return f'{os.path.relpath(node.origin.name, root) if node.origin.name.startswith(root) else node.origin.name}:{node.token.lineno}'
+        if code.co_name == 'to_representation' and 'field' in frame.f_locals and code.co_filename.endswith(os.path.join('rest_framework', 'serializers.py')):
+            return f'{type(frame.f_locals["self"]).__name__}.{frame.f_locals["field"].field_name}'
+        filename = code.co_filename
+        if filename.startswith(root) and 'site-packages' not in filename and filename != __file__:
+            return f'{os.path.relpath(filename, root)}:{frame.f_lineno}'
+        frame = frame.f_back
+    return 'unknown'
+
+
+class NPlusOneDetector:
+    '''
+    execute_wrapper counting statements by (shape, call site). A shape repeated threshold times
+    or more from the same call site is reported: a relation loaded lazily once per row
+    '''
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold or getattr(settings, 'N_PLUS_ONE_THRESHOLD', 5)
+        self.counts = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # Start above Django's wrapper chain, other execute_wrappers (profiling) are not the origin
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_name != '_execute_with_wrappers':
+            frame = frame.f_back
+        key = (fingerprint(sql), call_site(frame or sys._getframe(1)))
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return execute(sql, params, many, context)
+
+    def findings(self):
+        '''[(count, call site, statement)] of the repeated statements, most repeated first'''
+        return sorted(((count, site, sql) for (sql, site), count in self.counts.items() if count >= self.threshold), reverse=True)
+
+    def report(self, label=''):
+        findings = self.findings()
+        lines = [f'N+1 queries{f" in {label}" if label else ""}:']
+        lines += [f'  {count}x from {site}: {sql[:200]}' for count, site, sql in findings]
+        return '\n'.join(lines)
+
+
+@contextmanager
+def detect_n_plus_one(label='', threshold=None, raise_error=True):
+    '''
+    Watches the queries run in the block, e.g. in a test around client.get() or serializer.data,
+    and raises NPlusOneError (or logs a warning) if any statement was repeated per row
+    '''
+    detector = NPlusOneDetector(threshold)
+    with connections['default'].execute_wrapper(detector):
+        yield detector
+    if detector.findings():
+        if raise_error:
+            raise NPlusOneError(detector.report(label))
+        logger.warning(detector.report(label))
+
+
+class NPlusOneMiddleware:
+    '''
+    Runs every request under detect_n_plus_one when N_PLUS_ONE_DETECTION is 'log' (development)
+    or 'raise' (tests). Not loaded at all when it is 'off', the production setting
+    '''
+
+    def __init__(self, get_response):
+        self.mode = getattr(settings, 'N_PLUS_ONE_DETECTION', 'off')
+        if self.mode not in ('log', 'raise'):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with detect_n_plus_one(f'{request.method} {request.path}', raise_error=self.mode == 'raise'):
+            return self.get_response(request)
@@ -0,0 +1,134 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('student_records.profiling')
+
+_current = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    '''Time spent in each part of one request, in seconds, and its query count'''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings = {'db': 0.0, 'serialize': 0.0, 'render': 0.0}
+        self.queries = 0
+        self.depth = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        '''connection.execute_wrapper adding up the queries of the request'''
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings['db'] += time.perf_counter() - start
+            self.queries += 1
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+
+def current_profile():
+    '''The RequestProfile of the request being handled, None outside ProfilingMiddleware'''
+    return _current.get()
+
+
+@contextmanager
+def profiled(name):
+    '''
+    Adds the time spent in the block to the current request's name timing.
+    Nested blocks of the same name (e.g. nested serializers) are only counted once
+    '''
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    depth = profile.depth.get(name, 0)
+    profile.depth[name] = depth + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.depth[name] = depth
+        if not depth:
+            profile.timings[name] = profile.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def resolved_role(request):
+    '''The role of the request's user if it was already resolved, never queries'''
+    user = getattr(request, 'user', None)
+    # A session user that was never loaded is still an empty SimpleLazyObject
+    user = getattr(user, '_wrapped', user)
+    return getattr(user, '_role', None) or None
+
+
+class ProfilingMiddleware:
+    '''
+    Measures every request: total time, DB time and query count (execute_wrapper on every
+    connection), template render time (TemplateResponse) and DRF serialization time
+    (RecordSerializer.to_representation). They are sent as a Server-Timing header, shown in
+    the browser devtools, and logged as one JSON line on 'student_records.profiling' for a
+    REQUEST_PROFILING_SAMPLE_RATE fraction of requests.
+    Queries run while a streamed response is sent are not included
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.header = getattr(settings, 'REQUEST_PROFILING_HEADER', True)
+        self.sample_rate = getattr(settings, 'REQUEST_PROFILING_SAMPLE_RATE', 0.0)
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+
+        total = profile.total()
+        if self.header:
+            response['Server-Timing'] = self.server_timing(profile, total)
+        if self.sample_rate and random.random() < self.sample_rate:
+            logger.info(self.log_line(request, response, profile, total))
+        return response
+
+    def process_template_response(self, request, response):
+        '''Times the render that follows, up to the post-render callbacks'''
+        profile = _current.get()
+        if profile is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                profile.timings['render'] += time.perf_counter() - start
+            response.add_post_render_callback(rendered)
+        return response
+
+    def server_timing(self, profile, total):
+        metrics = [f'db;dur={profile.timings["db"] * 1000:.1f};desc="{profile.queries} queries"']
+        metrics += [f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in profile.timings.items() if name != 'db' and elapsed]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def log_line(self, request, response, profile, total):
+        match = request.resolver_match
+        line = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'role': resolved_role(request),
+            'queries': profile.queries,
+            'total_ms': round(total * 1000, 2),
+        }
+        line.update({f'{name}_ms': round(elapsed * 1000, 2) for name, elapsed in profile.timings.items()})
+        return json.dumps(line)
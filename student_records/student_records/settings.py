@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+from datetime import timedelta
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its total covers every other middleware
+    'student_records.profiling.ProfilingMiddleware',
+    'student_records.metrics.MetricsMiddleware',
+    'student_records.nplusone.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +91,26 @@ DATABASES = {
     }
 }
 
+# records/cache.py: a per-process tier and a tier shared by every worker of the host,
+# which also keeps the model version stamps. Clear CACHE_DIR when restoring the database
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'student_records',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CACHE_DIR', '/tmp/student_records_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+RECORDS_CACHE_TIMEOUT = 3600
+# Tests and the benchmark command keep the shared tier in a temporary directory of their own
+TEST_RUNNER = 'student_records.testing.IsolatedTestRunner'
+# Paginated lists above this many rows show cached or estimated counts (records/pagination.py)
+RECORDS_EXACT_COUNT_LIMIT = 10000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -141,11 +166,60 @@ AUTHENTICATION_BACKENDS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.StatelessJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # Keyset pagination: viewsets override pagination_class with their own ordering
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_FILTER_BACKENDS': [
+        'api.filters.ParentLookupFilter',
+        'api.filters.DeclaredFilterBackend',
+    ],
+}
+
+SIMPLE_JWT = {
+    # Short lived access tokens carrying the role/profile claims read by api.authentication
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=5),
+    'TOKEN_USER_CLASS': 'api.authentication.RecordsTokenUser',
+    'TOKEN_OBTAIN_SERIALIZER': 'api.serializers.RoleTokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'api.serializers.RoleTokenRefreshSerializer',
+}
+
+# Seconds a worker keeps a user's role and role version (records/roles.py). A role change made in another worker
+# reaches this one within ROLE_CACHE_TTL: until then that worker still accepts the user's
+# older tokens (api/authentication.py check_role_version)
+ROLE_CACHE_TTL = 60
+
+# student_records/profiling.py: Server-Timing header on every response, and the fraction
+# of requests logged as a JSON line on the 'student_records.profiling' logger
+REQUEST_PROFILING_HEADER = True
+REQUEST_PROFILING_SAMPLE_RATE = 0.01
+
+# student_records/metrics.py: per-process metric files added up by /metrics, the directory
+# must be shared by all gunicorn workers; files of exited processes are merged by the next scrape
+METRICS_DIR = os.environ.get('METRICS_DIR', '/tmp/student_records_metrics')
+METRICS_FLUSH_INTERVAL = 5
+# /metrics requires "Authorization: Bearer <token>", and is only served without it when DEBUG is on
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# student_records/nplusone.py: 'log' or 'raise' on a statement repeated N_PLUS_ONE_THRESHOLD
+# times from one call site in a request, 'off' (middleware not loaded) in production
+N_PLUS_ONE_DETECTION = 'log' if DEBUG else 'off'
+N_PLUS_ONE_THRESHOLD = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'student_records.profiling': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'student_records.nplusone': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
 }
 
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
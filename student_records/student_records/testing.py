@@ -0,0 +1,41 @@
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from . import metrics
+
+
+@contextmanager
+def isolated_storage():
+    '''
+    Points the shared records cache tier and METRICS_DIR at a temporary directory of their own
+    for the duration, so a test run or a benchmark on a host that also serves traffic never
+    reads, writes or clears the cache and version stamps of the real database, nor adds its
+    requests to the metrics /metrics serves
+    '''
+    directory = tempfile.mkdtemp(prefix='student_records_')
+    caches = {name: dict(options) for name, options in settings.CACHES.items()}
+    caches['shared']['LOCATION'] = f'{directory}/cache'
+    try:
+        with override_settings(CACHES=caches, RECORDS_CACHE_ISOLATED=True, METRICS_DIR=f'{directory}/metrics'):
+            yield directory
+    finally:
+        # Nothing measured meanwhile is flushed to the real METRICS_DIR at exit
+        metrics.store.reset()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class IsolatedTestRunner(DiscoverRunner):
+    '''DiscoverRunner whose whole run, test databases included, uses isolated_storage()'''
+
+    def setup_test_environment(self, **kwargs):
+        self.storage = isolated_storage()
+        self.storage.__enter__()
+        super().setup_test_environment(**kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        super().teardown_test_environment(**kwargs)
+        self.storage.__exit__(None, None, None)
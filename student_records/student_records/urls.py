@@ -16,10 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('records/', include('records.urls')),
     path('api/', include('api.urls')),
     path('accounts/', include('accounts.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]